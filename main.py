@@ -2,7 +2,7 @@ import pygame
 import os
 import ctypes
 import random
-from PIL import Image, ImageSequence
+from PIL import Image, ImageSequence, ImageChops
 import webbrowser
 import json
 import requests
@@ -11,6 +11,19 @@ import importlib.util
 import sys
 import subprocess
 import platform
+import hashlib
+import mmap
+import threading
+import shutil
+import tempfile
+import queue
+import weakref
+import io
+import tracemalloc
+import bisect
+from collections import OrderedDict
+from itertools import accumulate
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     ctypes.windll.user32.SetProcessDPIAware()
@@ -21,9 +34,15 @@ pygame.init()
 pygame.mixer.quit()
 pygame.mixer.init(frequency=44100, size=-16, channels=2, buffer=512)
 
+# Служебные команды (бенчмарки и т.п.) запускаются без полноэкранного окна
+TOOL_COMMANDS = ["--bench-gif", "--mem-report", "--bake", "--format-report", "--trace-alloc", "--bench-deltas", "--self-test"]
+tool_command = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] in TOOL_COMMANDS else None
+
 info = pygame.display.Info()
-WIN_W, WIN_H = info.current_w, info.current_h
-screen = pygame.display.set_mode((WIN_W, WIN_H), pygame.FULLSCREEN)
+DESKTOP_SIZE = (info.current_w, info.current_h)
+WIN_W, WIN_H = DESKTOP_SIZE
+# Настоящее окно создается в set_display_mode(), когда прочитаны настройки
+screen = display = pygame.display.set_mode((1, 1), pygame.HIDDEN)
 pygame.display.set_caption("Five Nights at Freddy's 2")
 
 base_path = os.path.dirname(os.path.abspath(__file__))
@@ -31,21 +50,90 @@ images_path = os.path.join(base_path, "images")
 sounds_path = os.path.join(base_path, "sounds")
 
 OFFICE_SCALE = 1.25
-office_size = (int(WIN_W * OFFICE_SCALE), WIN_H)
+
+def resolve_size(size, resolution=None):
+    # Размеры ресурсов задаются относительно экрана ("screen", "office", "map"),
+    # чтобы их можно было пересчитать под любое разрешение
+    w, h = resolution or (WIN_W, WIN_H)
+    if size == "screen":
+        return (w, h)
+    if size == "office":
+        return (int(w * OFFICE_SCALE), h)
+    if size == "map":
+        return (w // 2, h)
+    if size == "hud_button":
+        # Кнопки монитора и маски - по 650 px, но на узком экране обе должны поместиться рядом
+        return (min(650, w // 2 - 60), 40)
+    if size == "ui":
+        return ui_size(*resolution) if resolution else (UI_W, UI_H)
+    return size
+
+# Меню, настройки и прочие экраны интерфейса сверстаны под 1920x1080. На окне меньше этого
+# они рисуются на логическом холсте ui_screen не меньше этого размера и ужимаются до окна,
+# а не обрезаются. render_scale к ним не применяется: раскладка в пикселях 1920x1080 на меньшем
+# холсте не поместится. На окне от 1920x1080 ui_screen - само окно, без сжатия; на меньшем
+# сжатие идет только в кадрах, где холст изменился (present_frame)
+UI_MIN_SIZE = (1920, 1080)
+UI_STATES = ("MENU", "SETTINGS", "CUSTOM", "MODS", "BUG_REPORT", "GAMEOVER")
+
+def ui_size(w, h):
+    factor = max(1.0, UI_MIN_SIZE[0] / w, UI_MIN_SIZE[1] / h)
+    return int(w * factor), int(h * factor)
+
+UI_W, UI_H = ui_size(WIN_W, WIN_H)
 
 os.makedirs(images_path, exist_ok=True)
 os.makedirs(sounds_path, exist_ok=True)
 
-font_clock = pygame.font.SysFont("OCR A Extended", 40)
-font_dev = pygame.font.SysFont("Consolas", 18)
-font_main = pygame.font.SysFont("Arial", 100, bold=True)
-font_title = pygame.font.SysFont("Arial", 50, bold=True)
-font_button = pygame.font.SysFont("Arial", 30, bold=True)
-font_bug_report = pygame.font.SysFont("Arial", 20)
-font_bug_input = pygame.font.SysFont("Arial", 18)
-font_mods = pygame.font.SysFont("Arial", 24)
-font_mods_warning = pygame.font.SysFont("Arial", 16, bold=True)
-font_mods_tab = pygame.font.SysFont("Arial", 20, bold=True)
+class FontRegistry:
+    # SysFont ищет шрифт в системе и грузит его - делаем это один раз на (имя, размер, жирность)
+    def __init__(self):
+        self.fonts = {}
+
+    def get(self, name, size, bold=False):
+        key = (name, size, bold)
+        if key not in self.fonts:
+            self.fonts[key] = pygame.font.SysFont(name, size, bold=bold)
+        return self.fonts[key]
+
+class TextCache:
+    # Отрендеренные строки: меню, часы, подписи камер и т.п. не меняются от кадра к кадру
+    def __init__(self, limit=512):
+        self.limit = limit
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, antialias, color):
+        key = (font, text, antialias, tuple(color))
+        surf = self.surfaces.get(key)
+        if surf is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surf
+        self.misses += 1
+        surf = font.render(text, antialias, color)
+        self.surfaces[key] = surf
+        if len(self.surfaces) > self.limit:
+            self.surfaces.popitem(last=False)
+        return surf
+
+fonts = FontRegistry()
+text_cache = TextCache()
+render_text = text_cache.render
+
+font_clock = fonts.get("OCR A Extended", 40)
+font_dev = fonts.get("Consolas", 18)
+font_main = fonts.get("Arial", 100, bold=True)
+font_title = fonts.get("Arial", 50, bold=True)
+font_button = fonts.get("Arial", 30, bold=True)
+font_bug_report = fonts.get("Arial", 20)
+font_bug_input = fonts.get("Arial", 18)
+font_mods = fonts.get("Arial", 24)
+font_mods_warning = fonts.get("Arial", 16, bold=True)
+font_mods_tab = fonts.get("Arial", 20, bold=True)
+font_cam = fonts.get("Arial", 16, bold=True)
+font_level = fonts.get("Arial", 28, bold=True)
 
 appdata_path = os.getenv('APPDATA') or os.path.expanduser('~')
 if os.name == 'nt' and not os.getenv('APPDATA'):
@@ -61,6 +149,188 @@ except:
 
 save_file = os.path.join(save_dir, "save.json")
 
+DEFAULT_SETTINGS = {
+    "palettized_animations": False,
+    "surface_budget_mb": 1536,
+    "resolution": None,
+    "fullscreen": True,
+    "render_scale": 1.0,
+    "dirty_rects": False,
+    "frame_rate": 60,
+    "idle_throttle": True,
+}
+
+RENDER_SCALES = [0.5, 0.67, 1.0]
+# Ограничение частоты кадров: число FPS, 0 - без ограничения, "vsync" - по обновлению монитора
+FRAME_RATES = [60, 120, 0, "vsync"]
+
+# Включился ли vsync при последнем set_display_mode()
+vsync_active = False
+
+def display_refresh_rate():
+    # Частота обновления монитора; если pygame ее не сообщает - 60
+    get_rates = getattr(pygame.display, "get_desktop_refresh_rates", None)
+    rates = get_rates() if get_rates else None
+    return rates[0] if rates and rates[0] > 0 else 60
+
+def frame_rate_cap():
+    # Для clock.tick: с работающим vsync кадр придерживает сам flip, без него - частота монитора
+    if settings["frame_rate"] == "vsync":
+        return 0 if vsync_active else display_refresh_rate()
+    return settings["frame_rate"] if isinstance(settings["frame_rate"], int) else 0
+
+def load_settings():
+    loaded = dict(DEFAULT_SETTINGS)
+    try:
+        with open(save_file, 'r') as f:
+            loaded.update(json.load(f).get('settings', {}))
+    except:
+        pass
+    return loaded
+
+settings = load_settings()
+
+def available_resolutions():
+    # Разрешения не больше рабочего стола; первым идет сам рабочий стол
+    modes = pygame.display.list_modes()
+    if not modes or modes == -1:
+        modes = [(1920, 1080), (1600, 900), (1366, 768), (1280, 720), (1024, 576)]
+    sizes = [DESKTOP_SIZE] + [tuple(mode) for mode in modes if mode[0] <= DESKTOP_SIZE[0] and mode[1] <= DESKTOP_SIZE[1]]
+    return list(dict.fromkeys(sizes))
+
+def set_display_mode():
+    # display - окно, screen - куда рисует игра. При render_scale < 1 это отдельная поверхность
+    # меньшего размера (WIN_W x WIN_H), которая растягивается на окно раз в кадр
+    global screen, display, ui_screen, WIN_W, WIN_H, UI_W, UI_H, vsync_active
+    size = tuple(settings["resolution"]) if settings["resolution"] else DESKTOP_SIZE
+    vsync_active = False
+    if not tool_command:
+        flags = pygame.FULLSCREEN if settings["fullscreen"] else 0
+        if settings["frame_rate"] == "vsync":
+            # vsync в pygame работает только с SCALED или OPENGL
+            try:
+                display = pygame.display.set_mode(size, flags | pygame.SCALED, vsync=1)
+                is_vsync = getattr(pygame.display, "is_vsync", None)
+                vsync_active = is_vsync() if is_vsync else True
+            except:
+                pass
+        if not vsync_active:
+            # Драйвер не дал vsync - обычное окно, кадр ограничивает clock.tick(частота монитора)
+            display = pygame.display.set_mode(size, flags)
+        # Драйвер может не дать запрошенный размер - раскладка строится по фактическому
+        size = display.get_size()
+    scale = settings["render_scale"]
+    WIN_W, WIN_H = max(1, int(size[0] * scale)), max(1, int(size[1] * scale))
+    if tool_command or (WIN_W, WIN_H) == display.get_size():
+        screen = display
+    else:
+        screen = pygame.Surface((WIN_W, WIN_H)).convert()
+    dirty_renderer.invalidate()
+    UI_W, UI_H = ui_size(*size)
+    if tool_command or (UI_W, UI_H) == display.get_size():
+        ui_screen = display
+    else:
+        ui_screen = pygame.Surface((UI_W, UI_H)).convert()
+
+class DirtyRenderer:
+    # Что вывести на экран, сообщает сам рисующий код - кадр с прошлым не сравнивается.
+    # scene(...) - все статичное, что кадр нарисовал (комната, смещение панорамы, кнопки, час...):
+    # набор сменился - кадр выводится целиком. mark(rect) - то, что кадр перерисовал поверх
+    # статичного (анимации, меняющийся текст). Кадр без scene() всегда выводится целиком,
+    # как и кадр, где отмечено больше FULL_RATIO экрана (смена камеры, скример)
+    FULL_RATIO = 0.5
+
+    def __init__(self):
+        self.key = None
+        self.frame_key = None
+        self.rects = []
+        self.invalid = True
+        self.pixels_pushed = 0
+
+    def scene(self, *parts):
+        # Дописывает к ключу кадра очередную статичную часть
+        self.frame_key = (self.frame_key or ()) + (parts,)
+
+    def mark(self, rect):
+        if rect is not None and rect.width and rect.height:
+            self.rects.append(pygame.Rect(rect))
+
+    def invalidate(self):
+        # Окно перерисовано системой или создано заново - следующий кадр выводится целиком
+        self.invalid = True
+
+    def changed_rects(self, surface):
+        # -> [Rect, ...] в координатах surface или None, если нужен полный flip. Сбрасывает отметки кадра
+        key, rects = self.frame_key, self.rects
+        full = self.invalid or key is None or key != self.key
+        self.key, self.frame_key, self.rects, self.invalid = key, None, [], False
+        if full:
+            return None
+        w, h = surface.get_size()
+        rects = [rect.clip(surface.get_rect()) for rect in rects]
+        if sum(rect.width * rect.height for rect in rects) > self.FULL_RATIO * w * h:
+            return None
+        return rects
+
+dirty_renderer = DirtyRenderer()
+
+def present_frame(ui=False):
+    # Экраны интерфейса рисуются на ui_screen, игра - на screen; отметки DirtyRenderer - в пикселях холста
+    target = ui_screen if ui else screen
+    rects = dirty_renderer.changed_rects(target)
+    # Холст с прошлого кадра не менялся (rects == []) - в окне уже лежит его сжатая копия. Экраны интерфейса
+    # полностью описаны scene(), поэтому для них это верно всегда, для игры - в режиме dirty_rects
+    unchanged = rects == [] and (ui or settings["dirty_rects"])
+    if target is not display and not unchanged:
+        # Холст целиком сжимается до окна: интерфейс сглаженно, игра - быстрым scale
+        (pygame.transform.smoothscale if ui else pygame.transform.scale)(target, display.get_size(), display)
+    if rects is None or not settings["dirty_rects"]:
+        pygame.display.flip()
+        dirty_renderer.pixels_pushed = display.get_width() * display.get_height()
+        return
+    if target is not display:
+        # Прямоугольники из пикселей холста в пиксели окна (с запасом на округление)
+        sx, sy = display.get_width() / target.get_width(), display.get_height() / target.get_height()
+        rects = [pygame.Rect(int(r.x * sx) - 1, int(r.y * sy) - 1, int(r.width * sx) + 3, int(r.height * sy) + 3).clip(display.get_rect())
+                 for r in rects]
+    if rects:
+        pygame.display.update(rects)
+    dirty_renderer.pixels_pushed = sum(rect.width * rect.height for rect in rects)
+
+def get_mouse_pos(ui=False):
+    # Координаты мыши в пикселях screen (с учетом render_scale), для экранов интерфейса - в пикселях ui_screen
+    x, y = pygame.mouse.get_pos()
+    w, h = (UI_W, UI_H) if ui else (WIN_W, WIN_H)
+    display_w, display_h = display.get_size()
+    return x * w // display_w, y * h // display_h
+
+class SurfacePool:
+    # Служебные поверхности (подложки, затемнение) создаются один раз на (размер, флаги, заливка)
+    # и переиспользуются каждый кадр, а не выделяются заново под разрешение экрана
+    def __init__(self):
+        self.surfaces = {}
+        self.created = 0
+
+    def get(self, size, flags=0, fill=None):
+        # fill задан - поверхность уже залита им; иначе содержимое остается от прошлого кадра
+        key = (tuple(size), flags, fill)
+        surf = self.surfaces.get(key)
+        if surf is None:
+            surf = pygame.Surface(size, flags)
+            surf = surf.convert_alpha() if flags & pygame.SRCALPHA else surf.convert()
+            if fill is not None:
+                surf.fill(fill)
+            self.surfaces[key] = surf
+            self.created += 1
+        return surf
+
+    def clear(self):
+        self.surfaces.clear()
+
+surface_pool = SurfacePool()
+
+set_display_mode()
+
 available_mods = []
 installed_mod = None
 active_mod = None
@@ -128,36 +398,978 @@ def open_mods_folder():
     except:
         pass
 
-def load_img(name, target_size=(WIN_W, WIN_H)):
-    path = os.path.join(images_path, name)
-    try:
-        img = pygame.image.load(path).convert_alpha()
-        return pygame.transform.scale(img, target_size)
-    except:
-        surf = pygame.Surface(target_size, pygame.SRCALPHA)
-        surf.fill((30, 30, 30))
+def source_hash(src_path, known=None):
+    # -> [mtime_ns, размер, sha1] исходника. known - прошлая отметка того же файла:
+    # если mtime и размер не менялись, файл не перечитывается и возвращается known
+    st = os.stat(src_path)
+    if known and known[0] == st.st_mtime_ns and known[1] == st.st_size:
+        return known
+    digest = hashlib.sha1()
+    with open(src_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return [st.st_mtime_ns, st.st_size, digest.hexdigest()]
+
+def frames_from_buffer(view, header, fmt):
+    # Кадры лежат подряд сырыми пикселями; поверхности ссылаются на view без копирования
+    size = (header['w'], header['h'])
+    frame_bytes = size[0] * size[1] * len(fmt)
+    digests = header.get('digests') or [None] * len(header['durations'])
+    frames = []
+    for i, duration in enumerate(header['durations']):
+        surf = pygame.image.frombuffer(view[i * frame_bytes:(i + 1) * frame_bytes], size, fmt)
+        if 'palette' in header:
+            surf.set_palette(header['palette'])
+        if header.get('colorkey') is not None:
+            surf.set_colorkey(header['colorkey'])
+        frames.append((surf, duration, bytes.fromhex(digests[i]) if digests[i] else None))
+    return frames
+
+class AssetPack:
+    # Все ресурсы в одном файле: заголовок-индекс (имя -> смещение, размер, размеры, формат)
+    # и за ним сырые пиксели уже отмасштабированных картинок и байты звуков. Читается через mmap
+    MAGIC = b"FNPK"
+
+    def __init__(self, path):
+        self.path = path
+        self.index = {}
+        self.image_files = set()
+        self.hashes = {}  # путь исходника -> отметка source_hash, чтобы не перечитывать файл
+        self.view = None
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if mm[:4] == self.MAGIC:
+                header_len = int.from_bytes(mm[4:8], 'little')
+                self.index = json.loads(mm[8:8 + header_len])
+                self.view = memoryview(mm)[8 + header_len:]
+                self.image_files = {name.split(':')[1] for name in self.index if name.startswith('images:')}
+        except:
+            self.index = {}
+
+    @staticmethod
+    def image_name(filename, target_size, fmt="RGBA", variant=""):
+        return f"images:{filename}:{target_size[0]}x{target_size[1]}:{fmt}:{variant}"
+
+    @staticmethod
+    def source_stamp(path):
+        # Отметка исходника при запекании: mtime, размер и хеш содержимого
+        return source_hash(path)
+
+    def _fresh(self, entry, path):
+        # Исходник поменяли после запекания - запись устарела, грузится файл из images/ или sounds/.
+        # Исходника нет (раздается только архив) или архив старый, без отметки - верим архиву.
+        # mtime меняется и от простого копирования, поэтому при несовпадении сверяется хеш
+        source = entry.get('source')
+        if not source:
+            return True
+        try:
+            st = os.stat(path)
+        except OSError:
+            return True
+        if [st.st_mtime_ns, st.st_size] == source[:2]:
+            return True
+        try:
+            if st.st_size != source[1]:
+                return False
+            self.hashes[path] = source_hash(path, self.hashes.get(path))
+            return self.hashes[path][2] == source[2]
+        except OSError:
+            return True
+
+    def _entry_view(self, entry):
+        return self.view[entry['offset']:entry['offset'] + entry['size']]
+
+    def frames(self, filename, target_size, fmt="RGBA", variant=""):
+        # -> [(surface, duration, digest), ...] или None, если такого размера нет в архиве или он устарел
+        entry = self.index.get(self.image_name(filename, target_size, fmt, variant))
+        if not entry or not self._fresh(entry, os.path.join(images_path, filename)):
+            return None
+        return frames_from_buffer(self._entry_view(entry), entry, fmt)
+
+    def sound(self, filename):
+        entry = self.index.get(f"sounds:{filename}")
+        if not entry or not self._fresh(entry, os.path.join(sounds_path, filename)):
+            return None
+        return self._entry_view(entry)
+
+    def has_image(self, filename):
+        return filename in self.image_files
+
+asset_pack = AssetPack(os.path.join(base_path, "assets.pak"))
+
+class SurfaceCache:
+    # Уже отмасштабированные пиксели на диске: ключ - хеш исходника, размер и формат.
+    # Изменился файл в images/ - изменился хеш, старая запись удаляется при сохранении новой.
+    MAGIC = b"FNSC"
+
+    def __init__(self, path, limit_bytes):
+        self.path = path
+        self.limit_bytes = limit_bytes
+        self.lock = threading.Lock()
+        self.hashes = {}
+        self.index_dirty = False
+        self.enabled = True
+        # Отображенные записи: пока поверхности ссылаются на mmap, файл на Windows не удалить.
+        # Такие записи откладываются в stale и удаляются при следующем сохранении
+        self.mapped = weakref.WeakValueDictionary()
+        self.stale = set()
+        try:
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, "index.json"), 'r') as f:
+                self.hashes = json.load(f)
+        except FileNotFoundError:
+            pass
+        except:
+            self.enabled = os.path.isdir(path)
+        self.total_bytes = sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        entries = []
+        try:
+            for filename in os.listdir(self.path):
+                if filename.endswith('.surf'):
+                    st = os.stat(os.path.join(self.path, filename))
+                    entries.append((st.st_mtime, st.st_size, filename))
+        except:
+            pass
+        return entries
+
+    def _source_hash(self, src_path):
+        with self.lock:
+            known = self.hashes.get(src_path)
+        stamp = source_hash(src_path, known)
+        if stamp is not known:
+            with self.lock:
+                self.hashes[src_path] = stamp
+                self.index_dirty = True
+        return stamp[2]
+
+    def _prefix(self, src_path, target_size, fmt, variant):
+        stem = os.path.splitext(os.path.basename(src_path))[0]
+        return f"{stem}-{target_size[0]}x{target_size[1]}-{fmt}-{variant}-"
+
+    def _entry_name(self, src_path, target_size, fmt, variant):
+        return self._prefix(src_path, target_size, fmt, variant) + self._source_hash(src_path)[:16] + ".surf"
+
+    def load(self, src_path, target_size, fmt="RGBA", variant=""):
+        # -> [(surface, duration), ...] поверх mmap или None
+        if not self.enabled:
+            return None
+        try:
+            name = self._entry_name(src_path, target_size, fmt, variant)
+            entry = os.path.join(self.path, name)
+            with open(entry, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            return None
+        try:
+            if mm[:4] != self.MAGIC:
+                mm.close()
+                return None
+            header_len = int.from_bytes(mm[4:8], 'little')
+            header = json.loads(mm[8:8 + header_len])
+            frames = frames_from_buffer(memoryview(mm)[8 + header_len:], header, fmt)
+            with self.lock:
+                self.mapped[name] = mm
+            os.utime(entry)
+            return [(surf, duration) for surf, duration, _ in frames]
+        except:
+            return None
+
+    def store(self, src_path, target_size, frames, fmt="RGBA", variant=""):
+        if not frames:
+            return
+        writer = self.writer(src_path, target_size, fmt, variant)
+        for surf, duration in frames:
+            writer.add(surf, duration)
+        writer.commit()
+
+    def writer(self, src_path, target_size, fmt="RGBA", variant=""):
+        return SurfaceCacheWriter(self, src_path, target_size, fmt, variant)
+
+    def _commit(self, writer):
+        # Пиксели уже лежат во временном файле, длительности кадров известны только в конце
+        try:
+            prefix = self._prefix(writer.src_path, writer.target_size, writer.fmt, writer.variant)
+            name = self._entry_name(writer.src_path, writer.target_size, writer.fmt, writer.variant)
+            header = json.dumps(dict(writer.meta, w=writer.target_size[0], h=writer.target_size[1],
+                                     durations=writer.durations)).encode()
+            tmp_path = os.path.join(self.path, name + f".{threading.get_ident()}.tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(self.MAGIC + len(header).to_bytes(4, 'little') + header)
+                writer.data.seek(0)
+                shutil.copyfileobj(writer.data, f)
+            entry = os.path.join(self.path, name)
+            with self.lock:
+                # Запись с тем же именем заменяется целиком - ее размер больше не учитывается
+                old_size = os.path.getsize(entry) if os.path.exists(entry) else 0
+                if not self._release(name):
+                    os.remove(tmp_path)
+                    return
+                try:
+                    os.replace(tmp_path, entry)
+                except OSError:
+                    os.remove(tmp_path)
+                    return
+                self.stale.discard(name)
+                self.total_bytes += os.path.getsize(entry) - old_size
+                for filename in list(self.stale):
+                    self._remove(filename)
+                for filename in os.listdir(self.path):
+                    if filename.startswith(prefix) and filename != name and filename.endswith('.surf'):
+                        self._remove(filename)
+                if self.total_bytes > self.limit_bytes:
+                    self._evict()
+        except:
+            pass
+
+    def _release(self, filename):
+        # Закрывает mmap записи перед удалением/заменой файла. False - поверхности из него еще живы
+        mm = self.mapped.get(filename)
+        if mm is None:
+            return True
+        try:
+            mm.close()
+        except BufferError:
+            return False
+        self.mapped.pop(filename, None)
+        return True
+
+    def _remove(self, filename):
+        filepath = os.path.join(self.path, filename)
+        try:
+            size = os.path.getsize(filepath)
+        except OSError:
+            self.stale.discard(filename)
+            return
+        if not self._release(filename):
+            self.stale.add(filename)
+            return
+        try:
+            os.remove(filepath)
+        except OSError:
+            self.stale.add(filename)
+            return
+        self.stale.discard(filename)
+        self.total_bytes -= size
+
+    def _evict(self):
+        # Самые давно читавшиеся записи удаляются, пока кэш не влезет в лимит
+        for _, _, filename in sorted(self._entries()):
+            if self.total_bytes <= self.limit_bytes:
+                break
+            self._remove(filename)
+
+    def save_index(self):
+        if not self.enabled:
+            return
+        with self.lock:
+            for filename in list(self.stale):
+                self._remove(filename)
+        if not self.index_dirty:
+            return
+        try:
+            with self.lock:
+                data = json.dumps(self.hashes)
+                self.index_dirty = False
+            with open(os.path.join(self.path, "index.json"), 'w') as f:
+                f.write(data)
+        except:
+            pass
+
+class SurfaceCacheWriter:
+    def __init__(self, cache, src_path, target_size, fmt, variant):
+        self.cache = cache
+        self.src_path = src_path
+        self.target_size = target_size
+        self.fmt = fmt
+        self.variant = variant
+        self.durations = []
+        self.meta = {}
+        self.data = tempfile.TemporaryFile() if cache.enabled else None
+
+    def add(self, surf, duration):
+        if self.data:
+            if self.fmt == "P" and not self.durations:
+                self.meta['palette'] = [list(color)[:3] for color in surf.get_palette()]
+                self.meta['colorkey'] = TRANSPARENT_INDEX if surf.get_colorkey() is not None else None
+            self.data.write(pygame.image.tostring(surf, self.fmt))
+            self.durations.append(duration)
+
+    def commit(self):
+        if self.data:
+            if self.durations:
+                self.cache._commit(self)
+            self.data.close()
+            self.data = None
+
+    def discard(self):
+        if self.data:
+            self.data.close()
+            self.data = None
+
+SURFACE_CACHE_LIMIT = 1024 * 1024 * 1024
+surface_cache = SurfaceCache(os.path.join(save_dir, 'cache'), SURFACE_CACHE_LIMIT)
+
+class SurfaceInterner:
+    # Поверхности с одинаковыми пикселями (после масштабирования) хранятся в одном экземпляре:
+    # одинаковые картинки под разными ключами и повторяющиеся кадры GIF
+    def __init__(self):
+        self.surfaces = weakref.WeakValueDictionary()
+        self.shared = 0
+        self.saved_bytes = 0
+
+    def digest(self, surf):
+        # Вызывается в рабочих потоках, поэтому ничего не меняет в self
+        fmt = "P" if surf.get_bitsize() == 8 else "RGBA"
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{surf.get_width()}x{surf.get_height()}:{fmt}:{surf.get_colorkey()}".encode())
+        if fmt == "P":
+            digest.update(bytes(channel for color in surf.get_palette() for channel in color[:3]))
+        digest.update(pygame.image.tostring(surf, fmt))
+        return digest.digest()
+
+    def finish(self, surf, digest):
+        shared = self.surfaces.get(digest)
+        if shared is not None:
+            self.shared += 1
+            self.saved_bytes += shared.get_width() * shared.get_height() * shared.get_bytesize()
+            return shared
+        # 8-битные кадры остаются с палитрой и переводятся в формат экрана прямо при blit
+        if surf.get_bitsize() == 8:
+            result = surf
+        elif surf.get_flags() & pygame.SRCALPHA:
+            result = surf.convert_alpha()
+        else:
+            result = surf.convert()
+            if surf.get_colorkey():
+                result.set_colorkey(surf.get_colorkey(), pygame.RLEACCEL)
+        self.surfaces[digest] = result
+        return result
+
+surface_interner = SurfaceInterner()
+
+KEY_COLORS = [(255, 0, 255), (0, 255, 0), (1, 2, 3)]
+
+def surface_mode(surf):
+    if isinstance(surf, PatchedSurface):
+        return "patch"
+    if surf.get_bitsize() == 8:
+        return "palette"
+    if surf.get_flags() & pygame.SRCALPHA:
+        return "alpha"
+    return "colorkey" if surf.get_colorkey() else "opaque"
+
+def reduce_alpha(surf, colorkey=None):
+    # Самый дешевый формат для blit: непрозрачная картинка -> convert() без альфы,
+    # альфа только 0/255 -> colorkey (+RLE), иначе остается попиксельная альфа.
+    # Вызывается в рабочих потоках
+    if surf.get_bitsize() == 8:
+        # PNG с палитрой: в кэш на диске он пишется как RGBA, поэтому и здесь формат выбирается
+        # по RGBA - иначе холодный старт оставлял бы палитру, а теплый давал бы другой формат
+        surf = pygame.image.fromstring(pygame.image.tostring(surf, "RGBA"), surf.get_size(), "RGBA")
+    if not surf.get_flags() & pygame.SRCALPHA:
+        # Альфы нет, но явно запрошенный ключ (белый фон маски) терять нельзя
+        if colorkey:
+            surf.set_colorkey(colorkey)
+        return surf
+    rgba = pygame.image.tostring(surf, "RGBA")
+    transparent = rgba[3::4].translate(None, b"\xff")
+    if transparent.translate(None, b"\x00"):
+        # Полупрозрачные пиксели есть - нужна настоящая альфа
+        if colorkey:
+            surf.set_colorkey(colorkey)
         return surf
+    img = Image.frombytes("RGBA", surf.get_size(), rgba)
+    rgb = img.convert("RGB")
+    key = colorkey
+    if transparent:
+        rgb_bytes = rgb.tobytes()
+        key = colorkey or next((color for color in KEY_COLORS if bytes(color) not in rgb_bytes), None)
+        if key is None:
+            return surf
+        rgb.paste(key, mask=img.getchannel("A").point(lambda v: 255 if v == 0 else 0))
+    result = pygame.image.frombuffer(rgb.tobytes(), surf.get_size(), "RGB")
+    if key:
+        result.set_colorkey(key)
+    return result
+
+PATCH_MAX_AREA = 0.5
+
+class PatchedSurface:
+    # Вариант комнаты: общая базовая картинка + вырезанный участок, которым вариант от нее отличается
+    def __init__(self, assets, base, patch, offset):
+        self.assets = assets
+        self.base = base
+        self.patch = patch
+        self.offset = offset
+
+    def get_size(self):
+        return self.assets[self.base].get_size()
+
+    def get_width(self):
+        return self.get_size()[0]
+
+    def get_height(self):
+        return self.get_size()[1]
+
+def rect_outside(outer, inner):
+    # Полосы outer вокруг inner (inner лежит внутри outer): сверху, снизу, слева, справа
+    if not inner.width or not inner.height:
+        return [outer]
+    strips = [pygame.Rect(outer.x, outer.y, outer.width, inner.y - outer.y),
+              pygame.Rect(outer.x, inner.bottom, outer.width, outer.bottom - inner.bottom),
+              pygame.Rect(outer.x, inner.y, inner.x - outer.x, inner.height),
+              pygame.Rect(inner.right, inner.y, outer.right - inner.right, inner.height)]
+    return [strip for strip in strips if strip.width > 0 and strip.height > 0]
+
+def blit_img(target, img, pos, area=None):
+    # area - как у Surface.blit: какая часть картинки рисуется в pos
+    if not isinstance(img, PatchedSurface):
+        target.blit(img, pos, area)
+        return
+    # Патч непрозрачный и целиком закрывает свой участок, поэтому base рисуется только вокруг него:
+    # вариант выводит столько же пикселей, сколько целая картинка
+    bounds = pygame.Rect((0, 0), img.get_size())
+    origin = bounds if area is None else pygame.Rect(area)
+    visible = origin.clip(bounds)
+    patch_rect = img.patch.get_rect(topleft=img.offset).clip(visible)
+    base = img.assets[img.base]
+    for strip in rect_outside(visible, patch_rect):
+        target.blit(base, (pos[0] + strip.x - origin.x, pos[1] + strip.y - origin.y), strip)
+    if patch_rect.width and patch_rect.height:
+        target.blit(img.patch, (pos[0] + patch_rect.x - origin.x, pos[1] + patch_rect.y - origin.y),
+                    patch_rect.move(-img.offset[0], -img.offset[1]))
+
+def image_patch(surf, base_surf):
+    # -> (патч, смещение) или None, если вариант выгоднее хранить целиком
+    if surface_mode(surf) != "opaque" or surface_mode(base_surf) != "opaque" or surf.get_size() != base_surf.get_size():
+        return None
+    size = surf.get_size()
+    diff = ImageChops.difference(Image.frombytes("RGB", size, pygame.image.tostring(surf, "RGB")),
+                                 Image.frombytes("RGB", size, pygame.image.tostring(base_surf, "RGB")))
+    x0, y0, x1, y1 = diff.getbbox() or (0, 0, 1, 1)
+    if (x1 - x0) * (y1 - y0) > PATCH_MAX_AREA * size[0] * size[1]:
+        return None
+    return surf.subsurface((x0, y0, x1 - x0, y1 - y0)).copy(), (x0, y0)
 
-def load_gif_frames(filename, target_size=(WIN_W, WIN_H), make_transparent=False):
+def decode_img(name, target_size="screen", colorkey=None, base=None):
+    target_size = resolve_size(target_size)
+    packed = asset_pack.frames(name, target_size)
+    path = os.path.join(images_path, name)
+    cached = None if packed else surface_cache.load(path, target_size)
+    if packed or cached:
+        surf = (packed or cached)[0][0]
+    else:
+        try:
+            img = pygame.image.load(path)
+            surf = pygame.transform.scale(img, target_size)
+            surface_cache.store(path, target_size, [(surf, 0)])
+        except:
+            surf = pygame.Surface(target_size, pygame.SRCALPHA)
+            surf.fill((30, 30, 30))
+    reduced = reduce_alpha(surf, colorkey)
+    if base:
+        # base - ключ imgs с той же комнатой; храним только отличающийся участок.
+        # Дифф - с уже загруженным base (LazyAssets грузит его раньше вариантов);
+        # декодируем base сами, только если его в памяти нет (фоновая подгрузка)
+        base_surf = imgs.loaded.get(base)
+        if base_surf is None or base_surf.get_size() != reduced.get_size():
+            base_surf = decode_img(*imgs.specs[base])[0]
+        patched = image_patch(reduced, base_surf)
+        if patched:
+            return patched[0], surface_interner.digest(patched[0]), base, patched[1]
+    if packed and reduced is surf and packed[0][2] and not colorkey:
+        return surf, packed[0][2]
+    return reduced, surface_interner.digest(reduced)
+
+def finish_img(decoded):
+    if len(decoded) > 2:
+        patch, digest, base, offset = decoded
+        return PatchedSurface(imgs, base, surface_interner.finish(patch, digest), offset)
+    return surface_interner.finish(*decoded)
+
+def load_img(name, target_size="screen"):
+    return finish_img(decode_img(name, target_size))
+
+def key_black(frame):
+    # Почти черные пиксели -> прозрачные, целиком на стороне PIL без цикла по пикселям
+    r, g, b, _ = frame.split()
+    black = ImageChops.lighter(ImageChops.lighter(r, g), b).point(lambda v: 255 if v < 10 else 0)
+    frame.paste((255, 255, 255, 0), mask=black)
+
+GIF_DEFAULT_DELAY = 100
+
+def gif_delay(duration):
+    # Задержка кадра GIF в мс. Нет задержки или она не больше 10 мс - 100 мс, как в браузерах
+    # (иначе GIF с нулевыми задержками проигрывается целиком за пару миллисекунд)
+    return duration if duration and duration > 10 else GIF_DEFAULT_DELAY
+
+def gif_frame_to_surface(frame, make_transparent=False):
+    frame = frame.convert("RGBA")
+    if make_transparent:
+        key_black(frame)
+    # frombuffer не копирует байты второй раз, как это делал fromstring
+    return pygame.image.frombuffer(frame.tobytes(), frame.size, "RGBA")
+
+TRANSPARENT_INDEX = 255
+
+def palette_colorkey(surf):
+    # Индекс палитры, заданный ключом у 8-битной поверхности, или None. SDL отдает только цвет ключа,
+    # а он может повторяться в палитре (добивка черным) - тогда TRANSPARENT_INDEX, как у gif_frames_to_palettized
+    colorkey = surf.get_colorkey()
+    if colorkey is None:
+        return None
+    if tuple(surf.get_palette_at(TRANSPARENT_INDEX)) == tuple(colorkey):
+        return TRANSPARENT_INDEX
+    return surf.map_rgb(colorkey)
+
+class Frames(list):
+    # [(surface, duration), ...] + deltas: прямоугольник, которым каждый кадр отличается от предыдущего
+    # (первый - от последнего, так что и повтор анимации идет по дельтам)
+    def __init__(self, frames, deltas=None):
+        super().__init__(frames)
+        self.deltas = deltas
+
+def surface_raw(surf):
+    return pygame.image.tostring(surf, "P" if surf.get_bitsize() == 8 else "RGBA")
+
+def raw_delta(prev, raw, size):
+    # -> Rect, в котором raw отличается от prev (пустой, если кадры совпадают)
+    w, h = size
+    if prev == raw:
+        return pygame.Rect(0, 0, 0, 0)
+    if len(prev) != len(raw):
+        return pygame.Rect(0, 0, w, h)
+    # Сравниваем как байты: ширина в байтах = w * bpp, потом переводим обратно в пиксели
+    bpp = len(raw) // (w * h)
+    diff = ImageChops.difference(Image.frombytes("L", (w * bpp, h), prev), Image.frombytes("L", (w * bpp, h), raw))
+    x0, y0, x1, y1 = diff.getbbox()
+    return pygame.Rect(x0 // bpp, y0, (x1 + bpp - 1) // bpp - x0 // bpp, y1 - y0)
+
+def frame_deltas(surfaces):
+    # Считается при загрузке (в рабочем потоке), в памяти держим только байты соседнего и первого кадров
+    if not surfaces:
+        return []
+    first = prev = surface_raw(surfaces[0])
+    deltas = [None]
+    for surf in surfaces[1:]:
+        raw = surface_raw(surf)
+        deltas.append(raw_delta(prev, raw, surf.get_size()))
+        prev = raw
+    deltas[0] = raw_delta(prev, first, surfaces[0].get_size())
+    return deltas
+
+def union_rect(a, b):
+    # Rect.union с пустым прямоугольником растягивает результат до его угла - пустые пропускаем
+    if not a.width or not a.height:
+        return b
+    if not b.width or not b.height:
+        return a
+    return a.union(b)
+
+def shared_gif_palette(pil_frames):
+    # Одна палитра на всю анимацию: квантуем уменьшенную склейку (до 16) кадров.
+    # Индекс TRANSPARENT_INDEX остается свободным под прозрачность
+    step = max(1, len(pil_frames) // 16)
+    thumbs = [frame.convert("RGB").reduce(max(1, frame.width // 256)) for frame in pil_frames[::step]]
+    montage = Image.new("RGB", (max(t.width for t in thumbs), sum(t.height for t in thumbs)))
+    y = 0
+    for thumb in thumbs:
+        montage.paste(thumb, (0, y))
+        y += thumb.height
+    return montage.quantize(colors=TRANSPARENT_INDEX, dither=0)
+
+def gif_frames_to_palettized(pil_frames, make_transparent=False):
+    palette_img = shared_gif_palette(pil_frames)
+    palette = palette_img.getpalette()[:TRANSPARENT_INDEX * 3]
+    palette = [tuple(palette[i:i + 3]) for i in range(0, len(palette), 3)]
+    palette += [(0, 0, 0)] * (256 - len(palette))
+    surfaces = []
+    for frame in pil_frames:
+        frame = frame.convert("RGBA")
+        if make_transparent:
+            key_black(frame)
+        indexed = frame.convert("RGB").quantize(palette=palette_img, dither=0)
+        transparent = frame.getchannel("A").point(lambda v: 255 if v < 128 else 0)
+        has_transparency = transparent.getbbox() is not None
+        if has_transparency:
+            indexed.paste(TRANSPARENT_INDEX, mask=transparent)
+        surf = pygame.image.frombuffer(indexed.tobytes(), indexed.size, "P")
+        surf.set_palette(palette)
+        if has_transparency:
+            surf.set_colorkey(TRANSPARENT_INDEX)
+        surfaces.append(surf)
+    return surfaces
+
+def decode_gif_frames(filename, target_size="screen", make_transparent=False, palettized=None):
+    target_size = resolve_size(target_size)
+    if palettized is None:
+        palettized = settings["palettized_animations"]
+    # В палитру идут только кадры GIF (в них и так не больше 256 цветов); PNG-картинки
+    # проверок полноцветные, квантование их бы испортило
+    palettized = palettized and filename.lower().endswith(".gif")
+    variant = "keyed" if make_transparent else ""
+    fmt = "P" if palettized else "RGBA"
+    packed = asset_pack.frames(filename, target_size, fmt, variant)
+    if packed:
+        frames = [(surf, gif_delay(duration), digest or surface_interner.digest(surf)) for surf, duration, digest in packed]
+        return Frames(frames, frame_deltas([surf for surf, _, _ in frames]))
     path = os.path.join(images_path, filename)
     if not os.path.exists(path):
         return None
-    try:
-        pil_image = Image.open(path)
-        frames = []
-        for frame in ImageSequence.Iterator(pil_image):
-            frame = frame.convert("RGBA")
-            if make_transparent:
-                datas = frame.getdata()
-                newData = [(255, 255, 255, 0) if item[0] < 10 and item[1] < 10 and item[2] < 10 else item for item in datas]
-                frame.putdata(newData)
-            pygame_surface = pygame.image.fromstring(frame.tobytes(), frame.size, frame.mode).convert_alpha()
-            frames.append((pygame.transform.scale(pygame_surface, target_size), frame.info.get('duration', 33)))
-        return frames
-    except:
+    frames = surface_cache.load(path, target_size, fmt, variant)
+    if not frames:
+        try:
+            pil_frames = [frame.copy() for frame in ImageSequence.Iterator(Image.open(path))]
+            durations = [gif_delay(frame.info.get('duration')) for frame in pil_frames]
+            if palettized:
+                surfaces = gif_frames_to_palettized(pil_frames, make_transparent)
+            else:
+                surfaces = [gif_frame_to_surface(frame, make_transparent) for frame in pil_frames]
+            frames = [(pygame.transform.scale(surf, target_size), duration) for surf, duration in zip(surfaces, durations)]
+            surface_cache.store(path, target_size, frames, fmt, variant)
+        except:
+            return None
+    return Frames([(surf, gif_delay(duration), surface_interner.digest(surf)) for surf, duration in frames],
+                  frame_deltas([surf for surf, _ in frames]))
+
+def finish_gif_frames(frames):
+    if frames is None:
         return None
+    return Frames([(surface_interner.finish(surf, digest), duration) for surf, duration, digest in frames], frames.deltas)
+
+def load_gif_frames(filename, target_size="screen", make_transparent=False, palettized=None):
+    return finish_gif_frames(decode_gif_frames(filename, target_size, make_transparent, palettized))
+
+class FrameStream:
+    # Проигрывает GIF без полной распаковки: рабочий поток декодирует кадры наперед
+    # в небольшой кольцевой буфер, в памяти одновременно живут только его кадры
+    def __init__(self, filename, target_size="screen", buffer_frames=8):
+        self.filename = filename
+        self.path = os.path.join(images_path, filename)
+        self.target_size = target_size
+        self.buffer_frames = buffer_frames
+        self.frames = None
+        self.stop_event = None
+        self.item = None
+        self.item_start = 0
+        self.current = None
+        self.changed = None
+
+    def exists(self):
+        return asset_pack.has_image(self.filename) or os.path.exists(self.path)
+
+    def prefetch(self):
+        if self.frames is not None:
+            return
+        self.frames = queue.Queue(maxsize=self.buffer_frames)
+        self.stop_event = threading.Event()
+        self.item = None
+        self.item_start = 0
+        self.current = None
+        self.changed = None
+        threading.Thread(target=self._decode, args=(self.frames, self.stop_event), daemon=True).start()
+
+    def _put(self, frames, stop_event, item):
+        while not stop_event.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _decode(self, frames, stop_event):
+        writer = None
+        target_size = resolve_size(self.target_size)
+        prev = None
+
+        def with_delta(surf, duration):
+            # Третий элемент - что изменилось относительно предыдущего кадра (None у первого)
+            nonlocal prev
+            raw = surface_raw(surf)
+            delta = raw_delta(prev, raw, surf.get_size()) if prev is not None else None
+            prev = raw
+            return (surf, duration, delta)
+
+        try:
+            packed = asset_pack.frames(self.filename, target_size)
+            cached = [(surf, duration) for surf, duration, _ in packed] if packed else surface_cache.load(self.path, target_size)
+            if cached:
+                for surf, duration in cached:
+                    if not self._put(frames, stop_event, with_delta(surf, gif_delay(duration))):
+                        return
+                return
+            writer = surface_cache.writer(self.path, target_size)
+            for frame in ImageSequence.Iterator(Image.open(self.path)):
+                surf = pygame.transform.scale(gif_frame_to_surface(frame), target_size)
+                duration = gif_delay(frame.info.get('duration'))
+                writer.add(surf, duration)
+                if not self._put(frames, stop_event, with_delta(surf, duration)):
+                    writer.discard()
+                    return
+            writer.commit()
+        except:
+            if writer:
+                writer.discard()
+        finally:
+            self._put(frames, stop_event, None)
+
+    def frame_at(self, elapsed):
+        # -> кадр на момент elapsed мс от начала или None, если анимация закончилась.
+        # Кадры идут только вперед; опоздавшие выбрасываются из буфера без convert_alpha()
+        if self.frames is None or elapsed < self.item_start:
+            self.release()
+            self.prefetch()
+        while self.item is None or elapsed >= self.item_start + self.item[1]:
+            if self.item is not None:
+                self.item_start += self.item[1]
+            item = self.frames.get()
+            if item is None:
+                self.frames.put(None)
+                return None
+            self.item = item[:2]
+            self.current = None
+            self.changed = None if item[2] is None or self.changed is None else union_rect(self.changed, item[2])
+        if self.current is None:
+            self.current = self.item[0].convert_alpha()
+        return self.current
+
+    def take_changed(self):
+        # -> область, изменившаяся с прошлого вызова (включая пропущенные кадры), None - весь кадр
+        changed, self.changed = self.changed, pygame.Rect(0, 0, 0, 0)
+        return changed
+
+    def release(self):
+        if self.stop_event:
+            self.stop_event.set()
+        self.frames = None
+        self.stop_event = None
+        self.item = None
+        self.item_start = 0
+        self.current = None
+        self.changed = None
+
+class AnimationPlayer:
+    # Кадр анимации выбирается по прошедшему времени, а не по числу отрисованных кадров:
+    # при просадке FPS лишние кадры пропускаются и анимация не замедляется
+    def __init__(self, loop=False):
+        self.loop = loop
+        self.start = pygame.time.get_ticks()
+        self.frames = None
+        self.ends = []
+        self.source = None
+        self.index = None
+        self.surf = None
+        self.canvas = None
+        self.canvas_valid = False
+        self.shown_source = None
+        self.shown_index = None
+        self.shown_target = None
+        self.dirty = None
+
+    def play(self):
+        self.start = pygame.time.get_ticks()
+
+    def elapsed(self):
+        return pygame.time.get_ticks() - self.start
+
+    def _ends(self, frames):
+        # Накопленные времена окончания кадров; список кадров может смениться после выгрузки
+        if frames is not self.frames:
+            self.frames = frames
+            self.ends = list(accumulate(duration for _, duration in frames))
+        return self.ends
+
+    def frame(self, frames):
+        # frames: [(surface, duration), ...] или FrameStream -> surface или None, когда анимация кончилась
+        self.source, self.index, self.surf = frames, None, None
+        if isinstance(frames, FrameStream):
+            self.surf = frames.frame_at(self.elapsed())
+            return self.surf
+        if not frames:
+            return None
+        ends = self._ends(frames)
+        elapsed = self.elapsed() % ends[-1] if self.loop else self.elapsed()
+        index = bisect.bisect_right(ends, elapsed)
+        if index < len(frames):
+            self.index, self.surf = index, frames[index][0]
+        return self.surf
+
+    def _changed(self):
+        # Что изменилось с прошлого показа: дельты всех кадров, которые мы прошли (в т.ч. пропущенных).
+        # None - неизвестно, считаем весь кадр
+        if self.shown_source is not self.source:
+            return None
+        if isinstance(self.source, FrameStream):
+            return self.source.take_changed()
+        deltas = getattr(self.source, "deltas", None)
+        if deltas is None or self.shown_index is None:
+            return None
+        changed = pygame.Rect(0, 0, 0, 0)
+        for step in range(1, (self.index - self.shown_index) % len(deltas) + 1):
+            changed = union_rect(changed, deltas[(self.shown_index + step) % len(deltas)])
+        return changed
+
+    @staticmethod
+    def _transparent(surf):
+        return surf.get_colorkey() is not None or surf.get_flags() & pygame.SRCALPHA
+
+    def _fits(self, surf):
+        # Холст того же формата; прозрачный холст принимает и непрозрачные кадры, но не наоборот
+        canvas = self.canvas
+        if canvas is None or canvas.get_size() != surf.get_size() or canvas.get_bitsize() != surf.get_bitsize():
+            return False
+        return self._transparent(canvas) or not self._transparent(surf)
+
+    def _new_canvas(self, surf):
+        # Копия кадра без RLE: холст переписывается каждый кадр
+        if surf.get_bitsize() == 8:
+            canvas = surf.copy()
+            if surf.get_colorkey() is not None:
+                canvas.set_colorkey(TRANSPARENT_INDEX)
+            return canvas
+        return surf.convert_alpha() if self._transparent(surf) else surf.copy()
+
+    def _copy_region(self, surf, rect):
+        # Точная копия пикселей surf в rect холста, включая прозрачность
+        canvas = self.canvas
+        if canvas.get_flags() & pygame.SRCALPHA:
+            if surf.get_flags() & pygame.SRCALPHA:
+                canvas.fill((255, 255, 255, 255), rect)
+                canvas.blit(surf, rect, rect, pygame.BLEND_RGBA_MIN)
+                return
+            canvas.fill((0, 0, 0, 0), rect)
+        elif canvas.get_colorkey() is not None:
+            canvas.fill(TRANSPARENT_INDEX, rect)
+        canvas.blit(surf, rect, rect)
+
+    def _take_changed(self, target):
+        changed = self._changed() if self.shown_target is target else None
+        self.shown_source, self.shown_index, self.shown_target = self.source, self.index, target
+        return changed
+
+    def blit(self, target, pos=(0, 0), area=None, alpha=None):
+        # Рисует кадр, выбранный последним frame(); self.dirty - что изменилось в target с прошлого раза.
+        # С alpha кадр идет через холст плеера (сами кадры общие, их прозрачность трогать нельзя),
+        # и на холст докладывается только изменившаяся область
+        surf = self.surf
+        if surf is None:
+            self.dirty = None
+            return
+        changed = self._take_changed(target)
+        if changed is None:
+            changed = surf.get_rect()
+        if alpha is None:
+            self.canvas_valid = False
+            target.blit(surf, pos, area)
+        else:
+            if not self._fits(surf):
+                self.canvas = self._new_canvas(surf)
+            elif not self.canvas_valid:
+                self._copy_region(surf, surf.get_rect())
+            elif changed.width and changed.height:
+                self._copy_region(surf, changed)
+            self.canvas_valid = True
+            if self.canvas.get_alpha() != alpha:
+                self.canvas.set_alpha(alpha)
+            target.blit(self.canvas, pos, area)
+        if area is not None:
+            changed = changed.clip(area).move(-area.x, -area.y)
+        self.dirty = changed.move(pos).clip(target.get_rect())
+
+    def draw_fullscreen(self, target, background=(0, 0, 0)):
+        # Анимация - единственное, что есть на экране (скримеры, танец Марионетки, 6 AM):
+        # в target остался прошлый кадр, поэтому перерисовывается только изменившаяся область
+        if self.surf is None:
+            self.dirty = None
+            return
+        changed = self._take_changed(target)
+        self.canvas_valid = False
+        if changed is None:
+            target.fill(background)
+            target.blit(self.surf, (0, 0))
+            self.dirty = target.get_rect()
+            return
+        target.fill(background, changed)
+        target.blit(self.surf, changed, changed)
+        self.dirty = changed.clip(target.get_rect())
+
+class AssetLoader:
+    # Декодирование и масштабирование идут в пуле потоков,
+    # а convert()/convert_alpha() (зависит от дисплея) - только в главном потоке
+    def __init__(self, workers=None):
+        self.workers = workers or max(2, (os.cpu_count() or 2) - 1)
+        self.pool = None
+        self.times = {}
+        self.total_ms = 0.0
+
+    def _decode(self, decode, args):
+        start = time.perf_counter()
+        raw = decode(*args)
+        return raw, (time.perf_counter() - start) * 1000
+
+    def load_many(self, jobs):
+        # jobs: [(label, decode, finish, args), ...] -> результаты в том же порядке
+        start = time.perf_counter()
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        futures = [(label, finish, self.pool.submit(self._decode, decode, args))
+                   for label, decode, finish, args in jobs]
+        results = []
+        for label, finish, future in futures:
+            raw, decode_ms = future.result()
+            finish_start = time.perf_counter()
+            results.append(finish(raw))
+            self.times[label] = decode_ms + (time.perf_counter() - finish_start) * 1000
+        self.total_ms += (time.perf_counter() - start) * 1000
+        return results
+
+    def submit(self, decode, args):
+        # Фоновое декодирование без ожидания; результат забирается через finish_one
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        return self.pool.submit(self._decode, decode, args)
+
+    def finish_one(self, label, finish, future):
+        raw, decode_ms = future.result()
+        start = time.perf_counter()
+        result = finish(raw)
+        self.times[label] = decode_ms + (time.perf_counter() - start) * 1000
+        return result
+
+    def load_one(self, label, decode, finish, args):
+        start = time.perf_counter()
+        result = finish(decode(*args))
+        elapsed = (time.perf_counter() - start) * 1000
+        self.times[label] = elapsed
+        self.total_ms += elapsed
+        return result
+
+    def report(self):
+        for label, ms in sorted(self.times.items(), key=lambda item: -item[1]):
+            print(f"{ms:8.1f} ms  {label}")
+        print(f"{len(self.times)} assets, {self.total_ms:.1f} ms total (wall clock, {self.workers} workers)")
+
+    def shutdown(self):
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+asset_loader = AssetLoader()
+asset_report = "--asset-report" in sys.argv
 
 def load_sound(filename):
+    packed = asset_pack.sound(filename)
+    if packed is not None:
+        try:
+            return pygame.mixer.Sound(file=io.BytesIO(packed))
+        except:
+            pass
     path = os.path.join(sounds_path, filename)
     if not os.path.exists(path):
         return None
@@ -166,150 +1378,466 @@ def load_sound(filename):
     except:
         return None
 
-map_size = (WIN_W // 2, WIN_H)
-
-imgs = {
-    "main": load_img("office_main.png", office_size),
-    "hall_clear": load_img("office_center_clear.png", office_size),
-    "hall_foxy": load_img("WitheredFoxyStage.png", office_size),
-    "vent_l_clear": load_img("FNaF_2_Office_Left_Vent_Light.png", office_size),
-    "vent_l_chica": load_img("FNaF_2_Office_Left_Vent_Toy_Chica.png", office_size),
-    "vent_r_clear": load_img("FNaF_2_Office_Right_Vent_Light.png", office_size),
-    "vent_r_bonnie": load_img("FNaF_2_Office_Right_Vent_Toy_Bonnie.png", office_size),
-    "mask": load_img("Mask.png"),
-    "puppet_awake_light": load_img("PuppetAwakeLight.png"),
-    "puppet_in_box_light": load_img("PuppetInBoxLight.png"),
-    "puppet_box_no_light": load_img("PuppetBoxNoLight.png"),
-    "map8": load_img("Cam8.png", map_size),
-    "map9": load_img("cam9.png", map_size),
-    "map11": load_img("Cam11.png", map_size),
-    "stage_full": load_img("StageFull.png"),
-    "stage_full_light": load_img("StageLightFull.png"),
-    "stage_freddy_chica": load_img("StageFreddyChicka.png"),
-    "stage_freddy_chica_light": load_img("StageFreddyChickaLight.png"),
-    "stage_freddy_bonnie": load_img("StageFreddyBonnie.png"),
-    "stage_freddy_bonnie_light": load_img("StageFreddyBonnieLight.png"),
-    "stage_freddy": load_img("StageFreddy.png"),
-    "stage_freddy_light": load_img("StageFreddyLight.png"),
-    "stage_bonnie_freddy": load_img("ToyBonnieToyFreddyStage.png"),
-    "stage_bonnie_freddy_light": load_img("ToyBonnieToyFreddyStageLight.png"),
-    "cam8_view": load_img("Cam8View.png"),
-    "menu": load_img("menuTest.png"),
-    "toy_chica_face": load_img("ToyChikaFace.png", (150, 150)),
-    "toy_chica_face2": load_img("ToyChickaFace2.png", (150, 150)),
-    "toy_chica_face3": load_img("ToyChickaFace3.png", (150, 150)),
-    "toy_bonnie_face": load_img("ToyBonnyFace.png", (150, 150)),
-    "toy_bonnie_face2": load_img("BonnieFace2.png", (150, 150)),
-    "toy_bonnie_face3": load_img("BonnieFace3.png", (150, 150)),
-    "withered_foxy_face": load_img("WitheredFoxyFace.png", (150, 150)),
-    "withered_foxy_face2": load_img("FoxyFace2.png", (150, 150)),
-    "withered_foxy_face3": load_img("FoxyFace3.png", (150, 150)),
-    "puppet_face": load_img("PuppetFace.png", (150, 150)),
-    "main_hall_clear": load_img("MainHallClear.png"),
-    "main_hall_toy_chica": load_img("MainHallToyChicka.png"),
-    "main_hall_clear_light": load_img("MainHalLClearLight.png"),
-    "main_hall_toy_chica_light": load_img("MainHallToyChickaLight.png"),
-    "party_room2_toy_bonnie": load_img("PartyRoom2ToyBonnie.png"),
-    "party_room2_toy_bonnie_light": load_img("PartyRoom2ToyBonnieLight.png"),
-    "party_room2_clear": load_img("PartyRoom2Clear.png"),
-    "party_room2_clear_light": load_img("PartyRoomClearLight.png"),
-    "bb_face": load_img("BBFace.png", (150, 150)),
-    "bb_face2": load_img("BBFace2.png", (150, 150)),
-    "bb_face3": load_img("BBFace3.png", (150, 150)),
-    "bb_face4": load_img("BBFace4.png", (150, 150)),
-    "parts_service_lo_light": load_img("PartsServiceLoLight.png"),
-    "parts_service_all_light": load_img("PartsServiceAllLight.png"),
-    "parts_service_without_foxy": load_img("PartsServiceWithoutFoxy.png"),
-    "game_area_bb": load_img("GameAreaBB.png"),
-    "game_area_bb_light": load_img("GameAreBBLight.png"),
-    "game_area_clear": load_img("GameAreaClear.png"),
-    "game_area_clear_light": load_img("GameAreClearLight.png"),
-    "left_vent": load_img("LeftVent.png"),
-    "left_vent_bb_light": load_img("LeftVentBBLight.png"),
-    "left_vent_toy_chicka": load_img("LeftVentToyChicka.png"),
-    "office_bb_vent": load_img("OfficeBBVent.png", office_size),
-    "office_bb": load_img("OfficeBB.png", office_size),
-    "tg_icon": load_img("TGIcon.png", (50, 50)),
-    "tiktok_icon": load_img("TikTokIcon.png", (50, 50)),
-    "bug_icon": load_img("BugIcon.png", (50, 50)),
-    "monitor_button": load_img("MonitorButton.png", (650, 40)),
-    "mask_button": load_img("MaskButton.png", (650, 40)),
-    "withered_freddy_face": load_img("WitheredFreddyFace.png", (150, 150)),
-    "withered_chica_face": load_img("WitheredChicaFace.png", (150, 150)),
-    "withered_bonny_face": load_img("WitheredBonnyFace.png", (150, 150)),
-    "toy_freddy_face": load_img("ToyFreddyFace.png", (150, 150)),
-    "toy_chica_hallway": load_img("ToyChicaHallway.png", office_size),
-    "toy_freddy_hallway": load_img("ToyFreddyHalway.png", office_size),
-    "toy_freddy_near": load_img("ToyFreddyNear.png", office_size),
-    "withered_bonny_hallway": load_img("WitheredBonnyHallway.png", office_size),
-    "withered_freddy_hallway": load_img("WitheredFreddyHallway.png", office_size),
-    "wfoxy_wbonny": load_img("WFoxyWBonny.png", office_size),
-    "game_area_bb_and_toy_freddy": load_img("GameAreaBBAndToyFreddy.png"),
-    "game_area_toy_freddy_light": load_img("GameAreaToyFreddyLight.png"),
-    "left_air_vent_clear_light": load_img("LeftAirVentClearLight.png"),
-    "left_air_vent_withered_bonny": load_img("LeftAirVentWitheredBonny.png"),
-    "withered_bonny_main_hall_light": load_img("WitheredBonnyMainHallLight.png"),
-    "withered_freddy_mail_hall_light": load_img("WitheredFreddyMailHallLight.png"),
-    "parts_service_without_foxy_and_bonny_light": load_img("PartsServiceWithoutFoxyAndBonnyLight.png"),
-    "parts_service_withered_freddy": load_img("PartsServiceWitheredFreddy.png"),
-    "parts_service_clear_light": load_img("PartsServiceClearLight.png"),
-    "parts_service_withered_foxy_light": load_img("PartsServiceWitheredFoxyLight.png"),
-    "shadow_freddy": load_img("ShadowFreddy.png"),
-    "party_room1_clear": load_img("PartyRoom1Clear.png"),
-    "party_room1_clear_light": load_img("PartyRoom1ClearLight.png"),
-    "party_room1_withered_bonny_light": load_img("PartyRoom1WitheredBonnyLight.png"),
-    "party_room1_toy_chica_light": load_img("PartyRoom1ToyChicaLight.png"),
-    "party_room2_withered_chica": load_img("PartyRoom2WitheredChicka.png"),
-    "party_room2_withered_chica_light": load_img("PartyRoom2WitheredChicaLight.png"),
-    "party_room3_clear": load_img("PartyRoomClear.png"),
-    "party_room3_clear_light": load_img("PartyRoom3ClearLight.png"),
-    "party_room3_toy_bonny_light": load_img("PartyRoom3ToyBonnyLight.png"),
-    "party_room3_withered_freddy": load_img("PartyRoom3WitheredFreddy.png"),
-    "party_room4_withered_freddy_light": load_img("PartyRoom4WitheredFreddyLight.png"),
-    "party_room4_clear": load_img("PartyRoom4Clear.png"),
-    "party_room4_clear_light": load_img("PartyRoom4ClearLight.png"),
-    "party_room4_toy_bonny": load_img("PartyRoom4ToyBonny.png"),
-    "party_room4_toy_bonny_light": load_img("PartyRoom4ToyBonnyLight.png"),
-    "party_room4_toy_chica_light": load_img("PartyRoom4ToyChicaLight.png"),
-    "party_room4_withered_chica_light": load_img("PartyRoom4WitheredChicaLight.png"),
-    "right_air_vent_clear": load_img("RightAirVentClear.png"),
-    "right_air_vent_clear_light": load_img("RightAirVentClearLight.png"),
-    "right_air_vent_toy_bonny_light": load_img("RightAirVentToyBonnyLight.png"),
-    "right_air_vent_withered_chica_light": load_img("RightAirVentWitheredChicaLight.png"),
-    "stage_clear": load_img("StageClear.png"),
-}
+def asset_surfaces(asset):
+    # Поверхности ресурса без повторов. После SurfaceInterner одинаковые пиксели (один digest) -
+    # один и тот же объект, так что повтор узнается по id
+    if asset is None:
+        return []
+    if isinstance(asset, PatchedSurface):
+        asset = asset.patch
+    surfaces = [asset] if isinstance(asset, pygame.Surface) else [surf for surf, _ in asset]
+    return list({id(surf): surf for surf in surfaces}.values())
+
+def surf_bytes(surf):
+    return surf.get_width() * surf.get_height() * surf.get_bytesize()
+
+def asset_bytes(asset):
+    return sum(surf_bytes(surf) for surf in asset_surfaces(asset))
+
+class AssetBudget:
+    # Общий лимит памяти на декодированные поверхности всех LazyAssets.
+    # При превышении выгружаются записи, к которым дольше всего не обращались.
+    # Поверхность, общая для нескольких ключей (SurfaceInterner), учитывается один раз -
+    # по счетчику ссылок, и освобождается, только когда ее не держит ни одна запись.
+    # hits - запрошенные загрузки (missing_jobs), не понадобившиеся: ресурс еще в памяти;
+    # misses - ресурсы, которые пришлось декодировать. Обращения кадров по ключу не считаются
+    def __init__(self, limit_bytes):
+        self.limit_bytes = limit_bytes
+        self.entries = OrderedDict()  # (assets, ключ) -> [поверхности]
+        self.refs = {}  # id поверхности -> [поверхность, число записей]
+        self.group_refs = {}  # (группа, id поверхности) -> число записей группы
+        self.total_bytes = 0
+        self.group_bytes = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def touch(self, assets, key):
+        if (assets, key) in self.entries:
+            self.entries.move_to_end((assets, key))
+
+    def add(self, assets, key, surfaces):
+        self.misses += 1
+        self.remove(assets, key)
+        self.entries[(assets, key)] = surfaces
+        for surf in surfaces:
+            ref = self.refs.setdefault(id(surf), [surf, 0])
+            if not ref[1]:
+                self.total_bytes += surf_bytes(surf)
+            ref[1] += 1
+            group_key = (assets.name, id(surf))
+            if not self.group_refs.get(group_key):
+                self.group_bytes[assets.name] = self.group_bytes.get(assets.name, 0) + surf_bytes(surf)
+            self.group_refs[group_key] = self.group_refs.get(group_key, 0) + 1
+        while self.limit_bytes and self.total_bytes > self.limit_bytes and len(self.entries) > 1:
+            self.evict_oldest()
+
+    def remove(self, assets, key):
+        for surf in self.entries.pop((assets, key), []):
+            ref = self.refs[id(surf)]
+            ref[1] -= 1
+            if not ref[1]:
+                del self.refs[id(surf)]
+                self.total_bytes -= surf_bytes(surf)
+            group_key = (assets.name, id(surf))
+            self.group_refs[group_key] -= 1
+            if not self.group_refs[group_key]:
+                del self.group_refs[group_key]
+                self.group_bytes[assets.name] -= surf_bytes(surf)
+
+    def evict_oldest(self):
+        (assets, key), _ = next(iter(self.entries.items()))
+        assets.unload(key)
+        self.evictions += 1
+
+class LazyAssets:
+    # Загружает ресурс только при первом обращении по ключу
+    def __init__(self, name, decode, finish, specs):
+        self.name = name
+        self.decode = decode
+        self.finish = finish
+        self.specs = specs
+        self.loaded = {}
+        self.groups = {}
+        self.pending = {}
+        self.bases = {}  # вариант комнаты -> ключ base (add_variants)
+
+    def _store(self, key, asset):
+        self.loaded[key] = asset
+        asset_budget.add(self, key, asset_surfaces(asset))
+
+    def __getitem__(self, key):
+        base = self.bases.get(key)
+        if base and key not in self.loaded and base not in self.loaded:
+            self[base]
+        if key in self.loaded:
+            # Обращение кадра к ресурсу в памяти - не hit: hits считает только missing_jobs
+            asset_budget.touch(self, key)
+        elif key in self.pending:
+            # Уже декодируется в фоне - дожидаемся его, а не начинаем заново
+            self._store(key, asset_loader.finish_one(f"{self.name}:{key}", self.finish, self.pending.pop(key)))
+        else:
+            self._store(key, asset_loader.load_one(f"{self.name}:{key}", self.decode, self.finish, self.specs[key]))
+        return self.loaded[key]
+
+    def prefetch(self, key):
+        # Запускает фоновое декодирование; True, если ресурс еще не был готов
+        if key in self.loaded:
+            asset_budget.touch(self, key)
+            return False
+        if key not in self.pending:
+            self.pending[key] = asset_loader.submit(self.decode, self.specs[key])
+        return True
 
-imgs["mask"].set_colorkey((255, 255, 255))
+    def collect(self):
+        # Доводит готовые фоновые загрузки до поверхностей (convert - только в главном потоке)
+        for key, future in list(self.pending.items()):
+            if future.done():
+                del self.pending[key]
+                if key not in self.loaded:
+                    self._store(key, asset_loader.finish_one(f"{self.name}:{key}", self.finish, future))
+
+    def is_loaded(self, key):
+        return key in self.loaded
+
+    def unload(self, key):
+        # Следующее обращение загрузит ресурс снова (из дискового кэша, если он есть)
+        if key in self.loaded:
+            del self.loaded[key]
+            asset_budget.remove(self, key)
+
+    def invalidate(self, keys):
+        # Выгружает keys и отменяет их фоновые загрузки; при следующем обращении загрузятся заново
+        for key in keys:
+            self.unload(key)
+            future = self.pending.pop(key, None)
+            if future:
+                future.cancel()
+
+    def invalidate_sizes(self):
+        # После смены разрешения: выгружаем все, что масштабировано под экран
+        # ("screen"/"office"/"map"); при следующем обращении загрузится в новом размере
+        self.invalidate([key for key, spec in self.specs.items() if isinstance((spec + ("screen",))[1], str)])
+
+    def __contains__(self, key):
+        return key in self.specs
+
+    def get(self, key, default=None):
+        if key not in self.specs:
+            return default
+        return self[key]
+
+    def keys(self):
+        return self.specs.keys()
+
+    def add_variants(self, base, keys):
+        # Варианты той же комнаты хранятся патчами поверх base (см. decode_img)
+        for key in keys:
+            filename, target_size, colorkey = self.specs[key] + ("screen", None)[len(self.specs[key]) - 1:]
+            self.specs[key] = (filename, target_size, colorkey, base)
+            self.bases[key] = base
+
+    def add_group(self, state, keys):
+        self.groups.setdefault(state, []).extend(keys)
+
+    def missing_jobs(self, keys):
+        keys = list(dict.fromkeys(keys))
+        for key in keys:
+            if key in self.loaded:
+                # Загрузка не нужна - ресурс еще в памяти
+                asset_budget.hits += 1
+                asset_budget.touch(self, key)
+        # Варианты диффятся с загруженным base, поэтому base грузятся до них - один раз на все варианты
+        bases = [base for base in dict.fromkeys(self.bases.get(key) for key in keys if key not in self.loaded)
+                 if base and base not in self.loaded]
+        if bases:
+            jobs = self.missing_jobs(bases)
+            self.store_all([key for key, _ in jobs], asset_loader.load_many([job for _, job in jobs]))
+            for base in bases:
+                if base in self.pending:
+                    self[base]
+        return [(key, (f"{self.name}:{key}", self.decode, self.finish, self.specs[key]))
+                for key in keys if key not in self.loaded and key not in self.pending]
+
+    def store_all(self, keys, assets):
+        for key, asset in zip(keys, assets):
+            self._store(key, asset)
+
+asset_budget = AssetBudget(settings["surface_budget_mb"] * 1024 * 1024)
+
+imgs = LazyAssets("imgs", decode_img, finish_img, {
+    "main": ("office_main.png", "office"),
+    "hall_clear": ("office_center_clear.png", "office"),
+    "hall_foxy": ("WitheredFoxyStage.png", "office"),
+    "vent_l_clear": ("FNaF_2_Office_Left_Vent_Light.png", "office"),
+    "vent_l_chica": ("FNaF_2_Office_Left_Vent_Toy_Chica.png", "office"),
+    "vent_r_clear": ("FNaF_2_Office_Right_Vent_Light.png", "office"),
+    "vent_r_bonnie": ("FNaF_2_Office_Right_Vent_Toy_Bonnie.png", "office"),
+    "mask": ("Mask.png", "screen", (255, 255, 255)),
+    "puppet_awake_light": ("PuppetAwakeLight.png",),
+    "puppet_in_box_light": ("PuppetInBoxLight.png",),
+    "puppet_box_no_light": ("PuppetBoxNoLight.png",),
+    "map8": ("Cam8.png", "map"),
+    "map9": ("cam9.png", "map"),
+    "map11": ("Cam11.png", "map"),
+    "stage_full": ("StageFull.png",),
+    "stage_full_light": ("StageLightFull.png",),
+    "stage_freddy_chica": ("StageFreddyChicka.png",),
+    "stage_freddy_chica_light": ("StageFreddyChickaLight.png",),
+    "stage_freddy_bonnie": ("StageFreddyBonnie.png",),
+    "stage_freddy_bonnie_light": ("StageFreddyBonnieLight.png",),
+    "stage_freddy": ("StageFreddy.png",),
+    "stage_freddy_light": ("StageFreddyLight.png",),
+    "stage_bonnie_freddy": ("ToyBonnieToyFreddyStage.png",),
+    "stage_bonnie_freddy_light": ("ToyBonnieToyFreddyStageLight.png",),
+    "cam8_view": ("Cam8View.png",),
+    "menu": ("menuTest.png", "ui"),
+    "toy_chica_face": ("ToyChikaFace.png", (150, 150)),
+    "toy_chica_face2": ("ToyChickaFace2.png", (150, 150)),
+    "toy_chica_face3": ("ToyChickaFace3.png", (150, 150)),
+    "toy_bonnie_face": ("ToyBonnyFace.png", (150, 150)),
+    "toy_bonnie_face2": ("BonnieFace2.png", (150, 150)),
+    "toy_bonnie_face3": ("BonnieFace3.png", (150, 150)),
+    "withered_foxy_face": ("WitheredFoxyFace.png", (150, 150)),
+    "withered_foxy_face2": ("FoxyFace2.png", (150, 150)),
+    "withered_foxy_face3": ("FoxyFace3.png", (150, 150)),
+    "puppet_face": ("PuppetFace.png", (150, 150)),
+    "main_hall_clear": ("MainHallClear.png",),
+    "main_hall_toy_chica": ("MainHallToyChicka.png",),
+    "main_hall_clear_light": ("MainHalLClearLight.png",),
+    "main_hall_toy_chica_light": ("MainHallToyChickaLight.png",),
+    "party_room2_toy_bonnie": ("PartyRoom2ToyBonnie.png",),
+    "party_room2_toy_bonnie_light": ("PartyRoom2ToyBonnieLight.png",),
+    "party_room2_clear": ("PartyRoom2Clear.png",),
+    "party_room2_clear_light": ("PartyRoomClearLight.png",),
+    "bb_face": ("BBFace.png", (150, 150)),
+    "bb_face2": ("BBFace2.png", (150, 150)),
+    "bb_face3": ("BBFace3.png", (150, 150)),
+    "bb_face4": ("BBFace4.png", (150, 150)),
+    "parts_service_lo_light": ("PartsServiceLoLight.png",),
+    "parts_service_all_light": ("PartsServiceAllLight.png",),
+    "parts_service_without_foxy": ("PartsServiceWithoutFoxy.png",),
+    "game_area_bb": ("GameAreaBB.png",),
+    "game_area_bb_light": ("GameAreBBLight.png",),
+    "game_area_clear": ("GameAreaClear.png",),
+    "game_area_clear_light": ("GameAreClearLight.png",),
+    "left_vent": ("LeftVent.png",),
+    "left_vent_bb_light": ("LeftVentBBLight.png",),
+    "left_vent_toy_chicka": ("LeftVentToyChicka.png",),
+    "office_bb_vent": ("OfficeBBVent.png", "office"),
+    "office_bb": ("OfficeBB.png", "office"),
+    "tg_icon": ("TGIcon.png", (50, 50)),
+    "tiktok_icon": ("TikTokIcon.png", (50, 50)),
+    "bug_icon": ("BugIcon.png", (50, 50)),
+    "monitor_button": ("MonitorButton.png", "hud_button"),
+    "mask_button": ("MaskButton.png", "hud_button"),
+    "withered_freddy_face": ("WitheredFreddyFace.png", (150, 150)),
+    "withered_chica_face": ("WitheredChicaFace.png", (150, 150)),
+    "withered_bonny_face": ("WitheredBonnyFace.png", (150, 150)),
+    "toy_freddy_face": ("ToyFreddyFace.png", (150, 150)),
+    "toy_chica_hallway": ("ToyChicaHallway.png", "office"),
+    "toy_freddy_hallway": ("ToyFreddyHalway.png", "office"),
+    "toy_freddy_near": ("ToyFreddyNear.png", "office"),
+    "withered_bonny_hallway": ("WitheredBonnyHallway.png", "office"),
+    "withered_freddy_hallway": ("WitheredFreddyHallway.png", "office"),
+    "wfoxy_wbonny": ("WFoxyWBonny.png", "office"),
+    "game_area_bb_and_toy_freddy": ("GameAreaBBAndToyFreddy.png",),
+    "game_area_toy_freddy_light": ("GameAreaToyFreddyLight.png",),
+    "left_air_vent_clear_light": ("LeftAirVentClearLight.png",),
+    "left_air_vent_withered_bonny": ("LeftAirVentWitheredBonny.png",),
+    "withered_bonny_main_hall_light": ("WitheredBonnyMainHallLight.png",),
+    "withered_freddy_mail_hall_light": ("WitheredFreddyMailHallLight.png",),
+    "parts_service_without_foxy_and_bonny_light": ("PartsServiceWithoutFoxyAndBonnyLight.png",),
+    "parts_service_withered_freddy": ("PartsServiceWitheredFreddy.png",),
+    "parts_service_clear_light": ("PartsServiceClearLight.png",),
+    "parts_service_withered_foxy_light": ("PartsServiceWitheredFoxyLight.png",),
+    "shadow_freddy": ("ShadowFreddy.png",),
+    "party_room1_clear": ("PartyRoom1Clear.png",),
+    "party_room1_clear_light": ("PartyRoom1ClearLight.png",),
+    "party_room1_withered_bonny_light": ("PartyRoom1WitheredBonnyLight.png",),
+    "party_room1_toy_chica_light": ("PartyRoom1ToyChicaLight.png",),
+    "party_room2_withered_chica": ("PartyRoom2WitheredChicka.png",),
+    "party_room2_withered_chica_light": ("PartyRoom2WitheredChicaLight.png",),
+    "party_room3_clear": ("PartyRoomClear.png",),
+    "party_room3_clear_light": ("PartyRoom3ClearLight.png",),
+    "party_room3_toy_bonny_light": ("PartyRoom3ToyBonnyLight.png",),
+    "party_room3_withered_freddy": ("PartyRoom3WitheredFreddy.png",),
+    "party_room4_withered_freddy_light": ("PartyRoom4WitheredFreddyLight.png",),
+    "party_room4_clear": ("PartyRoom4Clear.png",),
+    "party_room4_clear_light": ("PartyRoom4ClearLight.png",),
+    "party_room4_toy_bonny": ("PartyRoom4ToyBonny.png",),
+    "party_room4_toy_bonny_light": ("PartyRoom4ToyBonnyLight.png",),
+    "party_room4_toy_chica_light": ("PartyRoom4ToyChicaLight.png",),
+    "party_room4_withered_chica_light": ("PartyRoom4WitheredChicaLight.png",),
+    "right_air_vent_clear": ("RightAirVentClear.png",),
+    "right_air_vent_clear_light": ("RightAirVentClearLight.png",),
+    "right_air_vent_toy_bonny_light": ("RightAirVentToyBonnyLight.png",),
+    "right_air_vent_withered_chica_light": ("RightAirVentWitheredChicaLight.png",),
+    "stage_clear": ("StageClear.png",),
+})
+
+imgs.add_variants("hall_clear", ["hall_foxy", "wfoxy_wbonny", "toy_chica_hallway", "toy_freddy_near",
+                                 "toy_freddy_hallway", "withered_bonny_hallway", "withered_freddy_hallway"])
+imgs.add_variants("vent_l_clear", ["vent_l_chica", "office_bb_vent"])
+imgs.add_variants("vent_r_clear", ["vent_r_bonnie"])
+imgs.add_variants("stage_full", ["stage_freddy_chica", "stage_bonnie_freddy", "stage_freddy"])
+imgs.add_variants("stage_full_light", ["stage_freddy_chica_light", "stage_bonnie_freddy_light", "stage_freddy_light"])
+imgs.add_variants("party_room1_clear_light", ["party_room1_withered_bonny_light", "party_room1_toy_chica_light"])
+imgs.add_variants("party_room2_clear", ["party_room2_toy_bonnie", "party_room2_withered_chica"])
+imgs.add_variants("party_room2_clear_light", ["party_room2_toy_bonnie_light", "party_room2_withered_chica_light"])
+imgs.add_variants("party_room3_clear", ["party_room3_withered_freddy"])
+imgs.add_variants("party_room3_clear_light", ["party_room3_toy_bonny_light"])
+imgs.add_variants("party_room4_clear", ["party_room4_toy_bonny"])
+imgs.add_variants("party_room4_clear_light", ["party_room4_toy_bonny_light", "party_room4_toy_chica_light",
+                                              "party_room4_withered_chica_light", "party_room4_withered_freddy_light"])
+imgs.add_variants("game_area_clear", ["game_area_bb", "game_area_bb_and_toy_freddy"])
+imgs.add_variants("game_area_clear_light", ["game_area_bb_light", "game_area_toy_freddy_light"])
+imgs.add_variants("main_hall_clear", ["main_hall_toy_chica"])
+imgs.add_variants("main_hall_clear_light", ["main_hall_toy_chica_light", "withered_bonny_main_hall_light",
+                                            "withered_freddy_mail_hall_light"])
+imgs.add_variants("left_air_vent_clear_light", ["left_air_vent_withered_bonny"])
+imgs.add_variants("right_air_vent_clear_light", ["right_air_vent_toy_bonny_light", "right_air_vent_withered_chica_light"])
+imgs.add_variants("parts_service_clear_light", ["parts_service_all_light", "parts_service_without_foxy_and_bonny_light",
+                                                "parts_service_withered_foxy_light"])
 
 jumpscares = {
-    "Toy Bonnie": load_gif_frames("FNaF_2_Toy_Bonnie_Jumpscare.gif"),
-    "Toy Chica": load_gif_frames("FNaF_2_Toy_Chica_Jumpscare.gif"),
-    "Withered Foxy": load_gif_frames("FNaF_2_Withered_Foxy_Jumpscare.gif"),
-    "Puppet": load_gif_frames("PuppetJumpScare.gif"),
-    "Withered Freddy": load_gif_frames("WitheredFreddyJumpscare.gif"),
-    "Withered Bonny": load_gif_frames("WitheredBonnyJumpscare.gif"),
-    "Withered Chica": load_gif_frames("WitheredChicaJumpscare.gif"),
-    "Toy Freddy": load_gif_frames("ToyBonnyJumpscare.gif"),
-}
-
-checks = {
-    "Toy Bonnie_fail": load_gif_frames("ToyBonnieShake.gif", office_size),
-    "Toy Chica_fail": load_gif_frames("ToyChicaShake.gif", office_size),
-    "Withered Freddy_fail": load_gif_frames("WitheredFreddyCheck.png", office_size),
-    "Withered Bonny_fail": load_gif_frames("WitheredBonnyCheck.png", office_size),
-    "Withered Chica_fail": load_gif_frames("WitheredChicaCheck.png", office_size),
-    "Toy Freddy_fail": load_gif_frames("ToyFreddyCheck.png", office_size),
+    "Toy Bonnie": FrameStream("FNaF_2_Toy_Bonnie_Jumpscare.gif"),
+    "Toy Chica": FrameStream("FNaF_2_Toy_Chica_Jumpscare.gif"),
+    "Withered Foxy": FrameStream("FNaF_2_Withered_Foxy_Jumpscare.gif"),
+    "Puppet": FrameStream("PuppetJumpScare.gif"),
+    "Withered Freddy": FrameStream("WitheredFreddyJumpscare.gif"),
+    "Withered Bonny": FrameStream("WitheredBonnyJumpscare.gif"),
+    "Withered Chica": FrameStream("WitheredChicaJumpscare.gif"),
+    "Toy Freddy": FrameStream("ToyBonnyJumpscare.gif"),
 }
 
-puppet_dance_frames = load_gif_frames("PuppetDance.gif")
-monitor_up_frames = load_gif_frames("MonitorUp.gif")
-monitor_down_frames = load_gif_frames("MonitorDown.gif")
-mask_equip_frames = load_gif_frames("MaskEquip.gif")
-mask_unequip_frames = load_gif_frames("MaskUnequip.gif")
-pomexi_frames = load_gif_frames("Pomexi.gif")
-orange_alert_frames = load_gif_frames("Orange_Alert.gif", (100, 100))
-red_alert_frames = load_gif_frames("Red_Alert.gif", (100, 100))
-six_am_frames = load_gif_frames("6AM.gif")
+checks = LazyAssets("checks", decode_gif_frames, finish_gif_frames, {
+    "Toy Bonnie_fail": ("ToyBonnieShake.gif", "office"),
+    "Toy Chica_fail": ("ToyChicaShake.gif", "office"),
+    "Withered Freddy_fail": ("WitheredFreddyCheck.png", "office"),
+    "Withered Bonny_fail": ("WitheredBonnyCheck.png", "office"),
+    "Withered Chica_fail": ("WitheredChicaCheck.png", "office"),
+    "Toy Freddy_fail": ("ToyFreddyCheck.png", "office"),
+})
+
+class TextureAtlas:
+    # Мелкие картинки (лица, иконки, кнопки) раскладываются полками в общие страницы,
+    # все видимые за кадр рисуются одним Surface.blits(). Страницы учитываются в AssetBudget
+    # одной записью группы "atlas"; вытесненный атлас пересобирается при следующем обращении
+    name = "atlas"
+
+    def __init__(self, assets, keys, page_size=1024):
+        self.assets = assets
+        self.keys = keys
+        self.page_size = page_size
+        self.pages = []
+        self.rects = {}
+
+    def build(self):
+        if self.pages:
+            return
+        jobs = self.assets.missing_jobs(self.keys)
+        self.assets.store_all([key for key, _ in jobs], asset_loader.load_many([job for _, job in jobs]))
+        surfaces = {key: self.assets[key] for key in self.keys}
+        # Непрозрачные картинки - на страницу без альфы, остальные - на страницу с альфой
+        for opaque in (True, False):
+            keys = sorted((key for key in self.keys if (surface_mode(surfaces[key]) == "opaque") == opaque),
+                          key=lambda key: -surfaces[key].get_height())
+            placed = []
+            x = y = shelf_h = 0
+            for key in keys:
+                w, h = surfaces[key].get_size()
+                if x + w > self.page_size:
+                    x, y, shelf_h = 0, y + shelf_h, 0
+                if placed and y + h > self.page_size:
+                    self._add_page(placed, surfaces, opaque)
+                    placed, x, y, shelf_h = [], 0, 0, 0
+                placed.append((key, pygame.Rect(x, y, w, h)))
+                x += w
+                shelf_h = max(shelf_h, h)
+            if placed:
+                self._add_page(placed, surfaces, opaque)
+        # Отдельные копии больше не нужны - в бюджете их место занимают страницы
+        for key in self.keys:
+            self.assets.unload(key)
+        asset_budget.add(self, "pages", list(self.pages))
+
+    def _add_page(self, placed, surfaces, opaque):
+        width = max(rect.right for _, rect in placed)
+        height = max(rect.bottom for _, rect in placed)
+        page = pygame.Surface((width, height), 0 if opaque else pygame.SRCALPHA)
+        page = page.convert() if opaque else page.convert_alpha()
+        page.fill((0, 0, 0, 0))
+        for key, rect in placed:
+            page.blit(surfaces[key], rect)
+            self.rects[key] = (page, rect)
+        self.pages.append(page)
+
+    def invalidate(self):
+        # После смены разрешения: страницы пересобираются при следующем обращении
+        asset_budget.remove(self, "pages")
+        self.pages = []
+        self.rects = {}
+
+    def unload(self, key):
+        # Вызывается AssetBudget при вытеснении
+        self.invalidate()
+
+    def _use(self):
+        self.build()
+        asset_budget.touch(self, "pages")
+
+    def get_size(self, key):
+        self._use()
+        return self.rects[key][1].size
+
+    def blits(self, target, items):
+        # items: [(ключ, позиция), ...]
+        self._use()
+        target.blits([(self.rects[key][0], pos, self.rects[key][1]) for key, pos in items], doreturn=False)
+
+ui_atlas = TextureAtlas(imgs, ["bug_icon", "tg_icon", "tiktok_icon", "monitor_button", "mask_button",
+                               "toy_bonnie_face", "toy_bonnie_face2", "toy_bonnie_face3",
+                               "toy_chica_face", "toy_chica_face2", "toy_chica_face3",
+                               "withered_foxy_face", "withered_foxy_face2", "withered_foxy_face3",
+                               "puppet_face", "bb_face", "bb_face2", "bb_face3", "bb_face4",
+                               "withered_bonny_face", "withered_freddy_face", "withered_chica_face",
+                               "toy_freddy_face"])
+
+# Что подгрузить заранее при входе в каждое состояние игры (мелочь из ui_atlas собирается один раз)
+imgs.add_group("MENU", ["menu"])
+imgs.add_group("PLAY", ["main", "mask", "office_bb",
+                        "hall_clear", "vent_l_clear", "vent_r_clear", "puppet_box_no_light"])
+imgs.add_group("MODS", [])
+
+puppet_dance_stream = FrameStream("PuppetDance.gif")
+six_am_stream = FrameStream("6AM.gif")
+
+def release_streams():
+    for stream in list(jumpscares.values()) + [puppet_dance_stream, six_am_stream]:
+        stream.release()
+
+anims = LazyAssets("anims", decode_gif_frames, finish_gif_frames, {
+    "monitor_up": ("MonitorUp.gif",),
+    "monitor_down": ("MonitorDown.gif",),
+    "mask_equip": ("MaskEquip.gif",),
+    "mask_unequip": ("MaskUnequip.gif",),
+    "pomexi": ("Pomexi.gif",),
+    "orange_alert": ("Orange_Alert.gif", (100, 100)),
+    "red_alert": ("Red_Alert.gif", (100, 100)),
+})
+
+anims.add_group("PLAY", list(anims.keys()))
+
+def preload_state(state):
+    # Все недостающие ресурсы состояния декодируются параллельно одним пакетом
+    batches = [(assets, assets.missing_jobs(assets.groups.get(state, []))) for assets in (imgs, checks, anims)]
+    results = asset_loader.load_many([job for _, jobs in batches for _, job in jobs])
+    for assets, jobs in batches:
+        assets.store_all([key for key, _ in jobs], results[:len(jobs)])
+        results = results[len(jobs):]
+    ui_atlas.build()
+    surface_cache.save_index()
 
 jumpscare_sound = load_sound("JumpScare1.mp3")
 foxy_line1_sound = load_sound("FoxyLine1.mp3")
@@ -360,9 +1888,13 @@ class SimpleBeatDetector:
                             (8.0, 12), (8.25, 5), (8.5, 8), (8.75, 5), (9.0, 12), (9.25, 5), (9.5, 8), (9.75, 5)]
         self.pattern_duration = 10.0
         self.last_beat_time = -1
+        self.last_update = None
 
     def update(self, music_position_sec):
-        self.shake_intensity *= self.shake_decay
+        # shake_decay - затухание за кадр при 30 FPS; пересчитывается на реальный интервал между вызовами
+        if self.last_update is not None:
+            self.shake_intensity *= self.shake_decay ** (max(0.0, music_position_sec - self.last_update) / (1 / 30))
+        self.last_update = music_position_sec
         loop_position = music_position_sec % self.pattern_duration
         for beat_time, strength in self.beat_pattern:
             if abs(loop_position - beat_time) < 0.05:
@@ -371,6 +1903,11 @@ class SimpleBeatDetector:
                     self.last_beat_time = music_position_sec
                     break
 
+    def time_to_next_beat(self, music_position_sec, lead=0.0):
+        # Секунды до ближайшего бита, до которого еще больше lead (более близкие уже ловит update)
+        loop_position = music_position_sec % self.pattern_duration
+        return min((beat_time - loop_position - lead) % self.pattern_duration + lead for beat_time, _ in self.beat_pattern)
+
     def get_shake_offset(self):
         if self.shake_intensity > 0.5:
             return (int(random.uniform(-self.shake_intensity, self.shake_intensity)),
@@ -380,6 +1917,7 @@ class SimpleBeatDetector:
     def reset(self):
         self.shake_intensity = 0
         self.last_beat_time = -1
+        self.last_update = None
 
 bug_report_text = ""
 bug_report_category = ""
@@ -403,39 +1941,71 @@ def get_time_until_next_report():
     time_remaining = max(0, BUG_REPORT_COOLDOWN - (time.time() - last_bug_report_time))
     return int(time_remaining // 60), int(time_remaining % 60)
 
+# Логика ночи (ходы аниматроников, часы, разряд шкатулки) идет фиксированными шагами по SIM_STEP_MS
+# своего времени sim_time_ms, а не по реальным кадрам: результат не зависит от частоты кадров и просадок.
+# За один кадр догоняем не больше SIM_MAX_STEPS шагов, чтобы долгая загрузка не прокручивала ночь вперед
+SIM_STEP_MS = 20
+SIM_MAX_STEPS = 10
+# Состояния, в которых идет ночь: пока монитор поднимается/опускается, таймеры аниматроников не стоят
+SIM_STATES = ("PLAY", "CHECKING", "MONITOR_OPENING", "MONITOR_CLOSING")
+sim_time_ms = 0
+sim_accumulator = 0
+
+# Случайные события (танец Марионетки, Shadow Freddy) подбирались как шанс на кадр при 30 FPS.
+# Теперь бросок идет раз в шаг симуляции, а шанс пересчитан так, чтобы частота в секунду не изменилась
+LEGACY_FRAME_MS = 1000 / 30
+
+def step_chance(frame_chance):
+    return 1 - (1 - frame_chance) ** (SIM_STEP_MS / LEGACY_FRAME_MS)
+
+PUPPET_DANCE_CHANCE = step_chance(0.08)
+SHADOW_FREDDY_CHANCE = step_chance(0.001)
+
 class Animatronic:
     def __init__(self, name, start_pos, target_pos, ai_level, interval=5000):
         self.name = name
         self.start_pos = start_pos
+        self.registry = None
         self.pos = start_pos
         self.target_name = target_pos
         self.ai_level = ai_level
         self.interval = interval
-        self.last_think = pygame.time.get_ticks()
+        self.last_think = sim_time_ms
         self.think_interval = interval
         self.foxy_unwatched_time = 0
         self.foxy_watched_time = 0
         self.vent_arrival_time = 0
         self.status_msg = "Waiting"
         self.charge = 100.0 if name == "Puppet" else None
-        self.last_discharge = pygame.time.get_ticks()
+        self.last_discharge = sim_time_ms
         self.discharge_time = 0
 
+    @property
+    def pos(self):
+        return self._pos
+
+    @pos.setter
+    def pos(self, pos):
+        # Каждое перемещение сразу попадает в индекс комнат реестра
+        old, self._pos = getattr(self, "_pos", None), pos
+        if self.registry:
+            self.registry.moved(self, old, pos)
+
     def reset(self):
         self.pos = self.start_pos
-        self.last_think = pygame.time.get_ticks()
+        self.last_think = sim_time_ms
         self.think_interval = self.interval
         self.foxy_unwatched_time = 0
         self.foxy_watched_time = 0
         self.vent_arrival_time = 0
         self.status_msg = "Waiting"
-        self.last_discharge = pygame.time.get_ticks()
+        self.last_discharge = sim_time_ms
         self.discharge_time = 0
         if self.name == "Puppet":
             self.charge = 100.0
 
     def update(self, is_watching_hall, dt):
-        now = pygame.time.get_ticks()
+        now = sim_time_ms
         if self.ai_level == 0:
             return
 
@@ -457,7 +2027,7 @@ class Animatronic:
                 if now - self.last_think > self.think_interval:
                     self.last_think = now
                     if random.randint(1, 20) <= self.ai_level:
-                        if not any(b.pos == self.target_name for b in bots if b != self):
+                        if not self.registry.occupied(self.target_name, self):
                             self.pos = self.target_name
                             self.vent_arrival_time = now
                             self.status_msg = "ENTERING HALL"
@@ -486,7 +2056,7 @@ class Animatronic:
             if self.name == "Toy Chica":
                 if self.pos == "Stage":
                     if random.randint(1, 20) <= self.ai_level:
-                        if not any(b.pos == "Main Hall" for b in bots if b != self):
+                        if not self.registry.occupied("Main Hall", self):
                             self.pos = "Main Hall"
                             self.status_msg = "MOVING TO MAIN HALL"
                         else:
@@ -495,7 +2065,7 @@ class Animatronic:
                         self.status_msg = "Idle on Stage"
                 elif self.pos == "Main Hall":
                     if random.randint(1, 20) <= self.ai_level:
-                        if not any(b.pos == "Left Air Vent" for b in bots if b != self):
+                        if not self.registry.occupied("Left Air Vent", self):
                             self.pos = "Left Air Vent"
                             self.vent_arrival_time = now
                             play_sound(vent_crawl_sound)
@@ -506,7 +2076,7 @@ class Animatronic:
                         self.status_msg = "Idle in Main Hall"
                 elif self.pos == "Left Air Vent":
                     if random.randint(1, 20) <= self.ai_level:
-                        if not any(b.pos == "Office Vent Left" for b in bots if b != self):
+                        if not self.registry.occupied("Office Vent Left", self):
                             self.pos = "Office Vent Left"
                             self.vent_arrival_time = now
                             play_sound(vent_crawl_sound)
@@ -519,7 +2089,7 @@ class Animatronic:
             elif self.name == "Toy Bonnie":
                 if self.pos == "Stage":
                     if random.randint(1, 20) <= self.ai_level:
-                        if not any(b.pos == "Party Room2" for b in bots if b != self):
+                        if not self.registry.occupied("Party Room2", self):
                             self.pos = "Party Room2"
                             self.status_msg = "MOVING TO PARTY ROOM2"
                         else:
@@ -528,7 +2098,7 @@ class Animatronic:
                         self.status_msg = "Idle on Stage"
                 elif self.pos == "Party Room2":
                     if random.randint(1, 20) <= self.ai_level:
-                        if not any(b.pos == "Office Vent Right" for b in bots if b != self):
+                        if not self.registry.occupied("Office Vent Right", self):
                             self.pos = "Office Vent Right"
                             self.vent_arrival_time = now
                             play_sound(vent_crawl_sound)
@@ -541,7 +2111,7 @@ class Animatronic:
             elif self.name == "Balloon Boy":
                 if self.pos == "Left Air Vent":
                     if random.randint(1, 20) <= self.ai_level:
-                        if not any(b.pos == "Office Vent Left" for b in bots if b != self):
+                        if not self.registry.occupied("Office Vent Left", self):
                             self.pos = "Office Vent Left"
                             self.vent_arrival_time = now
                             self.status_msg = "ENTERING OFFICE VENT LEFT"
@@ -554,7 +2124,7 @@ class Animatronic:
                 if self.pos == "Parts Service":
                     if random.randint(1, 20) <= self.ai_level:
                         next_pos = random.choice(["Party Room3", "Main Hall"])
-                        if not any(b.pos == next_pos for b in bots if b != self):
+                        if not self.registry.occupied(next_pos, self):
                             self.pos = next_pos
                             self.status_msg = f"MOVING TO {next_pos}"
                         else:
@@ -563,7 +2133,7 @@ class Animatronic:
                         self.status_msg = "Idle in Parts Service"
                 elif self.pos in ["Party Room3", "Main Hall"]:
                     if random.randint(1, 20) <= self.ai_level:
-                        if not any(b.pos == "Hall" for b in bots if b != self):
+                        if not self.registry.occupied("Hall", self):
                             self.pos = "Hall"
                             self.status_msg = "ENTERING HALL"
                         else:
@@ -579,7 +2149,7 @@ class Animatronic:
                 if self.pos == "Parts Service":
                     if random.randint(1, 20) <= self.ai_level:
                         next_pos = random.choice(["Party Room2", "Party Room4"])
-                        if not any(b.pos == next_pos for b in bots if b != self):
+                        if not self.registry.occupied(next_pos, self):
                             self.pos = next_pos
                             self.status_msg = f"MOVING TO {next_pos}"
                         else:
@@ -588,7 +2158,7 @@ class Animatronic:
                         self.status_msg = "Idle in Parts Service"
                 elif self.pos in ["Party Room2", "Party Room4"]:
                     if random.randint(1, 20) <= self.ai_level:
-                        if not any(b.pos == "Right Air Vent" for b in bots if b != self):
+                        if not self.registry.occupied("Right Air Vent", self):
                             self.pos = "Right Air Vent"
                             self.vent_arrival_time = now
                             play_sound(vent_crawl_sound)
@@ -599,7 +2169,7 @@ class Animatronic:
                         self.status_msg = f"Idle in {self.pos}"
                 elif self.pos == "Right Air Vent":
                     if random.randint(1, 20) <= self.ai_level:
-                        if not any(b.pos == "Office Vent Right" for b in bots if b != self):
+                        if not self.registry.occupied("Office Vent Right", self):
                             self.pos = "Office Vent Right"
                             self.vent_arrival_time = now
                             play_sound(vent_crawl_sound)
@@ -613,7 +2183,7 @@ class Animatronic:
                 if self.pos == "Parts Service":
                     if random.randint(1, 20) <= self.ai_level:
                         next_pos = random.choice(["Party Room1", "Main Hall"])
-                        if not any(b.pos == next_pos for b in bots if b != self):
+                        if not self.registry.occupied(next_pos, self):
                             self.pos = next_pos
                             self.status_msg = f"MOVING TO {next_pos}"
                         else:
@@ -622,7 +2192,7 @@ class Animatronic:
                         self.status_msg = "Idle in Parts Service"
                 elif self.pos in ["Party Room1", "Main Hall"]:
                     if random.randint(1, 20) <= self.ai_level:
-                        if not any(b.pos == "Left Air Vent" for b in bots if b != self):
+                        if not self.registry.occupied("Left Air Vent", self):
                             self.pos = "Left Air Vent"
                             self.vent_arrival_time = now
                             play_sound(vent_crawl_sound)
@@ -633,7 +2203,7 @@ class Animatronic:
                         self.status_msg = f"Idle in {self.pos}"
                 elif self.pos == "Left Air Vent":
                     if random.randint(1, 20) <= self.ai_level:
-                        if not any(b.pos == "Office Vent Left" for b in bots if b != self):
+                        if not self.registry.occupied("Office Vent Left", self):
                             self.pos = "Office Vent Left"
                             self.vent_arrival_time = now
                             play_sound(vent_crawl_sound)
@@ -647,7 +2217,7 @@ class Animatronic:
                 if self.pos == "Stage":
                     if random.randint(1, 20) <= self.ai_level:
                         # Toy Freddy может делить Game Area с Balloon Boy
-                        other_in_game_area = any(b.pos == "Game Area" and b.name != "Balloon Boy" for b in bots if b != self)
+                        other_in_game_area = any(b.name != "Balloon Boy" for b in self.registry.occupants("Game Area") if b != self)
                         if not other_in_game_area:
                             self.pos = "Game Area"
                             self.status_msg = "MOVING TO GAME AREA"
@@ -657,7 +2227,7 @@ class Animatronic:
                         self.status_msg = "Idle on Stage"
                 elif self.pos == "Game Area":
                     if random.randint(1, 20) <= self.ai_level:
-                        if not any(b.pos == "Hall" for b in bots if b != self):
+                        if not self.registry.occupied("Hall", self):
                             self.pos = "Hall"
                             self.status_msg = "ENTERING HALL"
                         else:
@@ -692,6 +2262,38 @@ bots = [
     Animatronic("Toy Freddy", "Stage", "Hall", ai_level=0, interval=8000)
 ]
 
+class BotRegistry:
+    # Аниматроники по имени и по комнатам, чтобы не перебирать весь список на каждом ходу и кадре.
+    # Индекс комнат обновляет сеттер Animatronic.pos
+    def __init__(self, bots):
+        self.by_name = {}
+        self.rooms = {}
+        for bot in bots:
+            self.add(bot)
+
+    def add(self, bot):
+        self.by_name[bot.name] = bot
+        self.rooms.setdefault(bot.pos, set()).add(bot)
+        bot.registry = self
+
+    def moved(self, bot, old, new):
+        if old in self.rooms:
+            self.rooms[old].discard(bot)
+        self.rooms.setdefault(new, set()).add(bot)
+
+    def get(self, name):
+        return self.by_name.get(name)
+
+    def occupants(self, room):
+        return self.rooms.get(room, ())
+
+    def occupied(self, room, exclude=None):
+        # Есть ли в комнате кто-то, кроме exclude
+        occupants = self.rooms.get(room, ())
+        return len(occupants) > (exclude in occupants)
+
+bot_registry = BotRegistry(bots)
+
 custom_levels = {bot.name: bot.ai_level for bot in bots}
 
 nights_ai = {
@@ -724,15 +2326,15 @@ checking_bot = None
 check_type = ""
 check_start = 0
 success_start = 0
-js_frame_index = 0
-js_frame_index_alert = 0
+js_player = AnimationPlayer()
+check_player = AnimationPlayer(loop=True)
+alert_player = AnimationPlayer(loop=True)
 is_vent_light_playing = False
 is_hall_sound_playing = False
 camera_mode = False
 light_on = False
 charging = False
 last_charge = 0
-charge_button_rect = pygame.Rect(WIN_W // 2 - 50, WIN_H - 100, 100, 50)
 music_box_playing = False
 current_cam = '11'
 clock = pygame.time.Clock()
@@ -746,17 +2348,15 @@ bb_last_speak_time = 0
 bb_idle_start = 0
 bb_return_idle = False
 flash_error_playing = False
-monitor_animation_start = 0
-pomexi_frame = 0
+monitor_player = AnimationPlayer()
+pomexi_player = AnimationPlayer(loop=True)
 monitor_button_hovered = False
 mask_button_hovered = False
 current_night = 1
 is_custom_unlocked = False
 mask_animation_state = None
-mask_animation_start = 0
-mask_animation_frame = 0
-six_am_animation_start = 0
-six_am_frame_index = 0
+mask_player = AnimationPlayer()
+six_am_player = AnimationPlayer()
 six_am_sound_playing = False
 shadow_freddy_shown = False
 shadow_freddy_trigger_time = 0
@@ -789,7 +2389,8 @@ def save_progress():
         'current_night': current_night,
         'custom_unlocked': is_custom_unlocked,
         'last_bug_report_time': last_bug_report_time,
-        'installed_mod': installed_mod
+        'installed_mod': installed_mod,
+        'settings': settings
     }
     try:
         os.makedirs(save_dir, exist_ok=True)
@@ -802,79 +2403,378 @@ load_save()
 save_progress()
 scan_mods()
 
-puppet = next(b for b in bots if b.name == "Puppet")
-foxy = next(b for b in bots if b.name == "Withered Foxy")
+puppet = bot_registry.get("Puppet")
+foxy = bot_registry.get("Withered Foxy")
+
+# Прямоугольники кнопок раскладываются в compute_layout()
+cam_buttons = {str(i): {'label': f'CAM {i:02d}'} for i in range(1, 13)}
+
+# Что показывает камера: (комната, аниматроники, чье присутствие в ней меняет картинку,
+# правила (свет, {имя: есть ли в комнате}, ключ imgs)). Свет None - при любом, не названные в правиле - любые;
+# срабатывает первое подходящее правило. Камера 11 (шкатулка) рисуется отдельно
+CAMERA_VIEWS = {
+    '1': ("Party Room1", ["Withered Bonny", "Toy Chica"], [
+        (True, {"Withered Bonny": True}, "party_room1_withered_bonny_light"),
+        (True, {"Toy Chica": True}, "party_room1_toy_chica_light"),
+        (True, {}, "party_room1_clear_light"),
+        (False, {}, "party_room1_clear"),
+    ]),
+    '2': ("Party Room2", ["Toy Bonnie", "Withered Chica"], [
+        (True, {"Withered Chica": True}, "party_room2_withered_chica_light"),
+        (True, {"Toy Bonnie": True}, "party_room2_toy_bonnie_light"),
+        (True, {}, "party_room2_clear_light"),
+        (False, {"Withered Chica": True}, "party_room2_withered_chica"),
+        (False, {}, "party_room2_clear"),
+    ]),
+    '3': ("Game Area", ["Balloon Boy", "Toy Freddy"], [
+        (True, {"Balloon Boy": True, "Toy Freddy": True}, "game_area_bb_and_toy_freddy"),
+        (False, {"Balloon Boy": True}, "game_area_bb"),
+        (True, {"Toy Freddy": True}, "game_area_toy_freddy_light"),
+        (True, {"Balloon Boy": True}, "game_area_bb_light"),
+        (True, {}, "game_area_clear_light"),
+        (False, {}, "game_area_clear"),
+    ]),
+    '4': ("Main Hall", ["Toy Chica", "Withered Bonny", "Withered Freddy"], [
+        (True, {"Toy Chica": True}, "main_hall_toy_chica_light"),
+        (True, {"Withered Bonny": True}, "withered_bonny_main_hall_light"),
+        (True, {"Withered Freddy": True}, "withered_freddy_mail_hall_light"),
+        (True, {}, "main_hall_clear_light"),
+        (False, {"Toy Chica": True}, "main_hall_toy_chica"),
+        (False, {}, "main_hall_clear"),
+    ]),
+    '5': ("Left Air Vent", ["Withered Bonny"], [
+        (True, {"Withered Bonny": True}, "left_air_vent_withered_bonny"),
+        (True, {}, "left_air_vent_clear_light"),
+        (False, {}, "left_vent"),
+    ]),
+    '6': ("Right Air Vent", ["Toy Bonnie", "Withered Chica"], [
+        (True, {"Toy Bonnie": True}, "right_air_vent_toy_bonny_light"),
+        (True, {"Withered Chica": True}, "right_air_vent_withered_chica_light"),
+        (True, {}, "right_air_vent_clear_light"),
+        (False, {}, "right_air_vent_clear"),
+    ]),
+    '7': ("Party Room3", ["Toy Bonnie", "Withered Freddy"], [
+        (True, {"Toy Bonnie": True}, "party_room3_toy_bonny_light"),
+        (True, {"Withered Freddy": True}, "party_room4_withered_freddy_light"),
+        (True, {}, "party_room3_clear_light"),
+        (False, {"Withered Freddy": True}, "party_room3_withered_freddy"),
+        (False, {}, "party_room3_clear"),
+    ]),
+    # Пустая Parts Service при свете может показать Shadow Freddy (см. игровой цикл)
+    '8': ("Parts Service", ["Withered Foxy", "Withered Bonny", "Withered Chica", "Withered Freddy"], [
+        (True, {"Withered Foxy": False, "Withered Bonny": False, "Withered Chica": False, "Withered Freddy": False},
+         "parts_service_clear_light"),
+        (True, {"Withered Foxy": False, "Withered Bonny": False, "Withered Chica": False}, "parts_service_withered_freddy"),
+        (True, {"Withered Foxy": False, "Withered Bonny": False}, "parts_service_without_foxy_and_bonny_light"),
+        (True, {"Withered Foxy": True, "Withered Bonny": False}, "parts_service_withered_foxy_light"),
+        (True, {}, "parts_service_all_light"),
+        (False, {}, "parts_service_lo_light"),
+    ]),
+    '9': ("Stage", ["Toy Bonnie", "Toy Chica", "Toy Freddy"], [
+        (None, {"Toy Bonnie": False, "Toy Chica": False, "Toy Freddy": False}, "stage_clear"),
+        (True, {"Toy Bonnie": True, "Toy Chica": True}, "stage_full_light"),
+        (False, {"Toy Bonnie": True, "Toy Chica": True}, "stage_full"),
+        (True, {"Toy Chica": True}, "stage_freddy_chica_light"),
+        (False, {"Toy Chica": True}, "stage_freddy_chica"),
+        (True, {"Toy Bonnie": True}, "stage_bonnie_freddy_light"),
+        (False, {"Toy Bonnie": True}, "stage_bonnie_freddy"),
+        (True, {}, "stage_freddy_light"),
+        (False, {}, "stage_freddy"),
+    ]),
+    '10': ("Party Room4", ["Toy Bonnie", "Toy Chica", "Withered Chica"], [
+        (True, {"Toy Bonnie": True}, "party_room4_toy_bonny_light"),
+        (True, {"Toy Chica": True}, "party_room4_toy_chica_light"),
+        (True, {"Withered Chica": True}, "party_room4_withered_chica_light"),
+        (True, {}, "party_room4_clear_light"),
+        (False, {"Toy Bonnie": True}, "party_room4_toy_bonny"),
+        (False, {}, "party_room4_clear"),
+    ]),
+}
+
+def compile_camera_views(views):
+    # Правила перебираются один раз здесь: (камера, свет, битовая маска присутствия) -> ключ imgs
+    table = {}
+    for cam, (room, names, rules) in views.items():
+        for light in (False, True):
+            for mask in range(1 << len(names)):
+                for rule_light, present, key in rules:
+                    if rule_light in (None, light) and all(
+                            bool(mask >> names.index(name) & 1) == there for name, there in present.items()):
+                        table[(cam, light, mask)] = key
+                        break
+    return table
 
-map_pos = (WIN_W // 2, 0)
+camera_table = compile_camera_views(CAMERA_VIEWS)
 
-cam_buttons = {
-    str(i): {'rect': pygame.Rect(50 + (i-1)%3*120, 100 + (i-1)//3*100, 100, 60), 'label': f'CAM {i:02d}'}
-    for i in range(1, 13)
-}
+def camera_view(cam, light):
+    # -> (ключ imgs, маска присутствия) за один проход по нескольким аниматроникам камеры
+    room, names, _ = CAMERA_VIEWS[cam]
+    mask = 0
+    for i, name in enumerate(names):
+        bot = bot_registry.get(name)
+        if bot and bot.pos == room:
+            mask |= 1 << i
+    return camera_table[(cam, light, mask)], mask
 
 custom_pos_y = 200
 custom_characters = [b.name for b in bots]
-custom_rects_left = {}
-custom_rects_right = {}
-custom_level_rects = {}
-
-# Создаем позиции в 2 ряда: 5 сверху, 4 снизу
-char_positions = []
-spacing_x = WIN_W // 6  # Расстояние между персонажами по горизонтали
-
-# Верхний ряд (5 персонажей)
-for i in range(5):
-    x = WIN_W // 6 + i * spacing_x
-    y = custom_pos_y + 100
-    char_positions.append((x, y))
-
-# Нижний ряд (4 персонажа, по центру)
-for i in range(4):
-    x = WIN_W // 6 + spacing_x // 2 + i * spacing_x
-    y = custom_pos_y + 350
-    char_positions.append((x, y))
-
-for i, name in enumerate(custom_characters):
-    x, y = char_positions[i]
-    custom_rects_left[name] = pygame.Rect(x - 70, y + 90, 35, 35)
-    custom_rects_right[name] = pygame.Rect(x + 35, y + 90, 35, 35)
-    custom_level_rects[name] = pygame.Rect(x - 35, y + 90, 70, 35)
-
-rect_start_custom = pygame.Rect(WIN_W//2 - 100, custom_pos_y + 600, 200, 50)
 
 foxy_sequence_start = 0
 black_screen_alpha = 0
 foxy_sound_played = False
 foxy_sound_end = 0
 
-rect_bug = pygame.Rect(WIN_W - 170, 10, 50, 50)
-rect_tg = pygame.Rect(WIN_W - 110, 10, 50, 50)
-rect_tiktok = pygame.Rect(WIN_W - 50, 10, 50, 50)
-
-monitor_button_rect = pygame.Rect(WIN_W // 2 + 50, WIN_H - 60, 650, 40)
-mask_button_rect = pygame.Rect(WIN_W // 2 - 700, WIN_H - 60, 650, 40)
-
 menu_buttons = [
     {"text": "ИГРАТЬ", "action": "new_game"},
     {"text": "ПРОДОЛЖИТЬ", "action": "continue"},
     {"text": "КАСТОМ НАЙТ", "action": "custom"},
-    {"text": "МОДЫ", "action": "mods"}
+    {"text": "МОДЫ", "action": "mods"},
+    {"text": "НАСТРОЙКИ", "action": "settings"}
 ]
 
-menu_font = pygame.font.SysFont("Arial", 60, bold=True)
-menu_button_y_start = WIN_H // 2 - 100
+menu_font = fonts.get("Arial", 60, bold=True)
 menu_button_spacing = 80
 menu_selected = -1
-menu_button_rects = []
 
-for i, btn in enumerate(menu_buttons):
-    text_surf = menu_font.render(btn["text"], True, (255, 255, 255))
-    y = menu_button_y_start + (i if i <= 2 else 3) * menu_button_spacing
-    menu_button_rects.append(pygame.Rect(200, y, text_surf.get_width(), text_surf.get_height()))
+SETTINGS_ROWS = ["resolution", "fullscreen", "render_scale", "dirty_rects", "frame_rate", "palettized_animations"]
+SETTINGS_ROW_STEP = 80
+SETTINGS_TITLE_H = 130
+
+def compute_layout():
+    # Все прямоугольники и позиции, зависящие от размера окна; пересчитываются при смене разрешения
+    global map_size, map_pos, charge_button_rect, char_positions, custom_rects_left, custom_rects_right
+    global custom_level_rects, rect_start_custom, rect_bug, rect_tg, rect_tiktok, monitor_button_rect
+    global mask_button_rect, menu_button_y_start, menu_button_rects, settings_rects, settings_title_y
+    map_size = (WIN_W // 2, WIN_H)
+    map_pos = (WIN_W // 2, 0)
+    charge_button_rect = pygame.Rect(WIN_W // 2 - 50, WIN_H - 100, 100, 50)
+
+    # Кнопки камер - сетка 3x4 на карте; на маленькой карте шаг сетки ужимается
+    step_x = min(120, (map_size[0] - 60) // 3)
+    step_y = min(100, (map_size[1] - 160) // 4)
+    for cam_id, cam_data in cam_buttons.items():
+        i = int(cam_id) - 1
+        cam_data['rect'] = pygame.Rect(50 + i % 3 * step_x, 100 + i // 3 * step_y, step_x - 20, min(60, step_y - 10))
+
+    # Создаем позиции в 2 ряда: 5 сверху, 4 снизу
+    char_positions = []
+    spacing_x = UI_W // 6  # Расстояние между персонажами по горизонтали
+
+    # Верхний ряд (5 персонажей)
+    for i in range(5):
+        x = UI_W // 6 + i * spacing_x
+        y = custom_pos_y + 100
+        char_positions.append((x, y))
+
+    # Нижний ряд (4 персонажа, по центру)
+    for i in range(4):
+        x = UI_W // 6 + spacing_x // 2 + i * spacing_x
+        y = custom_pos_y + 350
+        char_positions.append((x, y))
+
+    custom_rects_left = {}
+    custom_rects_right = {}
+    custom_level_rects = {}
+    for i, name in enumerate(custom_characters):
+        x, y = char_positions[i]
+        custom_rects_left[name] = pygame.Rect(x - 70, y + 90, 35, 35)
+        custom_rects_right[name] = pygame.Rect(x + 35, y + 90, 35, 35)
+        custom_level_rects[name] = pygame.Rect(x - 35, y + 90, 70, 35)
+
+    rect_start_custom = pygame.Rect(UI_W//2 - 100, custom_pos_y + 600, 200, 50)
+
+    rect_bug = pygame.Rect(UI_W - 170, 10, 50, 50)
+    rect_tg = pygame.Rect(UI_W - 110, 10, 50, 50)
+    rect_tiktok = pygame.Rect(UI_W - 50, 10, 50, 50)
+
+    button_w, button_h = resolve_size("hud_button")
+    monitor_button_rect = pygame.Rect(WIN_W // 2 + 50, WIN_H - 60, button_w, button_h)
+    mask_button_rect = pygame.Rect(WIN_W // 2 - 50 - button_w, WIN_H - 60, button_w, button_h)
+
+    menu_button_y_start = UI_H // 2 - 100
+    menu_button_rects = []
+    for i, btn in enumerate(menu_buttons):
+        text_surf = render_text(menu_font, btn["text"], True, (255, 255, 255))
+        y = menu_button_y_start + i * menu_button_spacing
+        menu_button_rects.append(pygame.Rect(200, y, text_surf.get_width(), text_surf.get_height()))
+
+    # Колонка настроек (заголовок, строки через SETTINGS_ROW_STEP, "Назад") центрируется по высоте целиком:
+    # новая строка сдвигает колонку, а не выталкивает кнопку за край экрана
+    settings_title_y = (UI_H - SETTINGS_TITLE_H - len(SETTINGS_ROWS) * SETTINGS_ROW_STEP - 50) // 2
+    settings_rects = {}
+    for i, row in enumerate(SETTINGS_ROWS):
+        y = settings_title_y + SETTINGS_TITLE_H + i * SETTINGS_ROW_STEP
+        if row == "resolution":
+            settings_rects["resolution_left"] = pygame.Rect(UI_W // 2 + 20, y, 40, 40)
+            settings_rects["resolution_right"] = pygame.Rect(UI_W // 2 + 260, y, 40, 40)
+        else:
+            settings_rects[row] = pygame.Rect(UI_W // 2 + 20, y, 280, 40)
+    settings_rects["back"] = pygame.Rect(UI_W // 2 - 100, settings_title_y + SETTINGS_TITLE_H + len(SETTINGS_ROWS) * SETTINGS_ROW_STEP, 200, 50)
+
+compute_layout()
+
+def apply_display_settings():
+    # Смена разрешения и режима окна на лету. Поверхности под старый размер выгружаются,
+    # заново масштабируется только то, что понадобится (текущее состояние - сразу, остальное - при обращении)
+    set_display_mode()
+    compute_layout()
+    for assets in (imgs, checks, anims):
+        assets.invalidate_sizes()
+    ui_atlas.invalidate()
+    surface_pool.clear()
+    release_streams()
+    preload_state(game_state)
+    save_progress()
 
 beat_detector = SimpleBeatDetector()
 menu_music_start_time = 0
 
+class IdleScheduler:
+    # На статичных экранах цикл не рисует кадр за кадром одно и то же: ждет ввода, а если
+    # на экране что-то идет по времени (бит музыки в меню, мигающий курсор) - просыпается к нему.
+    # Заодно считает время CPU главного потока по состояниям
+    IDLE_STATES = ("MENU", "CUSTOM", "MODS", "BUG_REPORT", "GAMEOVER")
+    IDLE_TICK_MS = 250
+    POLL_MS = 10
+    BEAT_LEAD = 0.03
+
+    def __init__(self):
+        self.states = {}  # состояние -> [кадры, CPU в с, время в с]
+        self.mark = (time.thread_time(), time.perf_counter())
+
+    def wake_in(self, state):
+        # -> мс до следующей нужной перерисовки, 0 - рисовать сразу
+        if state not in self.IDLE_STATES or not settings["idle_throttle"]:
+            return 0
+        now = pygame.time.get_ticks()
+        if state == "MENU":
+            if beat_detector.shake_intensity > 0.5:
+                return 0
+            # Просыпаемся чуть раньше бита, чтобы update поймал его в своем окне
+            to_beat = beat_detector.time_to_next_beat((now - menu_music_start_time) / 1000.0, self.BEAT_LEAD)
+            return min(self.IDLE_TICK_MS, int((to_beat - self.BEAT_LEAD) * 1000))
+        if state == "BUG_REPORT":
+            # Курсор мигает по полсекунды
+            return min(self.IDLE_TICK_MS, 500 - now % 500)
+        return self.IDLE_TICK_MS
+
+    def wait(self, state):
+        # Событие из очереди не забирается - его разберет обычный цикл
+        deadline = pygame.time.get_ticks() + self.wake_in(state)
+        while not pygame.event.peek():
+            left = deadline - pygame.time.get_ticks()
+            if left <= 0:
+                break
+            pygame.time.wait(min(left, self.POLL_MS))
+
+    def account(self, state):
+        cpu, wall = time.thread_time(), time.perf_counter()
+        stats = self.states.setdefault(state, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += cpu - self.mark[0]
+        stats[2] += wall - self.mark[1]
+        self.mark = (cpu, wall)
+
+    def report(self):
+        for state, (frames, cpu, wall) in sorted(self.states.items(), key=lambda item: -item[1][1]):
+            print(f"{state:16} {frames:6} frames {wall:7.1f} s  {frames / max(wall, 1e-9):6.1f} fps  "
+                  f"CPU {cpu * 1000 / frames:6.2f} ms/frame, {cpu * 100 / max(wall, 1e-9):5.1f}% of wall time")
+
+idle_scheduler = IdleScheduler()
+cpu_report = "--cpu-report" in sys.argv
+
+class PreloadScheduler:
+    # По позициям аниматроников и заряду шкатулки заранее прогревает то, что может
+    # понадобиться в ближайшие секунды: скример, проверку офиса, танец Марионетки и 6 AM
+    APPROACH = ["Hall", "Office Vent Left", "Office Vent Right", "Office"]
+
+    def __init__(self):
+        self.warmed = 0
+        self.ready = 0
+        self.late = 0
+
+    def predict(self):
+        streams, check_keys = [], []
+        for bot in bots:
+            if bot.pos in self.APPROACH:
+                streams.append(jumpscares.get(bot.name))
+                check_keys.append(f"{bot.name}_fail")
+        if puppet.pos != "Box" or puppet.charge < 20:
+            streams += [puppet_dance_stream, jumpscares.get("Puppet")]
+        if hour == 5 and game_time_ms >= HOUR_DURATION - 5000:
+            streams.append(six_am_stream)
+        return [stream for stream in streams if stream], [key for key in check_keys if key in checks]
+
+    def update(self):
+        streams, check_keys = self.predict()
+        for stream in streams:
+            stream.prefetch()
+        for key in check_keys:
+            if key not in checks.pending and checks.prefetch(key):
+                self.warmed += 1
+        checks.collect()
+
+    def record(self, state):
+        # Успели ли прогреть ресурс к моменту перехода в CHECKING/JUMPSCARE
+        if state == "CHECKING" and checking_bot:
+            ready = checks.is_loaded(f"{checking_bot.name}_fail") or f"{checking_bot.name}_fail" not in checks
+        elif state == "JUMPSCARE" and active_js_bot in jumpscares:
+            ready = jumpscares[active_js_bot].frames is not None
+        else:
+            return
+        if ready:
+            self.ready += 1
+        else:
+            self.late += 1
+
+preload_scheduler = PreloadScheduler()
+
+def office_viewport():
+    # Видимая часть панорамы офиса (шире экрана): целое смещение вместо дробного office_x,
+    # blit берет только эту область, а не всю картинку
+    return pygame.Rect(-int(office_x), 0, WIN_W, WIN_H)
+
+def draw_office(img):
+    # Плавно ведет панораму за мышью и рисует офис (и Balloon Boy в нем) через office_viewport
+    global office_x
+    mouse_x, _ = get_mouse_pos()
+    target_x = -(mouse_x / WIN_W) * (imgs["main"].get_width() - WIN_W)
+    # 0.1 пути за кадр при 30 FPS - пересчитано на реальную длину кадра, чтобы скорость не зависела от FPS
+    office_x += (target_x - office_x) * (1 - 0.9 ** (dt / 33.3))
+    viewport = office_viewport()
+    blit_img(screen, img, (0, 0), viewport)
+    if bb_in_office:
+        screen.blit(imgs["office_bb"], (0, 0), viewport)
+
+# Служебные слои кадра: их рисует главный цикл, а --trace-alloc и --self-test меряют те же функции
+POMEXI_ALPHA = 89
+
+def draw_pomexi_overlay(target, player, frames):
+    # Полупрозрачный шум Pomexi поверх камеры через холст плеера; True, если кадр нарисован
+    if not player.frame(frames):
+        return False
+    player.blit(target, alpha=POMEXI_ALPHA)
+    return True
+
+def draw_map_backdrop(target):
+    target.blit(surface_pool.get(map_size, pygame.SRCALPHA, (20, 20, 20, 200)), map_pos)
+
+def draw_dev_backdrop(target):
+    target.blit(surface_pool.get((420, 130), pygame.SRCALPHA, (0, 0, 0, 180)), (10, 10))
+
+def draw_fade(target, alpha):
+    # Затемнение FOXY_SEQUENCE
+    black_surf = surface_pool.get((WIN_W, WIN_H), 0, (0, 0, 0))
+    black_surf.set_alpha(int(alpha))
+    target.blit(black_surf, (0, 0))
+
+def draw_pooled_layers(target, player, frames, i):
+    # Все служебные слои одного кадра - как в PLAY (камера, dev-панель) и FOXY_SEQUENCE
+    draw_pomexi_overlay(target, player, frames)
+    draw_map_backdrop(target)
+    draw_dev_backdrop(target)
+    draw_fade(target, i % 256)
+
 def set_ai_levels():
     if is_custom_night:
         for bot in bots:
@@ -887,33 +2787,527 @@ def set_ai_levels():
             foxy.ai_level = 0
 
 def reset_game():
-    global game_time_ms, hour, office_x, mask_on, mask_on_start, is_breathing_playing, active_js_bot, checking_bot, check_type, check_start, success_start, js_frame_index, js_frame_index_alert, is_vent_light_playing, is_hall_sound_playing, camera_mode, light_on, charging, last_charge, music_box_playing, current_cam, foxy_sequence_start, black_screen_alpha, foxy_sound_played, foxy_sound_end, bb_sound_count, bb_move_time, bb_mask_start, bb_in_office, bb_laugh_playing, bb_last_speak_time, bb_idle_start, bb_return_idle, flash_error_playing, monitor_animation_start, pomexi_frame, monitor_button_hovered, mask_button_hovered, mask_animation_state, mask_animation_start, mask_animation_frame, shadow_freddy_shown, shadow_freddy_trigger_time
+    global game_time_ms, hour, office_x, mask_on, mask_on_start, is_breathing_playing, active_js_bot, checking_bot, check_type, check_start, success_start, is_vent_light_playing, is_hall_sound_playing, camera_mode, light_on, charging, last_charge, music_box_playing, current_cam, foxy_sequence_start, black_screen_alpha, foxy_sound_played, foxy_sound_end, bb_sound_count, bb_move_time, bb_mask_start, bb_in_office, bb_laugh_playing, bb_last_speak_time, bb_idle_start, bb_return_idle, flash_error_playing, monitor_button_hovered, mask_button_hovered, mask_animation_state, shadow_freddy_shown, shadow_freddy_trigger_time, sim_accumulator
 
     for bot in bots:
         bot.reset()
 
     set_ai_levels()
 
-    game_time_ms = hour = office_x = mask_on_start = check_start = success_start = js_frame_index = js_frame_index_alert = foxy_sequence_start = black_screen_alpha = foxy_sound_end = bb_sound_count = bb_move_time = bb_mask_start = bb_idle_start = monitor_animation_start = pomexi_frame = mask_animation_start = mask_animation_frame = shadow_freddy_trigger_time = 0
+    game_time_ms = hour = office_x = mask_on_start = check_start = success_start = foxy_sequence_start = black_screen_alpha = foxy_sound_end = bb_sound_count = bb_move_time = bb_mask_start = bb_idle_start = shadow_freddy_trigger_time = sim_accumulator = 0
     hour = 12
-    last_charge = bb_last_speak_time = bb_idle_start = pygame.time.get_ticks()
+    last_charge = sim_time_ms
+    bb_last_speak_time = bb_idle_start = sim_time_ms
     mask_on = is_breathing_playing = camera_mode = light_on = charging = music_box_playing = foxy_sound_played = bb_in_office = bb_laugh_playing = bb_return_idle = flash_error_playing = monitor_button_hovered = mask_button_hovered = shadow_freddy_shown = False
     active_js_bot = checking_bot = check_type = mask_animation_state = None
     is_vent_light_playing = is_hall_sound_playing = False
     current_cam = '11'
 
+def update_balloon_boy():
+    # Шаг симуляции Balloon Boy: голос в Game Area, уход в вентиляцию, маска и выход в офис.
+    # Все таймеры - по sim_time_ms, как у остальных аниматроников
+    global bb_idle_start, bb_last_speak_time, bb_sound_count, bb_move_time, bb_mask_start, bb_return_idle, bb_in_office
+    now = sim_time_ms
+    bb_bot = bot_registry.get("Balloon Boy")
+
+    if bb_bot and bb_bot.ai_level > 2 and bb_bot.pos == "Game Area":
+        if now - bb_idle_start >= 15000:
+            interval = 12000 if bb_bot.ai_level <= 6 else (8000 if bb_bot.ai_level <= 12 else random.choice([5000, 6000, 7000, 7500]))
+
+            if now - bb_last_speak_time >= interval:
+                bb_last_speak_time = now
+                play_sound(random.choice([bb_hi, bb_hello]))
+                bb_sound_count += 1
+                if bb_sound_count == 4:
+                    bb_move_time = now + 1000
+
+    if bb_bot and bb_bot.pos == "Game Area" and bb_move_time > 0 and now >= bb_move_time:
+        if not bot_registry.occupied("Left Air Vent", bb_bot):
+            bb_bot.pos = "Left Air Vent"
+            bb_sound_count = bb_move_time = 0
+            bb_bot.status_msg = "MOVING TO LEFT AIR VENT"
+
+    if bb_bot and bb_bot.pos == "Office Vent Left":
+        if mask_on:
+            if bb_mask_start == 0:
+                bb_mask_start = now
+            elif now - bb_mask_start >= 5000:
+                bb_bot.pos = "Game Area"
+                bb_mask_start = 0
+                bb_bot.status_msg = "RETURNING TO GAME AREA"
+                bb_idle_start = now
+                bb_return_idle = True
+        else:
+            bb_mask_start = 0
+
+        if now - bb_bot.vent_arrival_time >= 10000:
+            bb_bot.pos = "Office"
+            bb_in_office = True
+            bb_bot.status_msg = "IN OFFICE"
+
+def advance_sim(dt, show_hall):
+    # Догоняет логику ночи на dt мс реального времени фиксированными шагами SIM_STEP_MS
+    global sim_accumulator, sim_time_ms, game_time_ms, hour, game_state, is_breathing_playing, is_vent_light_playing, is_hall_sound_playing, music_box_playing, charging, bb_laugh_playing, flash_error_playing, six_am_sound_playing, shadow_freddy_shown, shadow_freddy_trigger_time
+    sim_accumulator += min(dt, SIM_STEP_MS * SIM_MAX_STEPS)
+    while sim_accumulator >= SIM_STEP_MS and game_state in SIM_STATES:
+        sim_accumulator -= SIM_STEP_MS
+        sim_time_ms += SIM_STEP_MS
+        game_time_ms += SIM_STEP_MS
+        if game_time_ms >= HOUR_DURATION:
+            game_time_ms = 0
+            hour = 1 if hour == 12 else hour + 1
+            if not is_custom_night and hour == 3 and current_night == 1:
+                foxy.ai_level = 1
+            if hour == 6:
+                for bot in bots:
+                    bot.ai_level = 0
+                stop_all_sounds()
+                is_breathing_playing = is_vent_light_playing = is_hall_sound_playing = music_box_playing = charging = bb_laugh_playing = flash_error_playing = False
+                game_state = "SIX_AM_ANIMATION"
+                six_am_player.play()
+                six_am_sound_playing = False
+
+        for bot in bots:
+            bot.update(show_hall, SIM_STEP_MS)
+        update_balloon_boy()
+
+        if game_state not in ["PLAY", "CHECKING"]:
+            # Пока монитор анимируется, камеры не видно - Puppet и Shadow Freddy не разыгрываются
+            continue
+        if camera_mode and light_on and current_cam == '11' and not (puppet.charge > 0 and puppet.pos == "Box"):
+            if random.random() < PUPPET_DANCE_CHANCE:
+                game_state = "PUPPET_DANCE"
+                js_player.play()
+        elif camera_mode and light_on and current_cam == '8' and not shadow_freddy_shown:
+            # Shadow Freddy появляется только в пустой Parts Service
+            if not camera_view('8', True)[1] and random.random() < SHADOW_FREDDY_CHANCE:
+                shadow_freddy_shown = True
+                shadow_freddy_trigger_time = sim_time_ms
+
+def bench_gif(filenames):
+    def legacy_gif_frame_to_surface(frame, make_transparent=False):
+        frame = frame.convert("RGBA")
+        if make_transparent:
+            datas = frame.getdata()
+            newData = [(255, 255, 255, 0) if item[0] < 10 and item[1] < 10 and item[2] < 10 else item for item in datas]
+            frame.putdata(newData)
+        return pygame.image.fromstring(frame.tobytes(), frame.size, frame.mode)
+
+    for filename in filenames or sorted({stream.filename for stream in jumpscares.values()}):
+        try:
+            pil_frames = [frame.copy() for frame in ImageSequence.Iterator(Image.open(os.path.join(images_path, filename)))]
+        except:
+            print(f"{filename}: cannot open")
+            continue
+        fps = []
+        for convert in (legacy_gif_frame_to_surface, gif_frame_to_surface):
+            start = time.perf_counter()
+            count = 0
+            while count < len(pil_frames) or time.perf_counter() - start < 1.0:
+                for frame in pil_frames:
+                    convert(frame, True)
+                    count += 1
+            fps.append(count / (time.perf_counter() - start))
+        same = (pygame.image.tostring(legacy_gif_frame_to_surface(pil_frames[0], True), "RGBA") ==
+                pygame.image.tostring(gif_frame_to_surface(pil_frames[0], True), "RGBA"))
+        w, h = pil_frames[0].size
+        print(f"{filename} {w}x{h}, {len(pil_frames)} frames: old {fps[0]:.1f} fps, new {fps[1]:.1f} fps "
+              f"(x{fps[1] / fps[0]:.1f}, output {'identical' if same else 'DIFFERENT'})")
+
+def bench_deltas(fps=30):
+    # Проигрывание анимаций на fps, как в игре: сколько пикселей кадров копируется (blit)
+    # и сколько нужно обновить на экране (dirty) - раньше весь кадр на каждый тик, теперь по дельтам
+    target = pygame.Surface((WIN_W, WIN_H)).convert()
+    baked = {}
+
+    def old_draw(mode, surf):
+        if mode == "alpha":
+            # Как было: заранее запеченная полупрозрачная копия каждого кадра
+            if surf not in baked:
+                baked[surf] = surf.copy()
+                baked[surf].set_alpha(89)
+            surf = baked[surf]
+        elif mode == "fullscreen":
+            target.fill((0, 0, 0))
+        target.blit(surf, (0, 0))
+
+    def new_draw(mode, player):
+        if mode == "fullscreen":
+            player.draw_fullscreen(target)
+        else:
+            player.blit(target, alpha=POMEXI_ALPHA if mode == "alpha" else None)
+
+    sets = {
+        "checks": [(key, checks[key], "blit") for key in checks.keys()],
+        "anims": [(key, anims[key], "alpha" if key == "pomexi" else "blit") for key in anims.keys()],
+        "jumpscares": [],
+    }
+    for name, stream in list(jumpscares.items()) + [("puppet_dance", puppet_dance_stream), ("six_am", six_am_stream)]:
+        # Потоковые кадры в игре идут через convert_alpha(), так же готовим их и здесь
+        frames = decode_gif_frames(stream.filename, stream.target_size, palettized=False)
+        if frames:
+            sets["jumpscares"].append((name, Frames([(surf.convert_alpha(), duration) for surf, duration, _ in frames],
+                                                    frames.deltas), "fullscreen"))
+
+    for set_name, animations in sets.items():
+        totals = [0] * 7
+        for key, frames, mode in animations:
+            if not frames:
+                continue
+            player = AnimationPlayer()
+            # old blit px, new blit px, old dirty px, new dirty px, old ms, new ms, тиков
+            stats = [0] * 7
+            for t in range(0, sum(max(1, d) for _, d in frames), 1000 // fps):
+                player.start = pygame.time.get_ticks() - t
+                surf = player.frame(frames)
+                if surf is None:
+                    break
+                start = time.perf_counter()
+                old_draw(mode, surf)
+                stats[4] += (time.perf_counter() - start) * 1000
+                start = time.perf_counter()
+                new_draw(mode, player)
+                stats[5] += (time.perf_counter() - start) * 1000
+                full = surf.get_width() * surf.get_height()
+                dirty = player.dirty.width * player.dirty.height
+                stats[0] += full
+                stats[1] += {"blit": full, "alpha": full + dirty, "fullscreen": dirty}[mode]
+                stats[2] += full
+                stats[3] += dirty
+                stats[6] += 1
+            print(f"  {key:24} {len(frames):3} frames, {mode:10}: " + bench_line(stats, fps))
+            totals = [total + v for total, v in zip(totals, stats)]
+        print(f"{set_name}: " + bench_line(totals, fps))
+
+def bench_line(stats, fps):
+    seconds = max(1, stats[6]) / fps
+    ticks = max(1, stats[6])
+    return (f"blit {stats[0] / seconds / 1e6:6.1f} -> {stats[1] / seconds / 1e6:6.1f} Mpx/s, "
+            f"dirty {stats[2] / seconds / 1e6:6.1f} -> {stats[3] / seconds / 1e6:6.1f} Mpx/s, "
+            f"{stats[4] / ticks:.2f} -> {stats[5] / ticks:.2f} ms/frame")
+
+def surface_bytes(frames):
+    return sum(surf.get_width() * surf.get_height() * surf.get_bytesize() for surf, _ in frames or [])
+
+def mem_report():
+    totals = [0, 0]
+    specs = [(f"{assets.name}:{key}", args) for assets in (checks, anims) for key, args in assets.specs.items()]
+    for label, args in specs:
+        sizes = [surface_bytes(load_gif_frames(*args, palettized=palettized)) for palettized in (False, True)]
+        totals = [total + size for total, size in zip(totals, sizes)]
+        print(f"{label:32} RGBA {sizes[0] / 2**20:8.1f} MB   8-bit {sizes[1] / 2**20:8.1f} MB")
+    print(f"{'total':32} RGBA {totals[0] / 2**20:8.1f} MB   8-bit {totals[1] / 2**20:8.1f} MB"
+          f"   (x{totals[0] / max(1, totals[1]):.1f} smaller)")
+
+def format_report():
+    # Какой формат получил каждый ключ imgs, сколько он занимает и сколько стоит его blit
+    # по сравнению с целой картинкой после convert_alpha()
+    target = pygame.Surface((WIN_W, WIN_H)).convert()
+    def blit_ms(surf):
+        start = time.perf_counter()
+        for _ in range(10):
+            blit_img(target, surf, (0, 0))
+        return (time.perf_counter() - start) * 100
+    jobs = imgs.missing_jobs(imgs.keys())
+    imgs.store_all([key for key, _ in jobs], asset_loader.load_many([job for _, job in jobs]))
+    modes = {}
+    totals = [0.0, 0.0, 0, 0]
+    for key, spec in imgs.specs.items():
+        surf = imgs[key]
+        legacy = (finish_img(decode_img(*spec[:3])) if isinstance(surf, PatchedSurface) else surf).convert_alpha()
+        times = [blit_ms(legacy), blit_ms(surf), asset_bytes(legacy), asset_bytes(surf)]
+        totals = [total + t for total, t in zip(totals, times)]
+        modes[surface_mode(surf)] = modes.get(surface_mode(surf), 0) + 1
+        print(f"{key:36} {spec[0]:36} {surface_mode(surf):9} alpha {times[0]:6.2f} ms -> {times[1]:6.2f} ms, "
+              f"{times[2] / 2**20:5.1f} MB -> {times[3] / 2**20:5.1f} MB")
+    print(", ".join(f"{count} {mode}" for mode, count in modes.items()) +
+          f"; blit total {totals[0]:.1f} ms -> {totals[1]:.1f} ms, memory {totals[2] / 2**20:.0f} MB -> {totals[3] / 2**20:.0f} MB")
+
+def trace_alloc(frames=300):
+    # Сколько выделяют за кадр служебные поверхности (подложка карты, панель отладки,
+    # затемнение FOXY_SEQUENCE, оверлей Pomexi): раньше - новая Surface каждый кадр, теперь - SurfacePool
+    # и холст AnimationPlayer с выставленной прозрачностью.
+    # tracemalloc видит только объекты Python (сами пиксели выделяет SDL), поэтому печатаем
+    # и пик кучи за кадр, и число созданных поверхностей; остаток у пула - Rect, который возвращает blit
+    target = pygame.Surface((WIN_W, WIN_H)).convert()
+    pomexi_frames = anims["pomexi"] or Frames([(pygame.Surface((WIN_W, WIN_H)).convert(), 100)], [pygame.Rect(0, 0, 0, 0)])
+    pomexi_overlay = AnimationPlayer(loop=True)
+
+    def legacy(i):
+        pomexi_overlay = pomexi_frames[i % len(pomexi_frames)][0].copy()
+        pomexi_overlay.set_alpha(POMEXI_ALPHA)
+        target.blit(pomexi_overlay, (0, 0))
+        map_bg = pygame.Surface(map_size, pygame.SRCALPHA)
+        map_bg.fill((20, 20, 20, 200))
+        target.blit(map_bg, map_pos)
+        dev_panel = pygame.Surface((420, 130), pygame.SRCALPHA)
+        dev_panel.fill((0, 0, 0, 180))
+        target.blit(dev_panel, (10, 10))
+        black_surf = pygame.Surface((WIN_W, WIN_H))
+        black_surf.fill((0, 0, 0))
+        black_surf.set_alpha(i % 256)
+        target.blit(black_surf, (0, 0))
+        return 4
+
+    def pooled(i):
+        created, canvas = surface_pool.created, pomexi_overlay.canvas
+        draw_pooled_layers(target, pomexi_overlay, pomexi_frames, i)
+        return surface_pool.created - created + (pomexi_overlay.canvas is not canvas)
+
+    tracemalloc.start()
+    for name, draw in (("new Surface per frame", legacy), ("SurfacePool", pooled)):
+        # Первый проход по всем кадрам Pomexi заполняет пул, дальше меряем установившийся режим
+        for i in range(len(pomexi_frames)):
+            draw(i)
+        peaks, surfaces = [], 0
+        for i in range(frames):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            surfaces += draw(i)
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        print(f"{name:22} python heap peak {sum(peaks) / frames:6.0f} B/frame (max {max(peaks)} B), "
+              f"{surfaces / frames:.1f} surfaces/frame")
+    tracemalloc.stop()
+
+def bake_pack(resolutions):
+    # python main.py --bake 1920x1080 1280x720 -> assets.pak рядом с main.py
+    global asset_pack
+    asset_pack = AssetPack(None)
+    resolutions = [tuple(int(v) for v in r.lower().split('x')) for r in resolutions] or [(WIN_W, WIN_H)]
+    index = {}
+    with tempfile.TemporaryFile() as data:
+        def add(name, entry, chunks):
+            entry['offset'] = data.tell()
+            for chunk in chunks:
+                data.write(chunk)
+            entry['size'] = data.tell() - entry['offset']
+            index[name] = entry
+
+        for resolution in resolutions:
+            gif_specs = [spec for assets in (checks, anims) for spec in assets.specs.values()]
+            # FrameStream читает из архива только RGBA без ключа - потоки пекутся так при любом palettized_animations
+            gif_specs += [(stream.filename, stream.target_size, False, False) for stream in
+                          list(jumpscares.values()) + [puppet_dance_stream, six_am_stream]]
+            specs = [(decode_img, spec) for spec in imgs.specs.values()] + [(decode_gif_frames, spec) for spec in gif_specs]
+            for decode, spec in specs:
+                filename = spec[0]
+                if not os.path.exists(os.path.join(images_path, filename)):
+                    continue
+                target_size = resolve_size(spec[1] if len(spec) > 1 else "screen", resolution)
+                # Варианты комнат пекутся целиком, патч считается уже при загрузке
+                raw = decode(filename, target_size, *(spec[2:3] if decode is decode_img else spec[2:]))
+                frames = [(raw[0], 0, raw[1])] if decode is decode_img else raw
+                if not frames:
+                    continue
+                fmt = "P" if frames[0][0].get_bitsize() == 8 else "RGBA"
+                variant = "keyed" if decode is decode_gif_frames and len(spec) > 2 and spec[2] else ""
+                name = AssetPack.image_name(filename, target_size, fmt, variant)
+                if name in index:
+                    continue
+                entry = {'w': target_size[0], 'h': target_size[1],
+                         'source': AssetPack.source_stamp(os.path.join(images_path, filename)),
+                         'durations': [duration for _, duration, _ in frames],
+                         'digests': [digest.hex() for _, _, digest in frames]}
+                if fmt == "P":
+                    entry['palette'] = [list(color)[:3] for color in frames[0][0].get_palette()]
+                    entry['colorkey'] = palette_colorkey(frames[0][0])
+                add(name, entry, (pygame.image.tostring(surf, fmt) for surf, _, _ in frames))
+            print(f"baked {resolution[0]}x{resolution[1]}")
+
+        for filename in sorted(os.listdir(sounds_path)):
+            path = os.path.join(sounds_path, filename)
+            with open(path, 'rb') as f:
+                add(f"sounds:{filename}", {'source': AssetPack.source_stamp(path)}, [f.read()])
+
+        header = json.dumps(index).encode()
+        pack_path = os.path.join(base_path, "assets.pak")
+        with open(pack_path + ".tmp", 'wb') as f:
+            f.write(AssetPack.MAGIC + len(header).to_bytes(4, 'little') + header)
+            data.seek(0)
+            shutil.copyfileobj(data, f)
+        os.replace(pack_path + ".tmp", pack_path)
+    print(f"{pack_path}: {len(index)} entries, {os.path.getsize(pack_path) / 2**20:.1f} MB")
+
+# Проверки поведения кэшей, архива, плееров и симуляции: python main.py --self-test.
+# Тестового набора у проекта нет, поэтому проверки - служебная команда, как бенчмарки выше
+self_checks = []
+
+def self_check(check):
+    self_checks.append(check)
+    return check
+
+@self_check
+def check_sim_rolls():
+    # Танец Марионетки и Shadow Freddy бросаются в шаге симуляции: при одном seed их число
+    # одинаково на 30, 60, 144 и 1000 FPS и совпадает с прежним шансом в секунду
+    global game_state, camera_mode, light_on, current_cam, shadow_freddy_shown, is_custom_night
+    custom_night, is_custom_night = is_custom_night, True
+    results = []
+    for frame_ms in (33, 16, 7, 1):
+        counts = []
+        for cam, duration in (('11', 50000), ('8', 300000)):
+            random.seed(1)
+            reset_game()
+            for bot in bots:
+                bot.ai_level = 0
+                if bot.pos == CAMERA_VIEWS['8'][0]:
+                    bot.pos = bot.target_name
+            puppet.charge = 0
+            game_state, camera_mode, light_on, current_cam = "PLAY", True, True, cam
+            count = 0
+            left = duration
+            while left:
+                advance_sim(min(frame_ms, left), False)
+                left -= min(frame_ms, left)
+                if game_state == "PUPPET_DANCE" or shadow_freddy_shown:
+                    count += 1
+                    game_state, shadow_freddy_shown = "PLAY", False
+            assert game_state == "PLAY", game_state
+            counts.append(count)
+        results.append(counts)
+    assert all(counts == results[0] for counts in results), results
+    for count, duration, chance in zip(results[0], (50000, 300000), (PUPPET_DANCE_CHANCE, SHADOW_FREDDY_CHANCE)):
+        expected = duration // SIM_STEP_MS * chance
+        assert abs(count - expected) <= 4 * expected ** 0.5 + 1, (count, expected)
+    print(f"     dance {results[0][0]} per 50 s, shadow {results[0][1]} per 300 s at every frame rate")
+    is_custom_night = custom_night
+    reset_game()
+    game_state = "MENU"
+
+@self_check
+def check_cache_formats():
+    # Холодный старт (PNG декодируется) и теплый (пиксели из SurfaceCache) дают один формат и одни пиксели
+    global surface_cache
+    saved_cache = surface_cache
+    tmp = tempfile.mkdtemp()
+    try:
+        surface_cache = SurfaceCache(os.path.join(tmp, "cache"), SURFACE_CACHE_LIMIT)
+        palette = Image.new("P", (8, 8), 1)
+        palette.putpalette([0, 0, 0, 200, 40, 40, 250, 250, 250] + [0] * 759)
+        palette.paste(2, (2, 2, 6, 6))
+        binary = Image.new("RGBA", (8, 8), (200, 40, 40, 255))
+        binary.paste((0, 0, 0, 0), (0, 0, 4, 4))
+        soft = binary.copy()
+        soft.paste((10, 10, 10, 128), (4, 4, 8, 8))
+        sources = [("palette.png", palette, {}, None), ("palette_key.png", palette, {'transparency': 1}, None),
+                   ("binary.png", binary, {}, None), ("soft.png", soft, {}, None),
+                   ("opaque.png", binary.convert("RGB"), {}, None), ("white_key.png", palette, {}, (250, 250, 250))]
+        for name, img, options, colorkey in sources:
+            path = os.path.join(tmp, name)
+            img.save(path, **options)
+            results = []
+            for _ in range(2):
+                surf = decode_img(path, (16, 16), colorkey)[0]
+                results.append((surface_mode(surf), surf.get_colorkey(), pygame.image.tostring(surf, "RGBA")))
+            assert surface_cache.load(path, (16, 16)), f"{name} not cached"
+            assert results[0] == results[1], f"{name}: cold {results[0][:2]}, warm {results[1][:2]}"
+    finally:
+        surface_cache = saved_cache
+        shutil.rmtree(tmp, ignore_errors=True)
+
+@self_check
+def check_patch_blit():
+    # Вариант из base + патча выводит те же пиксели, что и целая картинка, при любом area
+    base = pygame.Surface((64, 48)).convert()
+    base.fill((40, 80, 120))
+    variant = base.copy()
+    variant.fill((200, 30, 30), (20, 10, 16, 12))
+    patch, offset = image_patch(variant, base)
+    patched = PatchedSurface({"base": base}, "base", patch, offset)
+    for area in (None, pygame.Rect(0, 0, 64, 48), pygame.Rect(10, 5, 30, 20), pygame.Rect(30, 0, 34, 48),
+                 pygame.Rect(0, 30, 64, 18), pygame.Rect(24, 14, 4, 4)):
+        expected, actual = pygame.Surface((64, 48)).convert(), pygame.Surface((64, 48)).convert()
+        expected.blit(variant, (3, 2), area)
+        blit_img(actual, patched, (3, 2), area)
+        assert pygame.image.tostring(expected, "RGB") == pygame.image.tostring(actual, "RGB"), area
+
+# Пик кучи Python за прогретый кадр: несколько Rect от blit и мелочь AnimationPlayer
+POOLED_FRAME_PEAK_BYTES = 4096
+
+@self_check
+def check_pooled_frames(frames=120):
+    # Прогретые кадры служебных слоев (те же draw_*, что зовет главный цикл) не создают Surface:
+    # пул не растет, холст оверлея и screen остаются теми же объектами, пик кучи за кадр ограничен
+    target = pygame.Surface((WIN_W, WIN_H)).convert()
+    overlay_frames = anims["pomexi"] or Frames([(pygame.Surface((WIN_W, WIN_H)).convert(), 100)], [pygame.Rect(0, 0, 0, 0)])
+    overlay = AnimationPlayer(loop=True)
+    for i in range(len(overlay_frames)):
+        draw_pooled_layers(target, overlay, overlay_frames, i)
+    created, canvas, game_screen = surface_pool.created, overlay.canvas, screen
+    peak = 0
+    tracemalloc.start()
+    try:
+        for i in range(frames):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            draw_pooled_layers(target, overlay, overlay_frames, i)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    assert surface_pool.created == created, f"{surface_pool.created - created} surfaces created in {frames} warm frames"
+    assert overlay.canvas is canvas, "overlay canvas reallocated"
+    assert screen is game_screen, "screen reallocated"
+    assert peak <= POOLED_FRAME_PEAK_BYTES, f"python heap peak {peak} B/frame"
+    print(f"     {frames} warm frames: 0 surfaces, heap peak {peak} B/frame")
+
+def self_test():
+    failed = 0
+    for check in self_checks:
+        try:
+            check()
+            print(f"ok   {check.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"FAIL {check.__name__}: {type(e).__name__} {e}")
+    print(f"{len(self_checks) - failed}/{len(self_checks)} passed")
+    return failed
+
+tool_failed = 0
+if tool_command == "--bench-gif":
+    bench_gif(sys.argv[2:])
+elif tool_command == "--mem-report":
+    mem_report()
+elif tool_command == "--bake":
+    bake_pack(sys.argv[2:])
+elif tool_command == "--format-report":
+    format_report()
+elif tool_command == "--trace-alloc":
+    trace_alloc()
+elif tool_command == "--bench-deltas":
+    bench_deltas()
+elif tool_command == "--self-test":
+    tool_failed = self_test()
+if tool_command:
+    pygame.quit()
+    sys.exit(1 if tool_failed else 0)
+
 play_sound(menu_music, -1)
 menu_music_start_time = pygame.time.get_ticks()
+preloaded_state = None
 
 while running:
-    dt = clock.tick(30)
-    js_frame_index_alert += 1
-    pomexi_frame += 1
+    idle_scheduler.wait(game_state)
+    dt = clock.tick(frame_rate_cap())
+
+    if game_state != preloaded_state:
+        preload_scheduler.record(game_state)
+        preload_state(game_state)
+        if game_state == "MENU":
+            release_streams()
+        if preloaded_state is None:
+            if asset_report:
+                asset_loader.report()
+            print(f"Assets: {surface_interner.shared} duplicate surfaces shared, "
+                  f"{surface_interner.saved_bytes / 2**20:.1f} MB saved")
+        preloaded_state = game_state
 
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
             running = False
 
+        if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED, pygame.WINDOWRESTORED):
+            dirty_renderer.invalidate()
+
         if game_state == "BUG_REPORT" and event.type == pygame.KEYDOWN:
             if event.key == pygame.K_BACKSPACE:
                 bug_report_text = bug_report_text[:-1]
@@ -933,13 +3327,16 @@ while running:
                     play_sound(flash_error)
                     flash_error_playing = True
 
+            if game_state == "SETTINGS" and event.key == pygame.K_ESCAPE:
+                game_state = "MENU"
+
             if game_state == "MENU":
                 if event.key == pygame.K_UP:
                     menu_selected = max(0, (menu_selected - 1) if menu_selected != -1 else 0)
                     if menu_selected == 2 and not is_custom_unlocked:
                         menu_selected = max(0, menu_selected - 1)
                 elif event.key == pygame.K_DOWN:
-                    menu_selected = min(3, (menu_selected + 1) if menu_selected != -1 else 0)
+                    menu_selected = min(len(menu_buttons) - 1, (menu_selected + 1) if menu_selected != -1 else 0)
                     if menu_selected == 2 and not is_custom_unlocked:
                         menu_selected = 3
                 elif event.key in [pygame.K_RETURN, pygame.K_SPACE] and menu_selected != -1:
@@ -966,6 +3363,8 @@ while running:
                     elif action == "mods":
                         scan_mods()
                         game_state = "MODS"
+                    elif action == "settings":
+                        game_state = "SETTINGS"
 
             if game_state == "SIX_AM_ANIMATION":
                 stop_sound(six_am_theme)
@@ -986,7 +3385,7 @@ while running:
                 beat_detector.reset()
 
         if event.type == pygame.MOUSEBUTTONDOWN:
-            mouse_pos = pygame.mouse.get_pos()
+            mouse_pos = get_mouse_pos(game_state in UI_STATES)
 
             if game_state in ["PLAY", "CHECKING"]:
                 if camera_mode:
@@ -1000,20 +3399,20 @@ while running:
                     if current_cam == '11' and puppet.charge > 0 and puppet.pos == "Box":
                         if charge_button_rect.collidepoint(mouse_pos):
                             charging = True
-                            last_charge = pygame.time.get_ticks()
+                            last_charge = sim_time_ms
                             play_sound(music_box_charge, -1)
 
             if game_state == "BUG_REPORT":
-                close_btn = pygame.Rect(WIN_W // 2 + 350, WIN_H // 2 - 250, 40, 40)
+                close_btn = pygame.Rect(UI_W // 2 + 350, UI_H // 2 - 250, 40, 40)
                 if close_btn.collidepoint(mouse_pos):
                     game_state = "MENU"
                     bug_report_text = bug_report_category = ""
 
                 for i, cat in enumerate(bug_categories):
-                    if pygame.Rect(WIN_W // 2 - 300, WIN_H // 2 - 50 + i * 60, 30, 30).collidepoint(mouse_pos):
+                    if pygame.Rect(UI_W // 2 - 300, UI_H // 2 - 50 + i * 60, 30, 30).collidepoint(mouse_pos):
                         bug_report_category = cat
 
-                submit_btn = pygame.Rect(WIN_W // 2 - 100, WIN_H // 2 + 200, 200, 50)
+                submit_btn = pygame.Rect(UI_W // 2 - 100, UI_H // 2 + 200, 200, 50)
                 if submit_btn.collidepoint(mouse_pos) and bug_report_text.strip() and bug_report_category:
                     if can_submit_bug_report():
                         if send_bug_report_to_discord(bug_report_text, bug_report_category):
@@ -1023,7 +3422,7 @@ while running:
                             game_state = "MENU"
 
             if game_state == "MODS":
-                window_x, window_y = WIN_W // 2 - 400, WIN_H // 2 - 300
+                window_x, window_y = UI_W // 2 - 400, UI_H // 2 - 300
                 panel_width = 150
 
                 tab_buttons_data = [
@@ -1037,24 +3436,24 @@ while running:
                         current_mods_tab = tab["id"]
                         break
 
-                if pygame.Rect(WIN_W // 2 + 350, WIN_H // 2 - 300, 40, 40).collidepoint(mouse_pos):
+                if pygame.Rect(UI_W // 2 + 350, UI_H // 2 - 300, 40, 40).collidepoint(mouse_pos):
                     game_state = "MENU"
 
-                if pygame.Rect(WIN_W // 2 - 100, WIN_H // 2 + 230, 200, 50).collidepoint(mouse_pos):
+                if pygame.Rect(UI_W // 2 - 100, UI_H // 2 + 230, 200, 50).collidepoint(mouse_pos):
                     open_mods_folder()
 
                 for i, mod in enumerate(available_mods):
-                    mod_y = WIN_H // 2 - 250 + 50 + i * 80
+                    mod_y = UI_H // 2 - 250 + 50 + i * 80
                     is_installed = installed_mod and installed_mod['name'] == mod['name']
 
                     if is_installed:
-                        if pygame.Rect(WIN_W // 2 + 100, mod_y + 10, 150, 40).collidepoint(mouse_pos):
+                        if pygame.Rect(UI_W // 2 + 100, mod_y + 10, 150, 40).collidepoint(mouse_pos):
                             launch_mod(mod)
-                        if pygame.Rect(WIN_W // 2 + 260, mod_y + 10, 80, 40).collidepoint(mouse_pos):
+                        if pygame.Rect(UI_W // 2 + 260, mod_y + 10, 80, 40).collidepoint(mouse_pos):
                             uninstall_mod()
                             save_progress()
                     else:
-                        if pygame.Rect(WIN_W // 2 + 100, mod_y + 10, 150, 40).collidepoint(mouse_pos):
+                        if pygame.Rect(UI_W // 2 + 100, mod_y + 10, 150, 40).collidepoint(mouse_pos):
                             if installed_mod:
                                 uninstall_mod()
                             install_mod(mod)
@@ -1089,12 +3488,52 @@ while running:
                         elif action == "mods":
                             scan_mods()
                             game_state = "MODS"
+                        elif action == "settings":
+                            game_state = "SETTINGS"
 
                 if rect_tg.collidepoint(mouse_pos):
                     webbrowser.open("https://t.me/sh4destudio")
                 if rect_tiktok.collidepoint(mouse_pos):
                     webbrowser.open("https://www.tiktok.com/@sh4de_o")
 
+            if game_state == "SETTINGS":
+                resolutions = available_resolutions()
+                index = resolutions.index(display.get_size()) if display.get_size() in resolutions else 0
+                if settings_rects["resolution_left"].collidepoint(mouse_pos):
+                    settings["resolution"] = list(resolutions[(index - 1) % len(resolutions)])
+                    apply_display_settings()
+                elif settings_rects["resolution_right"].collidepoint(mouse_pos):
+                    settings["resolution"] = list(resolutions[(index + 1) % len(resolutions)])
+                    apply_display_settings()
+                elif settings_rects["fullscreen"].collidepoint(mouse_pos):
+                    settings["fullscreen"] = not settings["fullscreen"]
+                    apply_display_settings()
+                elif settings_rects["dirty_rects"].collidepoint(mouse_pos):
+                    settings["dirty_rects"] = not settings["dirty_rects"]
+                    dirty_renderer.invalidate()
+                    save_progress()
+                elif settings_rects["render_scale"].collidepoint(mouse_pos):
+                    scale_index = RENDER_SCALES.index(settings["render_scale"]) if settings["render_scale"] in RENDER_SCALES else -1
+                    settings["render_scale"] = RENDER_SCALES[(scale_index + 1) % len(RENDER_SCALES)]
+                    apply_display_settings()
+                elif settings_rects["frame_rate"].collidepoint(mouse_pos):
+                    old_rate = settings["frame_rate"]
+                    rate_index = FRAME_RATES.index(old_rate) if old_rate in FRAME_RATES else -1
+                    settings["frame_rate"] = FRAME_RATES[(rate_index + 1) % len(FRAME_RATES)]
+                    if "vsync" in (old_rate, settings["frame_rate"]):
+                        apply_display_settings()
+                    else:
+                        save_progress()
+                elif settings_rects["palettized_animations"].collidepoint(mouse_pos):
+                    settings["palettized_animations"] = not settings["palettized_animations"]
+                    # Кадры GIF загрузятся заново в новом формате (текущее состояние - сразу, остальное - при обращении)
+                    for assets in (checks, anims):
+                        assets.invalidate(list(assets.keys()))
+                    preload_state(game_state)
+                    save_progress()
+                elif settings_rects["back"].collidepoint(mouse_pos):
+                    game_state = "MENU"
+
             if game_state == "CUSTOM":
                 for name in custom_characters:
                     if custom_rects_left[name].collidepoint(mouse_pos):
@@ -1135,7 +3574,7 @@ while running:
                 stop_sound(music_box_charge)
 
         if event.type == pygame.MOUSEMOTION and game_state == "MENU":
-            mouse_pos = pygame.mouse.get_pos()
+            mouse_pos = get_mouse_pos(True)
             menu_selected = -1
             for i, rect in enumerate(menu_button_rects):
                 if i == 2 and not is_custom_unlocked:
@@ -1145,7 +3584,7 @@ while running:
                     break
 
     if game_state in ["PLAY", "CHECKING"]:
-        mouse_pos = pygame.mouse.get_pos()
+        mouse_pos = get_mouse_pos()
 
         current_monitor_hover = monitor_button_rect.collidepoint(mouse_pos)
         if current_monitor_hover and not monitor_button_hovered:
@@ -1155,10 +3594,10 @@ while running:
 
             if not camera_mode and mask_animation_state not in ["equipping", "equipped"]:
                 game_state = "MONITOR_OPENING"
-                monitor_animation_start = pygame.time.get_ticks()
+                monitor_player.play()
             elif camera_mode:
                 game_state = "MONITOR_CLOSING"
-                monitor_animation_start = pygame.time.get_ticks()
+                monitor_player.play()
                 if music_box_playing:
                     stop_sound(music_box_song)
                 music_box_playing = False
@@ -1168,79 +3607,42 @@ while running:
         if current_mask_hover and not mask_button_hovered:
             if mask_animation_state is None and not camera_mode:
                 mask_animation_state = "equipping"
-                mask_animation_start = pygame.time.get_ticks()
-                mask_animation_frame = 0
+                mask_player.play()
                 play_sound(mask_equip_sound)
             elif mask_animation_state == "equipped":
                 mask_animation_state = "unequipping"
-                mask_animation_start = pygame.time.get_ticks()
-                mask_animation_frame = 0
+                mask_player.play()
                 play_sound(mask_unequip_sound)
                 if is_breathing_playing:
                     stop_sound(mask_breathing_sound)
                     is_breathing_playing = False
         mask_button_hovered = current_mask_hover
 
-    if mask_animation_state == "equipping" and mask_equip_frames:
-        now = pygame.time.get_ticks()
-        elapsed = now - mask_animation_start
-        cum_time = 0
-        finished = True
-
-        for i, (surf, dur) in enumerate(mask_equip_frames):
-            if elapsed < cum_time + dur:
-                mask_animation_frame = i
-                finished = False
-                break
-            cum_time += dur
-
-        if finished:
+    if mask_animation_state == "equipping" and anims["mask_equip"]:
+        if mask_player.frame(anims["mask_equip"]) is None:
             mask_animation_state = "equipped"
             mask_on = True
-            mask_on_start = pygame.time.get_ticks()
+            mask_on_start = sim_time_ms
 
-    elif mask_animation_state == "unequipping" and mask_unequip_frames:
-        now = pygame.time.get_ticks()
-        elapsed = now - mask_animation_start
-        cum_time = 0
-        finished = True
-
-        for i, (surf, dur) in enumerate(mask_unequip_frames):
-            if elapsed < cum_time + dur:
-                mask_animation_frame = i
-                finished = False
-                break
-            cum_time += dur
-
-        if finished:
+    elif mask_animation_state == "unequipping" and anims["mask_unequip"]:
+        if mask_player.frame(anims["mask_unequip"]) is None:
             mask_animation_state = None
             mask_on = False
 
+    ui_frame = game_state in UI_STATES
+    if game_state in ["MONITOR_OPENING", "MONITOR_CLOSING"]:
+        # До отрисовки: если за эти шаги случился скример или 6 AM, анимация монитора уже не рисуется
+        advance_sim(dt, False)
     if game_state in ["PLAY", "CHECKING"]:
-        game_time_ms += dt
-        if game_time_ms >= HOUR_DURATION:
-            game_time_ms = 0
-            hour = 1 if hour == 12 else hour + 1
-            if not is_custom_night and hour == 3 and current_night == 1:
-                foxy.ai_level = 1
-            if hour == 6:
-                for bot in bots:
-                    bot.ai_level = 0
-                stop_all_sounds()
-                is_breathing_playing = is_vent_light_playing = is_hall_sound_playing = music_box_playing = charging = bb_laugh_playing = flash_error_playing = False
-                game_state = "SIX_AM_ANIMATION"
-                six_am_animation_start = pygame.time.get_ticks()
-                six_am_frame_index = 0
-                six_am_sound_playing = False
-
         keys = pygame.key.get_pressed()
         show_hall = keys[pygame.K_z] and mask_animation_state not in ["equipping", "equipped"] and not camera_mode and not bb_in_office
         show_vent_l = keys[pygame.K_x] and mask_animation_state not in ["equipping", "equipped"] and not camera_mode and not bb_in_office
         show_vent_r = keys[pygame.K_c] and mask_animation_state not in ["equipping", "equipped"] and not camera_mode and not bb_in_office
         light_on = keys[pygame.K_LCTRL] and camera_mode
 
-        for bot in bots:
-            bot.update(show_hall, dt)
+        advance_sim(dt, show_hall)
+
+        preload_scheduler.update()
 
         if camera_mode and current_cam == '11' and puppet.charge > 0:
             if not music_box_playing:
@@ -1250,44 +3652,7 @@ while running:
             stop_sound(music_box_song)
             music_box_playing = False
 
-        now = pygame.time.get_ticks()
-        bb_bot = next((b for b in bots if b.name == "Balloon Boy"), None)
-
-        if bb_bot and bb_bot.ai_level > 2 and bb_bot.pos == "Game Area":
-            if now - bb_idle_start >= 15000:
-                interval = 12000 if bb_bot.ai_level <= 6 else (8000 if bb_bot.ai_level <= 12 else random.choice([5000, 6000, 7000, 7500]))
-
-                if now - bb_last_speak_time >= interval:
-                    bb_last_speak_time = now
-                    play_sound(random.choice([bb_hi, bb_hello]))
-                    bb_sound_count += 1
-                    if bb_sound_count == 4:
-                        bb_move_time = now + 1000
-
-        if bb_bot and bb_bot.pos == "Game Area" and bb_move_time > 0 and now >= bb_move_time:
-            if not any(b.pos == "Left Air Vent" for b in bots if b != bb_bot):
-                bb_bot.pos = "Left Air Vent"
-                bb_sound_count = bb_move_time = 0
-                bb_bot.status_msg = "MOVING TO LEFT AIR VENT"
-
-        if bb_bot and bb_bot.pos == "Office Vent Left":
-            if mask_on:
-                if bb_mask_start == 0:
-                    bb_mask_start = now
-                elif now - bb_mask_start >= 5000:
-                    bb_bot.pos = "Game Area"
-                    bb_mask_start = 0
-                    bb_bot.status_msg = "RETURNING TO GAME AREA"
-                    bb_idle_start = now
-                    bb_return_idle = True
-            else:
-                bb_mask_start = 0
-
-            if now - bb_bot.vent_arrival_time >= 10000:
-                bb_bot.pos = "Office"
-                bb_in_office = True
-                bb_bot.status_msg = "IN OFFICE"
-
+        bb_bot = bot_registry.get("Balloon Boy")
         if bb_in_office and not bb_laugh_playing:
             play_sound(bb_laught, -1)
             bb_laugh_playing = True
@@ -1309,7 +3674,7 @@ while running:
                             music_box_playing = False
                         active_js_bot = bot.name
                         game_state = "JUMPSCARE"
-                        js_frame_index = 0
+                        js_player.play()
                         stop_all_sounds()
                         play_sound(jumpscare_sound)
                     elif bot.name != "Balloon Boy":
@@ -1320,15 +3685,15 @@ while running:
                             music_box_playing = False
                             active_js_bot = bot.name
                             game_state = "JUMPSCARE"
-                            js_frame_index = 0
+                            js_player.play()
                             stop_all_sounds()
                             play_sound(jumpscare_sound)
                         else:
                             checking_bot = bot
-                            check_start = pygame.time.get_ticks()
+                            check_start = sim_time_ms
                             check_type = "fail"
                             game_state = "CHECKING"
-                            js_frame_index = 0
+                            check_player.play()
                             bot.status_msg = "Checking office..."
                             play_sound(check_sound, -1)
 
@@ -1339,7 +3704,7 @@ while running:
             stop_sound(vent_light_sound)
             is_vent_light_playing = False
 
-        foxy_bot = next((b for b in bots if b.name == "Withered Foxy"), None)
+        foxy_bot = bot_registry.get("Withered Foxy")
         if foxy_bot:
             if foxy_bot.pos == "Hall" and not is_hall_sound_playing:
                 play_sound(hall_sound, -1)
@@ -1349,12 +3714,12 @@ while running:
                 is_hall_sound_playing = False
 
         if mask_on and mask_animation_state == "equipped":
-            if pygame.time.get_ticks() - mask_on_start >= 2000 and not is_breathing_playing:
+            if sim_time_ms - mask_on_start >= 2000 and not is_breathing_playing:
                 play_sound(mask_breathing_sound, -1)
                 is_breathing_playing = True
 
         if charging and camera_mode and current_cam == '11' and puppet.charge > 0 and puppet.pos == "Box":
-            now = pygame.time.get_ticks()
+            now = sim_time_ms
             if music_box_charge:
                 charge_time = music_box_charge.get_length() * 1000
                 if now - last_charge >= charge_time:
@@ -1370,20 +3735,16 @@ while running:
                     if puppet.charge > 0 and puppet.pos == "Box":
                         current_img = imgs["puppet_in_box_light"]
                     else:
-                        if random.random() < 0.08:
-                            game_state = "PUPPET_DANCE"
-                            js_frame_index = 0
-                            continue
-                        else:
-                            current_img = imgs["puppet_awake_light"]
+                        current_img = imgs["puppet_awake_light"]
                 else:
                     current_img = imgs["puppet_box_no_light"]
 
-                screen.blit(current_img, (0, 0))
+                blit_img(screen, current_img, (0, 0))
+                dirty_renderer.scene("camera", current_img)
 
                 if puppet.charge > 0 and puppet.pos == "Box":
                     pygame.draw.rect(screen, (255, 255, 255), charge_button_rect)
-                    screen.blit(font_dev.render("Charge", True, (0, 0, 0)), (charge_button_rect.x + 10, charge_button_rect.y + 10))
+                    screen.blit(render_text(font_dev, "Charge", True, (0, 0, 0)), (charge_button_rect.x + 10, charge_button_rect.y + 10))
 
                     charge_circle_center = (charge_button_rect.x - 100, charge_button_rect.y + 25)
                     radius = 20
@@ -1391,283 +3752,45 @@ while running:
                     angle = 360 * (puppet.charge / 100)
                     rect = (charge_circle_center[0] - radius, charge_circle_center[1] - radius, radius * 2, radius * 2)
                     pygame.draw.arc(screen, (0, 255, 0), rect, 0, angle * (3.14159 / 180), 2)
+                    dirty_renderer.scene("charge")
+                    dirty_renderer.mark(pygame.Rect(rect).inflate(4, 4))
+
+            elif current_cam in CAMERA_VIEWS:
+                key, mask = camera_view(current_cam, light_on)
+                if current_cam == '8':
+                    # Shadow Freddy (бросок - в шаге симуляции) пропадает, когда кто-то вернется
+                    if mask:
+                        shadow_freddy_shown = False
+                    elif light_on and shadow_freddy_shown:
+                        key = "shadow_freddy"
+                blit_img(screen, imgs[key], (0, 0))
+                dirty_renderer.scene("camera", imgs[key])
+
+            if draw_pomexi_overlay(screen, pomexi_player, anims["pomexi"]):
+                dirty_renderer.scene("pomexi")
+                dirty_renderer.mark(pomexi_player.dirty)
+
+            draw_map_backdrop(screen)
 
-            elif current_cam == '9':
-                toy_bonnie = next(b for b in bots if b.name == "Toy Bonnie")
-                toy_chica = next(b for b in bots if b.name == "Toy Chica")
-                toy_freddy = next(b for b in bots if b.name == "Toy Freddy")
-
-                # Если все ушли со сцены
-                if toy_bonnie.pos != "Stage" and toy_chica.pos != "Stage" and toy_freddy.pos != "Stage":
-                    current_img = imgs["stage_clear"]
-                else:
-                    stages = {
-                        (True, True): ("stage_full_light" if light_on else "stage_full"),
-                        (False, True): ("stage_freddy_chica_light" if light_on else "stage_freddy_chica"),
-                        (True, False): ("stage_bonnie_freddy_light" if light_on else "stage_bonnie_freddy"),
-                        (False, False): ("stage_freddy_light" if light_on else "stage_freddy")
-                    }
-                    current_img = imgs[stages[(toy_bonnie.pos == "Stage", toy_chica.pos == "Stage")]]
-                screen.blit(current_img, (0, 0))
-
-            elif current_cam == '1':
-                # Party Room 1
-                withered_bonny = next(b for b in bots if b.name == "Withered Bonny")
-                toy_chica = next(b for b in bots if b.name == "Toy Chica")
-                
-                bonny_there = withered_bonny.pos == "Party Room1"
-                chica_there = toy_chica.pos == "Party Room1"
-                
-                if light_on:
-                    if bonny_there:
-                        current_img = imgs["party_room1_withered_bonny_light"]
-                    elif chica_there:
-                        current_img = imgs["party_room1_toy_chica_light"]
-                    else:
-                        current_img = imgs["party_room1_clear_light"]
-                else:
-                    current_img = imgs["party_room1_clear"]
-                screen.blit(current_img, (0, 0))
-
-            elif current_cam == '2':
-                # Party Room 2
-                toy_bonnie = next(b for b in bots if b.name == "Toy Bonnie")
-                withered_chica = next(b for b in bots if b.name == "Withered Chica")
-                
-                bonnie_there = toy_bonnie.pos == "Party Room2"
-                chica_there = withered_chica.pos == "Party Room2"
-                
-                if light_on:
-                    if chica_there:
-                        current_img = imgs["party_room2_withered_chica_light"]
-                    elif bonnie_there:
-                        current_img = imgs["party_room2_toy_bonnie_light"]
-                    else:
-                        current_img = imgs["party_room2_clear_light"]
-                else:
-                    if chica_there:
-                        current_img = imgs["party_room2_withered_chica"]
-                    else:
-                        current_img = imgs["party_room2_clear"]
-                screen.blit(current_img, (0, 0))
-
-            elif current_cam == '3':
-                # Game Area
-                bb_there = bb_bot.pos == "Game Area" if bb_bot else False
-                toy_freddy = next(b for b in bots if b.name == "Toy Freddy")
-                freddy_there = toy_freddy.pos == "Game Area"
-                
-                if bb_there and freddy_there:
-                    if light_on:
-                        current_img = imgs["game_area_bb_and_toy_freddy"]
-                    else:
-                        current_img = imgs["game_area_bb"]
-                elif freddy_there:
-                    if light_on:
-                        current_img = imgs["game_area_toy_freddy_light"]
-                    else:
-                        current_img = imgs["game_area_clear"]
-                elif bb_there:
-                    if light_on:
-                        current_img = imgs["game_area_bb_light"]
-                    else:
-                        current_img = imgs["game_area_bb"]
-                else:
-                    if light_on:
-                        current_img = imgs["game_area_clear_light"]
-                    else:
-                        current_img = imgs["game_area_clear"]
-                screen.blit(current_img, (0, 0))
-
-            elif current_cam == '4':
-                # Main Hall
-                toy_chica = next(b for b in bots if b.name == "Toy Chica")
-                withered_bonny = next(b for b in bots if b.name == "Withered Bonny")
-                withered_freddy = next(b for b in bots if b.name == "Withered Freddy")
-                
-                chica_there = toy_chica.pos == "Main Hall"
-                bonny_there = withered_bonny.pos == "Main Hall"
-                freddy_there = withered_freddy.pos == "Main Hall"
-                
-                if light_on:
-                    if chica_there:
-                        current_img = imgs["main_hall_toy_chica_light"]
-                    elif bonny_there:
-                        current_img = imgs["withered_bonny_main_hall_light"]
-                    elif freddy_there:
-                        current_img = imgs["withered_freddy_mail_hall_light"]
-                    else:
-                        current_img = imgs["main_hall_clear_light"]
-                else:
-                    if chica_there:
-                        current_img = imgs["main_hall_toy_chica"]
-                    else:
-                        current_img = imgs["main_hall_clear"]
-                screen.blit(current_img, (0, 0))
-
-            elif current_cam == '5':
-                # Left Air Vent
-                toy_chica = next((b for b in bots if b.name == "Toy Chica"), None)
-                withered_bonny = next((b for b in bots if b.name == "Withered Bonny"), None)
-                
-                bonny_there = withered_bonny.pos == "Left Air Vent" if withered_bonny else False
-                
-                if light_on:
-                    if bonny_there:
-                        current_img = imgs["left_air_vent_withered_bonny"]
-                    else:
-                        current_img = imgs["left_air_vent_clear_light"]
-                else:
-                    current_img = imgs["left_vent"]
-                screen.blit(current_img, (0, 0))
-
-            elif current_cam == '6':
-                # Right Air Vent
-                toy_bonnie = next((b for b in bots if b.name == "Toy Bonnie"), None)
-                withered_chica = next((b for b in bots if b.name == "Withered Chica"), None)
-                
-                bonnie_there = toy_bonnie.pos == "Right Air Vent" if toy_bonnie else False
-                chica_there = withered_chica.pos == "Right Air Vent" if withered_chica else False
-                
-                if light_on:
-                    if bonnie_there:
-                        current_img = imgs["right_air_vent_toy_bonny_light"]
-                    elif chica_there:
-                        current_img = imgs["right_air_vent_withered_chica_light"]
-                    else:
-                        current_img = imgs["right_air_vent_clear_light"]
-                else:
-                    current_img = imgs["right_air_vent_clear"]
-                screen.blit(current_img, (0, 0))
-
-            elif current_cam == '7':
-                # Party Room 3
-                toy_bonnie = next(b for b in bots if b.name == "Toy Bonnie")
-                withered_freddy = next(b for b in bots if b.name == "Withered Freddy")
-                
-                bonnie_there = toy_bonnie.pos == "Party Room3"
-                freddy_there = withered_freddy.pos == "Party Room3"
-                
-                if light_on:
-                    if bonnie_there:
-                        current_img = imgs["party_room3_toy_bonny_light"]
-                    elif freddy_there:
-                        current_img = imgs["party_room4_withered_freddy_light"]
-                    else:
-                        current_img = imgs["party_room3_clear_light"]
-                else:
-                    if freddy_there:
-                        current_img = imgs["party_room3_withered_freddy"]
-                    else:
-                        current_img = imgs["party_room3_clear"]
-                screen.blit(current_img, (0, 0))
-
-            elif current_cam == '8':
-                # Parts Service (бывшая камера 07)
-                withered_foxy = next((b for b in bots if b.name == "Withered Foxy"), None)
-                withered_bonny = next((b for b in bots if b.name == "Withered Bonny"), None)
-                withered_chica = next((b for b in bots if b.name == "Withered Chica"), None)
-                withered_freddy = next((b for b in bots if b.name == "Withered Freddy"), None)
-                
-                foxy_there = withered_foxy.pos == "Parts Service" if withered_foxy else False
-                bonny_there = withered_bonny.pos == "Parts Service" if withered_bonny else False
-                chica_there = withered_chica.pos == "Parts Service" if withered_chica else False
-                freddy_there = withered_freddy.pos == "Parts Service" if withered_freddy else False
-                
-                # Подсчет кто там есть
-                no_one = not (foxy_there or bonny_there or chica_there or freddy_there)
-                no_foxy_bonny = not foxy_there and not bonny_there
-                no_foxy_bonny_chica = not foxy_there and not bonny_there and not chica_there
-                
-                if light_on:
-                    if no_one:
-                        # 0.1% шанс Shadow Freddy
-                        if random.random() < 0.001:
-                            if not shadow_freddy_shown:
-                                shadow_freddy_shown = True
-                                shadow_freddy_trigger_time = pygame.time.get_ticks()
-                        
-                        if shadow_freddy_shown:
-                            current_img = imgs["shadow_freddy"]
-                        else:
-                            current_img = imgs["parts_service_clear_light"]
-                    elif no_foxy_bonny_chica and freddy_there:
-                        current_img = imgs["parts_service_withered_freddy"]
-                    elif no_foxy_bonny and not chica_there:
-                        current_img = imgs["parts_service_clear_light"]
-                    elif no_foxy_bonny:
-                        current_img = imgs["parts_service_without_foxy_and_bonny_light"]
-                    elif foxy_there and not bonny_there:
-                        current_img = imgs["parts_service_withered_foxy_light"]
-                    else:
-                        current_img = imgs["parts_service_all_light"]
-                else:
-                    current_img = imgs["parts_service_lo_light"]
-                
-                # Сбросить Shadow Freddy когда кто-то вернется
-                if not no_one and shadow_freddy_shown:
-                    shadow_freddy_shown = False
-                
-                screen.blit(current_img, (0, 0))
-
-            elif current_cam == '10':
-                # Party Room 4
-                toy_bonnie = next(b for b in bots if b.name == "Toy Bonnie")
-                toy_chica = next(b for b in bots if b.name == "Toy Chica")
-                withered_chica = next(b for b in bots if b.name == "Withered Chica")
-                
-                toy_bonnie_there = toy_bonnie.pos == "Party Room4"
-                toy_chica_there = toy_chica.pos == "Party Room4"
-                withered_chica_there = withered_chica.pos == "Party Room4"
-                
-                if light_on:
-                    if toy_bonnie_there:
-                        current_img = imgs["party_room4_toy_bonny_light"]
-                    elif toy_chica_there:
-                        current_img = imgs["party_room4_toy_chica_light"]
-                    elif withered_chica_there:
-                        current_img = imgs["party_room4_withered_chica_light"]
-                    else:
-                        current_img = imgs["party_room4_clear_light"]
-                else:
-                    if toy_bonnie_there:
-                        current_img = imgs["party_room4_toy_bonny"]
-                    else:
-                        current_img = imgs["party_room4_clear"]
-                screen.blit(current_img, (0, 0))
-
-            if pomexi_frames:
-                pomexi_overlay = pomexi_frames[pomexi_frame % len(pomexi_frames)][0].copy()
-                pomexi_overlay.set_alpha(89)
-                screen.blit(pomexi_overlay, (0, 0))
-
-            map_bg = pygame.Surface(map_size, pygame.SRCALPHA)
-            map_bg.fill((20, 20, 20, 200))
-            screen.blit(map_bg, map_pos)
-
-            font_cam = pygame.font.SysFont("Arial", 16, bold=True)
             for cam_id, cam_data in cam_buttons.items():
                 btn_rect = cam_data['rect'].copy()
                 btn_rect.move_ip(map_pos)
                 color = (50, 200, 50) if cam_id == current_cam else (60, 60, 60)
                 pygame.draw.rect(screen, color, btn_rect)
                 pygame.draw.rect(screen, (200, 200, 200), btn_rect, 2)
-                cam_text = font_cam.render(cam_data['label'], True, (255, 255, 255))
+                cam_text = render_text(font_cam, cam_data['label'], True, (255, 255, 255))
                 screen.blit(cam_text, (btn_rect.x + (btn_rect.width - cam_text.get_width()) // 2, 
                                      btn_rect.y + (btn_rect.height - cam_text.get_height()) // 2))
+            dirty_renderer.scene("map", current_cam)
         else:
-            mouse_x, _ = pygame.mouse.get_pos()
-            target_x = -(mouse_x / WIN_W) * (imgs["main"].get_width() - WIN_W)
-            office_x += (target_x - office_x) * 0.1
-
             current_img = imgs["main"]
 
             if show_hall:
                 # Проверяем каких аниматроников видим в коридоре
-                toy_chica = next((b for b in bots if b.name == "Toy Chica"), None)
-                toy_freddy = next((b for b in bots if b.name == "Toy Freddy"), None)
-                withered_bonny = next((b for b in bots if b.name == "Withered Bonny"), None)
-                withered_freddy = next((b for b in bots if b.name == "Withered Freddy"), None)
+                toy_chica = bot_registry.get("Toy Chica")
+                toy_freddy = bot_registry.get("Toy Freddy")
+                withered_bonny = bot_registry.get("Withered Bonny")
+                withered_freddy = bot_registry.get("Withered Freddy")
                 
                 foxy_in_hall = foxy_bot and foxy_bot.pos == "Hall"
                 toy_chica_in_hall = toy_chica and toy_chica.pos == "Hall"
@@ -1697,19 +3820,17 @@ while running:
                 if bb_bot and bb_bot.pos == "Office Vent Left":
                     current_img = imgs["office_bb_vent"]
                 else:
-                    chica_bot = next(b for b in bots if b.name == "Toy Chica")
+                    chica_bot = bot_registry.get("Toy Chica")
                     current_img = imgs["vent_l_chica"] if chica_bot.pos == "Office Vent Left" else imgs["vent_l_clear"]
             elif show_vent_r:
-                bonnie_bot = next(b for b in bots if b.name == "Toy Bonnie")
+                bonnie_bot = bot_registry.get("Toy Bonnie")
                 current_img = imgs["vent_r_bonnie"] if bonnie_bot.pos == "Office Vent Right" else imgs["vent_r_clear"]
 
-            screen.blit(current_img, (office_x, 0))
-
-            if bb_in_office:
-                screen.blit(imgs["office_bb"], (office_x, 0))
+            draw_office(current_img)
+            dirty_renderer.scene("office", current_img, tuple(office_viewport()), bb_in_office)
 
         if game_state == "CHECKING":
-            now = pygame.time.get_ticks()
+            now = sim_time_ms
 
             if mask_on and check_type == "fail":
                 check_type = "success"
@@ -1718,20 +3839,20 @@ while running:
             if check_type == "fail" and now - check_start > 1300:
                 active_js_bot = checking_bot.name
                 game_state = "JUMPSCARE"
-                js_frame_index = 0
+                js_player.play()
                 stop_all_sounds()
                 play_sound(jumpscare_sound)
 
-            frames = checks.get(checking_bot.name + "_fail")
-            if frames:
-                screen.blit(frames[js_frame_index % len(frames)][0], (office_x, 0))
-                js_frame_index += 1
+            if check_player.frame(checks.get(checking_bot.name + "_fail")):
+                check_player.blit(screen, (0, 0), office_viewport())
+                dirty_renderer.scene("check", check_player.source)
+                dirty_renderer.mark(check_player.dirty)
 
             if check_type == "success":
                 if not mask_on:
                     active_js_bot = checking_bot.name
                     game_state = "JUMPSCARE"
-                    js_frame_index = 0
+                    js_player.play()
                     stop_all_sounds()
                     play_sound(jumpscare_sound)
                 elif now - success_start > 3000:
@@ -1742,76 +3863,94 @@ while running:
                         checking_bot.pos = "Stage"
                     else:
                         checking_bot.pos = checking_bot.start_pos
-                    checking_bot.last_think = pygame.time.get_ticks() + 3000
+                    checking_bot.last_think = sim_time_ms + 3000
                     checking_bot.status_msg = "Waiting"
                     game_state = "PLAY"
                     stop_sound(check_sound)
 
-        if mask_animation_state == "equipping" and mask_equip_frames:
-            screen.blit(mask_equip_frames[mask_animation_frame][0], (0, 0))
+        if mask_animation_state == "equipping":
+            if mask_player.frame(anims["mask_equip"]):
+                mask_player.blit(screen)
+                dirty_renderer.scene("mask_equip")
+                dirty_renderer.mark(mask_player.dirty)
         elif mask_animation_state == "equipped":
             screen.blit(imgs["mask"], (0, 0))
-        elif mask_animation_state == "unequipping" and mask_unequip_frames:
-            screen.blit(mask_unequip_frames[mask_animation_frame][0], (0, 0))
+            dirty_renderer.scene("mask")
+        elif mask_animation_state == "unequipping":
+            if mask_player.frame(anims["mask_unequip"]):
+                mask_player.blit(screen)
+                dirty_renderer.scene("mask_unequip")
+                dirty_renderer.mark(mask_player.dirty)
 
         if game_state in ["PLAY", "CHECKING"]:
-            mouse_pos = pygame.mouse.get_pos()
+            mouse_pos = get_mouse_pos()
             monitor_hover = monitor_button_rect.collidepoint(mouse_pos)
             mask_hover = mask_button_rect.collidepoint(mouse_pos)
 
             if mask_animation_state == "equipped":
-                screen.blit(imgs["mask_button"], mask_button_rect)
+                hud_buttons = [("mask_button", mask_button_rect)]
             elif camera_mode:
-                screen.blit(imgs["monitor_button"], monitor_button_rect)
+                hud_buttons = [("monitor_button", monitor_button_rect)]
             else:
                 if mask_hover and mask_animation_state is None:
-                    screen.blit(imgs["mask_button"], mask_button_rect)
+                    hud_buttons = [("mask_button", mask_button_rect)]
                 elif monitor_hover:
-                    screen.blit(imgs["monitor_button"], monitor_button_rect)
+                    hud_buttons = [("monitor_button", monitor_button_rect)]
                 else:
-                    screen.blit(imgs["monitor_button"], monitor_button_rect)
-                    screen.blit(imgs["mask_button"], mask_button_rect)
+                    hud_buttons = [("monitor_button", monitor_button_rect), ("mask_button", mask_button_rect)]
+            ui_atlas.blits(screen, hud_buttons)
+            dirty_renderer.scene("hud", *(key for key, _ in hud_buttons))
 
         if puppet.charge < 50 and puppet.charge > 0:
-            alert_frames = red_alert_frames if puppet.charge < 20 else orange_alert_frames
-            if alert_frames:
-                frame_idx = js_frame_index_alert % len(alert_frames)
-                alert_w, alert_h = alert_frames[0][0].get_size()
-                screen.blit(alert_frames[frame_idx][0], (WIN_W - alert_w - 10, WIN_H - alert_h - 10))
+            alert_surf = alert_player.frame(anims["red_alert"] if puppet.charge < 20 else anims["orange_alert"])
+            if alert_surf:
+                alert_w, alert_h = alert_surf.get_size()
+                alert_rect = screen.blit(alert_surf, (WIN_W - alert_w - 10, WIN_H - alert_h - 10))
+                dirty_renderer.scene("alert", puppet.charge < 20)
+                dirty_renderer.mark(alert_rect)
 
-        screen.blit(font_clock.render(f"{hour} AM", True, (255, 255, 255)), (WIN_W - 150, 30))
+        screen.blit(render_text(font_clock, f"{hour} AM", True, (255, 255, 255)), (WIN_W - 150, 30))
+        dirty_renderer.scene("clock", hour)
 
         if dev_mode_active:
-            dev_panel = pygame.Surface((420, 130), pygame.SRCALPHA)
-            dev_panel.fill((0, 0, 0, 180))
-            screen.blit(dev_panel, (10, 10))
+            draw_dev_backdrop(screen)
 
+            # Строки панели меняются почти каждый кадр - в TextCache они бы только вытесняли
+            # стабильные надписи и портили его статистику, поэтому рендерятся напрямую
             for i, bot in enumerate(bots):
                 color = (0, 255, 0) if bot.pos == "Stage" else ((255, 255, 0) if bot.pos == "Target" else (255, 0, 0))
                 screen.blit(font_dev.render(f"{bot.name}: {bot.pos} | {bot.status_msg}", True, color), (15, 15 + i*30))
 
-    elif game_state == "MONITOR_OPENING":
-        if monitor_up_frames:
-            elapsed = pygame.time.get_ticks() - monitor_animation_start
-            cum_time = current_surf = 0
+            load_text = (f"Assets: {len(asset_loader.times)} loaded, {asset_loader.total_ms:.0f} ms, "
+                         f"dedup {surface_interner.saved_bytes / 2**20:.1f} MB saved | "
+                         f"preload {preload_scheduler.warmed} warmed, {preload_scheduler.ready} ready, {preload_scheduler.late} late")
+            screen.blit(font_dev.render(load_text, True, (200, 200, 200)), (15, 15 + len(bots)*30))
 
-            for surf, dur in monitor_up_frames:
-                if elapsed < cum_time + dur:
-                    current_surf = surf
-                    break
-                cum_time += dur
+            groups_text = ", ".join(f"{name} {nbytes / 2**20:.0f}" for name, nbytes in asset_budget.group_bytes.items())
+            budget_text = (f"Surfaces: {asset_budget.total_bytes / 2**20:.0f}/{asset_budget.limit_bytes / 2**20:.0f} MB "
+                           f"({groups_text}) | hit {asset_budget.hits} miss {asset_budget.misses} evict {asset_budget.evictions}")
+            screen.blit(font_dev.render(budget_text, True, (200, 200, 200)), (15, 15 + (len(bots) + 1)*30))
 
-            if current_surf:
-                mouse_x, _ = pygame.mouse.get_pos()
-                target_x = -(mouse_x / WIN_W) * (imgs["main"].get_width() - WIN_W)
-                office_x += (target_x - office_x) * 0.1
-                screen.blit(imgs["main"], (office_x, 0))
+            pushed = dirty_renderer.pixels_pushed
+            pushed_text = (f"Pushed: {pushed} px/frame ({pushed * 100 // max(1, display.get_width() * display.get_height())}%), "
+                           f"{'dirty rects' if settings['dirty_rects'] else 'full flip'}")
+            screen.blit(font_dev.render(pushed_text, True, (200, 200, 200)), (15, 15 + (len(bots) + 2)*30))
 
-                if bb_in_office:
-                    screen.blit(imgs["office_bb"], (office_x, 0))
+            lookups = text_cache.hits + text_cache.misses
+            text_stats = (f"Text cache: {text_cache.hits} hits / {text_cache.misses} misses "
+                          f"({text_cache.hits * 100 // max(1, lookups)}%), {len(text_cache.surfaces)} entries, {len(fonts.fonts)} fonts")
+            screen.blit(font_dev.render(text_stats, True, (200, 200, 200)), (15, 15 + (len(bots) + 3)*30))
+            dirty_renderer.scene("dev")
+            dirty_renderer.mark(pygame.Rect(0, 0, WIN_W, 15 + (len(bots) + 4)*30))
+
+    elif game_state == "MONITOR_OPENING":
+        if anims["monitor_up"]:
+            current_surf = monitor_player.frame(anims["monitor_up"])
 
-                screen.blit(current_surf, (0, 0))
-                screen.blit(imgs["monitor_button"], monitor_button_rect)
+            if current_surf:
+                draw_office(imgs["main"])
+                monitor_player.blit(screen)
+                ui_atlas.blits(screen, [("monitor_button", monitor_button_rect)])
             else:
                 camera_mode = True
                 game_state = "PLAY"
@@ -1820,20 +3959,13 @@ while running:
             game_state = "PLAY"
 
     elif game_state == "MONITOR_CLOSING":
-        if monitor_down_frames:
-            elapsed = pygame.time.get_ticks() - monitor_animation_start
-            cum_time = current_surf = 0
-
-            for surf, dur in monitor_down_frames:
-                if elapsed < cum_time + dur:
-                    current_surf = surf
-                    break
-                cum_time += dur
+        if anims["monitor_down"]:
+            current_surf = monitor_player.frame(anims["monitor_down"])
 
             if current_surf:
                 screen.fill((0, 0, 0))
-                screen.blit(current_surf, (0, 0))
-                screen.blit(imgs["monitor_button"], monitor_button_rect)
+                monitor_player.blit(screen)
+                ui_atlas.blits(screen, [("monitor_button", monitor_button_rect)])
             else:
                 camera_mode = False
                 game_state = "PLAY"
@@ -1846,48 +3978,111 @@ while running:
         beat_detector.update(elapsed_sec)
         shake_x, shake_y = beat_detector.get_shake_offset()
 
-        screen.fill((0, 0, 0))
-        screen.blit(imgs["menu"], (shake_x, shake_y))
+        ui_screen.fill((0, 0, 0))
+        ui_screen.blit(imgs["menu"], (shake_x, shake_y))
 
         for i, btn in enumerate(menu_buttons):
             if i == 2 and not is_custom_unlocked:
                 continue
 
-            text_surf = menu_font.render(btn["text"], True, (255, 255, 255))
-            x, y = 200 + shake_x, (menu_button_y_start + (i if i <= 2 else 3) * menu_button_spacing + shake_y)
+            text_surf = render_text(menu_font, btn["text"], True, (255, 255, 255))
+            x, y = 200 + shake_x, (menu_button_y_start + i * menu_button_spacing + shake_y)
 
-            screen.blit(text_surf, (x, y))
+            ui_screen.blit(text_surf, (x, y))
 
             if i == menu_selected:
-                screen.blit(menu_font.render(">>", True, (255, 255, 255)), (x - menu_font.size(">>")[0] - 20, y))
+                ui_screen.blit(render_text(menu_font, ">>", True, (255, 255, 255)), (x - menu_font.size(">>")[0] - 20, y))
 
                 if btn["action"] == "continue":
-                    screen.blit(menu_font.render(f"НОЧЬ {current_night}", True, (255, 255, 255)), (x, y + text_surf.get_height() + 10))
-
-        screen.blit(imgs["bug_icon"], (rect_bug.x + shake_x, rect_bug.y + shake_y))
-        screen.blit(imgs["tg_icon"], (rect_tg.x + shake_x, rect_tg.y + shake_y))
-        screen.blit(imgs["tiktok_icon"], (rect_tiktok.x + shake_x, rect_tiktok.y + shake_y))
+                    ui_screen.blit(render_text(menu_font, f"НОЧЬ {current_night}", True, (255, 255, 255)), (x, y + text_surf.get_height() + 10))
+
+        ui_atlas.blits(ui_screen, [("bug_icon", (rect_bug.x + shake_x, rect_bug.y + shake_y)),
+                                ("tg_icon", (rect_tg.x + shake_x, rect_tg.y + shake_y)),
+                                ("tiktok_icon", (rect_tiktok.x + shake_x, rect_tiktok.y + shake_y))])
+        # Тряска в такт сдвигает весь экран - тогда кадр выводится целиком, в покое не выводится ничего
+        dirty_renderer.scene("menu", imgs["menu"], shake_x, shake_y, menu_selected, is_custom_unlocked, current_night)
+
+    elif game_state == "SETTINGS":
+        ui_screen.fill((0, 0, 0))
+
+        title = render_text(font_title, "Настройки", True, (255, 255, 255))
+        ui_screen.blit(title, (UI_W // 2 - title.get_width() // 2, settings_title_y))
+
+        ui_screen.blit(render_text(font_button, "Разрешение", True, (255, 255, 255)), (UI_W // 2 - 300, settings_rects["resolution_left"].y + 5))
+        for key, label in (("resolution_left", "<"), ("resolution_right", ">")):
+            rect = settings_rects[key]
+            pygame.draw.rect(ui_screen, (100, 100, 100), rect)
+            pygame.draw.rect(ui_screen, (200, 200, 200), rect, 2)
+            ui_screen.blit(render_text(font_button, label, True, (255, 255, 255)), (rect.x + 12, rect.y + 2))
+        res_text = render_text(font_button, "{}x{}".format(*display.get_size()), True, (255, 255, 0))
+        res_center = (settings_rects["resolution_left"].right + settings_rects["resolution_right"].x) // 2
+        ui_screen.blit(res_text, (res_center - res_text.get_width() // 2, settings_rects["resolution_left"].y + 5))
+
+        ui_screen.blit(render_text(font_button, "Режим", True, (255, 255, 255)), (UI_W // 2 - 300, settings_rects["fullscreen"].y + 5))
+        mode_rect = settings_rects["fullscreen"]
+        pygame.draw.rect(ui_screen, (100, 100, 100), mode_rect)
+        pygame.draw.rect(ui_screen, (200, 200, 200), mode_rect, 2)
+        mode_text = render_text(font_button, "Полный экран" if settings["fullscreen"] else "Окно", True, (255, 255, 255))
+        ui_screen.blit(mode_text, (mode_rect.centerx - mode_text.get_width() // 2, mode_rect.y + 2))
+
+        ui_screen.blit(render_text(font_button, "Масштаб рендера", True, (255, 255, 255)), (UI_W // 2 - 300, settings_rects["render_scale"].y + 5))
+        scale_rect = settings_rects["render_scale"]
+        pygame.draw.rect(ui_screen, (100, 100, 100), scale_rect)
+        pygame.draw.rect(ui_screen, (200, 200, 200), scale_rect, 2)
+        scale_text = render_text(font_button, f"{settings['render_scale']:.0%} ({WIN_W}x{WIN_H})", True, (255, 255, 255))
+        ui_screen.blit(scale_text, (scale_rect.centerx - scale_text.get_width() // 2, scale_rect.y + 2))
+
+        ui_screen.blit(render_text(font_button, "Отрисовка", True, (255, 255, 255)), (UI_W // 2 - 300, settings_rects["dirty_rects"].y + 5))
+        dirty_rect = settings_rects["dirty_rects"]
+        pygame.draw.rect(ui_screen, (100, 100, 100), dirty_rect)
+        pygame.draw.rect(ui_screen, (200, 200, 200), dirty_rect, 2)
+        dirty_text = render_text(font_button, "Только изменения" if settings["dirty_rects"] else "Весь кадр", True, (255, 255, 255))
+        ui_screen.blit(dirty_text, (dirty_rect.centerx - dirty_text.get_width() // 2, dirty_rect.y + 2))
+
+        ui_screen.blit(render_text(font_button, "Частота кадров", True, (255, 255, 255)), (UI_W // 2 - 300, settings_rects["frame_rate"].y + 5))
+        rate_rect = settings_rects["frame_rate"]
+        pygame.draw.rect(ui_screen, (100, 100, 100), rate_rect)
+        pygame.draw.rect(ui_screen, (200, 200, 200), rate_rect, 2)
+        rate = settings["frame_rate"]
+        rate_label = "VSync" if rate == "vsync" else (f"{rate} FPS" if rate else "Без ограничения")
+        rate_text = render_text(font_button, rate_label, True, (255, 255, 255))
+        ui_screen.blit(rate_text, (rate_rect.centerx - rate_text.get_width() // 2, rate_rect.y + 2))
+
+        ui_screen.blit(render_text(font_button, "Анимации", True, (255, 255, 255)), (UI_W // 2 - 300, settings_rects["palettized_animations"].y + 5))
+        anim_rect = settings_rects["palettized_animations"]
+        pygame.draw.rect(ui_screen, (100, 100, 100), anim_rect)
+        pygame.draw.rect(ui_screen, (200, 200, 200), anim_rect, 2)
+        anim_text = render_text(font_button, "Экономия памяти" if settings["palettized_animations"] else "Полный цвет", True, (255, 255, 255))
+        ui_screen.blit(anim_text, (anim_rect.centerx - anim_text.get_width() // 2, anim_rect.y + 2))
+
+        back_rect = settings_rects["back"]
+        pygame.draw.rect(ui_screen, (70, 130, 180), back_rect, border_radius=15)
+        pygame.draw.rect(ui_screen, (200, 200, 200), back_rect, 3, border_radius=15)
+        back_text = render_text(font_button, "Назад", True, (255, 255, 255))
+        ui_screen.blit(back_text, (back_rect.centerx - back_text.get_width() // 2, back_rect.y + 8))
+        dirty_renderer.scene("settings", display.get_size(), WIN_W, WIN_H, settings["fullscreen"], settings["render_scale"],
+                             settings["dirty_rects"], settings["frame_rate"], settings["palettized_animations"])
 
     elif game_state == "BUG_REPORT":
-        screen.fill((0, 0, 0))
+        ui_screen.fill((0, 0, 0))
 
-        window_rect = pygame.Rect(WIN_W // 2 - 400, WIN_H // 2 - 250, 800, 500)
-        pygame.draw.rect(screen, (40, 40, 40), window_rect)
-        pygame.draw.rect(screen, (200, 200, 200), window_rect, 3)
+        window_rect = pygame.Rect(UI_W // 2 - 400, UI_H // 2 - 250, 800, 500)
+        pygame.draw.rect(ui_screen, (40, 40, 40), window_rect)
+        pygame.draw.rect(ui_screen, (200, 200, 200), window_rect, 3)
 
-        title = font_title.render("Сообщить о баге", True, (255, 255, 255))
-        screen.blit(title, (WIN_W // 2 - title.get_width() // 2, WIN_H // 2 - 230))
+        title = render_text(font_title, "Сообщить о баге", True, (255, 255, 255))
+        ui_screen.blit(title, (UI_W // 2 - title.get_width() // 2, UI_H // 2 - 230))
 
-        close_btn = pygame.Rect(WIN_W // 2 + 350, WIN_H // 2 - 250, 40, 40)
-        pygame.draw.rect(screen, (150, 50, 50), close_btn)
-        pygame.draw.rect(screen, (255, 255, 255), close_btn, 2)
-        screen.blit(font_button.render("X", True, (255, 255, 255)), (close_btn.x + 8, close_btn.y + 2))
+        close_btn = pygame.Rect(UI_W // 2 + 350, UI_H // 2 - 250, 40, 40)
+        pygame.draw.rect(ui_screen, (150, 50, 50), close_btn)
+        pygame.draw.rect(ui_screen, (255, 255, 255), close_btn, 2)
+        ui_screen.blit(render_text(font_button, "X", True, (255, 255, 255)), (close_btn.x + 8, close_btn.y + 2))
 
-        screen.blit(font_bug_report.render("Опишите баг:", True, (255, 255, 255)), (WIN_W // 2 - 350, WIN_H // 2 - 180))
+        ui_screen.blit(render_text(font_bug_report, "Опишите баг:", True, (255, 255, 255)), (UI_W // 2 - 350, UI_H // 2 - 180))
 
-        text_box = pygame.Rect(WIN_W // 2 - 350, WIN_H // 2 - 150, 700, 100)
-        pygame.draw.rect(screen, (60, 60, 60), text_box)
-        pygame.draw.rect(screen, (200, 200, 200), text_box, 2)
+        text_box = pygame.Rect(UI_W // 2 - 350, UI_H // 2 - 150, 700, 100)
+        pygame.draw.rect(ui_screen, (60, 60, 60), text_box)
+        pygame.draw.rect(ui_screen, (200, 200, 200), text_box, 2)
 
         words = bug_report_text.split(' ')
         lines, current_line = [], ""
@@ -1902,59 +4097,63 @@ while running:
 
         y_offset = 0
         for line in lines[-4:]:
-            screen.blit(font_bug_input.render(line, True, (255, 255, 255)), (text_box.x + 10, text_box.y + 10 + y_offset))
+            ui_screen.blit(render_text(font_bug_input, line, True, (255, 255, 255)), (text_box.x + 10, text_box.y + 10 + y_offset))
             y_offset += 25
 
+        cursor_x = text_box.x + 10 + font_bug_input.size(lines[-1] if lines else "")[0]
+        cursor_y = text_box.y + 10 + (len(lines[-4:]) - 1) * 25
         if pygame.time.get_ticks() % 1000 < 500:
-            cursor_x = text_box.x + 10 + font_bug_input.size(lines[-1] if lines else "")[0]
-            cursor_y = text_box.y + 10 + (len(lines[-4:]) - 1) * 25
-            pygame.draw.line(screen, (255, 255, 255), (cursor_x, cursor_y), (cursor_x, cursor_y + 20), 2)
+            pygame.draw.line(ui_screen, (255, 255, 255), (cursor_x, cursor_y), (cursor_x, cursor_y + 20), 2)
+        # Курсор мигает и в видимой, и в погасшей фазе - его место выводится каждый кадр
+        dirty_renderer.mark(pygame.Rect(cursor_x - 2, cursor_y - 2, 6, 25))
 
-        screen.blit(font_bug_report.render("Категория:", True, (255, 255, 255)), (WIN_W // 2 - 350, WIN_H // 2 - 30))
+        ui_screen.blit(render_text(font_bug_report, "Категория:", True, (255, 255, 255)), (UI_W // 2 - 350, UI_H // 2 - 30))
 
         for i, cat in enumerate(bug_categories):
-            y_pos = WIN_H // 2 - 50 + i * 60
+            y_pos = UI_H // 2 - 50 + i * 60
 
-            radio_rect = pygame.Rect(WIN_W // 2 - 300, y_pos, 30, 30)
-            pygame.draw.circle(screen, (200, 200, 200), radio_rect.center, 15, 2)
+            radio_rect = pygame.Rect(UI_W // 2 - 300, y_pos, 30, 30)
+            pygame.draw.circle(ui_screen, (200, 200, 200), radio_rect.center, 15, 2)
 
             if bug_report_category == cat:
-                pygame.draw.circle(screen, (50, 200, 50), radio_rect.center, 10)
+                pygame.draw.circle(ui_screen, (50, 200, 50), radio_rect.center, 10)
 
-            screen.blit(font_bug_input.render(cat, True, (255, 255, 255)), (WIN_W // 2 - 260, y_pos + 5))
+            ui_screen.blit(render_text(font_bug_input, cat, True, (255, 255, 255)), (UI_W // 2 - 260, y_pos + 5))
 
-        submit_btn = pygame.Rect(WIN_W // 2 - 100, WIN_H // 2 + 200, 200, 50)
+        submit_btn = pygame.Rect(UI_W // 2 - 100, UI_H // 2 + 200, 200, 50)
         can_submit = bug_report_text.strip() and bug_report_category
 
         btn_color = (50, 150, 50) if (can_submit and can_submit_bug_report()) else (100, 100, 100)
 
-        pygame.draw.rect(screen, btn_color, submit_btn)
-        pygame.draw.rect(screen, (200, 200, 200), submit_btn, 3)
-        screen.blit(font_button.render("Отправить", True, (255, 255, 255)), 
+        pygame.draw.rect(ui_screen, btn_color, submit_btn)
+        pygame.draw.rect(ui_screen, (200, 200, 200), submit_btn, 3)
+        ui_screen.blit(render_text(font_button, "Отправить", True, (255, 255, 255)), 
                    (submit_btn.x + (submit_btn.width - font_button.size("Отправить")[0])//2, submit_btn.y + 10))
 
         if not can_submit_bug_report():
             minutes, seconds = get_time_until_next_report()
-            cooldown_text = font_bug_input.render(f"Подождите {minutes}:{seconds:02d} до следующего отчета", True, (255, 100, 100))
-            screen.blit(cooldown_text, (WIN_W // 2 - cooldown_text.get_width() // 2, WIN_H // 2 + 170))
+            cooldown_text = render_text(font_bug_input, f"Подождите {minutes}:{seconds:02d} до следующего отчета", True, (255, 100, 100))
+            ui_screen.blit(cooldown_text, (UI_W // 2 - cooldown_text.get_width() // 2, UI_H // 2 + 170))
+            dirty_renderer.mark(pygame.Rect(window_rect.x, UI_H // 2 + 170, window_rect.width, cooldown_text.get_height()))
+        dirty_renderer.scene("bug_report", bug_report_text, bug_report_category, can_submit_bug_report())
 
     elif game_state == "MODS":
-        screen.fill((0, 0, 0))
+        ui_screen.fill((0, 0, 0))
 
         window_width, window_height = 800, 600
-        window_x, window_y = WIN_W // 2 - window_width // 2, WIN_H // 2 - window_height // 2
+        window_x, window_y = UI_W // 2 - window_width // 2, UI_H // 2 - window_height // 2
 
         window_rect = pygame.Rect(window_x, window_y, window_width, window_height)
-        pygame.draw.rect(screen, (40, 40, 40), window_rect)
-        pygame.draw.rect(screen, (200, 200, 200), window_rect, 3)
+        pygame.draw.rect(ui_screen, (40, 40, 40), window_rect)
+        pygame.draw.rect(ui_screen, (200, 200, 200), window_rect, 3)
 
-        title = font_title.render("Моды", True, (255, 255, 255))
-        screen.blit(title, (WIN_W // 2 - title.get_width() // 2, window_y + 20))
+        title = render_text(font_title, "Моды", True, (255, 255, 255))
+        ui_screen.blit(title, (UI_W // 2 - title.get_width() // 2, window_y + 20))
 
         panel_width = 150
         panel_rect = pygame.Rect(window_x + 10, window_y + 70, panel_width, window_height - 80)
-        pygame.draw.rect(screen, (30, 30, 30), panel_rect)
-        pygame.draw.rect(screen, (200, 200, 200), panel_rect, 2)
+        pygame.draw.rect(ui_screen, (30, 30, 30), panel_rect)
+        pygame.draw.rect(ui_screen, (200, 200, 200), panel_rect, 2)
 
         tab_buttons = [
             {"text": "Популярное", "id": "popular", "y": window_y + 80},
@@ -1966,94 +4165,98 @@ while running:
             tab_rect = pygame.Rect(window_x + 15, tab["y"], panel_width - 10, 50)
 
             color = (70, 130, 180) if current_mods_tab == tab["id"] else (50, 50, 50)
-            pygame.draw.rect(screen, color, tab_rect, border_radius=5)
-            pygame.draw.rect(screen, (200, 200, 200), tab_rect, 2, border_radius=5)
+            pygame.draw.rect(ui_screen, color, tab_rect, border_radius=5)
+            pygame.draw.rect(ui_screen, (200, 200, 200), tab_rect, 2, border_radius=5)
 
-            tab_text = font_mods_tab.render(tab["text"], True, (255, 255, 255))
-            screen.blit(tab_text, (tab_rect.x + (tab_rect.width - tab_text.get_width()) // 2, 
+            tab_text = render_text(font_mods_tab, tab["text"], True, (255, 255, 255))
+            ui_screen.blit(tab_text, (tab_rect.x + (tab_rect.width - tab_text.get_width()) // 2, 
                                   tab_rect.y + (tab_rect.height - tab_text.get_height()) // 2))
 
-        close_btn = pygame.Rect(WIN_W // 2 + 350, WIN_H // 2 - 300, 40, 40)
-        pygame.draw.rect(screen, (150, 50, 50), close_btn)
-        pygame.draw.rect(screen, (255, 255, 255), close_btn, 2)
-        screen.blit(font_button.render("X", True, (255, 255, 255)), (close_btn.x + 8, close_btn.y + 2))
+        close_btn = pygame.Rect(UI_W // 2 + 350, UI_H // 2 - 300, 40, 40)
+        pygame.draw.rect(ui_screen, (150, 50, 50), close_btn)
+        pygame.draw.rect(ui_screen, (255, 255, 255), close_btn, 2)
+        ui_screen.blit(render_text(font_button, "X", True, (255, 255, 255)), (close_btn.x + 8, close_btn.y + 2))
 
         content_x = window_x + panel_width + 20
         content_y = window_y + 80
 
         if current_mods_tab in ["popular", "developer"]:
             text = "Популярные моды" if current_mods_tab == "popular" else "Моды от разработчика"
-            empty_text = font_mods.render(f"{text} скоро появятся!", True, (200, 200, 200))
-            screen.blit(empty_text, (content_x + 50, content_y + 100))
+            empty_text = render_text(font_mods, f"{text} скоро появятся!", True, (200, 200, 200))
+            ui_screen.blit(empty_text, (content_x + 50, content_y + 100))
 
         elif current_mods_tab == "library":
             if not available_mods:
-                screen.blit(font_mods.render("Модов пока нет.", True, (200, 200, 200)), (content_x + 100, content_y + 50))
-                screen.blit(font_bug_input.render("Добавьте .py файлы в папку с модами", True, (150, 150, 150)), (content_x + 50, content_y + 80))
+                ui_screen.blit(render_text(font_mods, "Модов пока нет.", True, (200, 200, 200)), (content_x + 100, content_y + 50))
+                ui_screen.blit(render_text(font_bug_input, "Добавьте .py файлы в папку с модами", True, (150, 150, 150)), (content_x + 50, content_y + 80))
             else:
                 for i, mod in enumerate(available_mods):
                     mod_y = content_y + i * 80
 
-                    screen.blit(font_mods.render(mod['name'], True, (255, 255, 255)), (content_x + 10, mod_y))
+                    ui_screen.blit(render_text(font_mods, mod['name'], True, (255, 255, 255)), (content_x + 10, mod_y))
 
                     is_installed = installed_mod and installed_mod['name'] == mod['name']
 
                     if is_installed:
                         launch_btn = pygame.Rect(content_x + 200, mod_y + 10, 120, 40)
-                        pygame.draw.rect(screen, (50, 150, 50), launch_btn)
-                        pygame.draw.rect(screen, (200, 200, 200), launch_btn, 2)
-                        screen.blit(font_bug_report.render("Запустить", True, (255, 255, 255)), 
+                        pygame.draw.rect(ui_screen, (50, 150, 50), launch_btn)
+                        pygame.draw.rect(ui_screen, (200, 200, 200), launch_btn, 2)
+                        ui_screen.blit(render_text(font_bug_report, "Запустить", True, (255, 255, 255)), 
                                    (launch_btn.x + (launch_btn.width - font_bug_report.size("Запустить")[0])//2, launch_btn.y + 10))
 
                         uninstall_btn = pygame.Rect(content_x + 330, mod_y + 10, 60, 40)
-                        pygame.draw.rect(screen, (150, 50, 50), uninstall_btn)
-                        pygame.draw.rect(screen, (200, 200, 200), uninstall_btn, 2)
-                        screen.blit(font_bug_report.render("X", True, (255, 255, 255)), 
+                        pygame.draw.rect(ui_screen, (150, 50, 50), uninstall_btn)
+                        pygame.draw.rect(ui_screen, (200, 200, 200), uninstall_btn, 2)
+                        ui_screen.blit(render_text(font_bug_report, "X", True, (255, 255, 255)), 
                                    (uninstall_btn.x + (uninstall_btn.width - font_bug_report.size("X")[0])//2, uninstall_btn.y + 10))
 
-                        screen.blit(font_bug_input.render("(Установлен)", True, (50, 255, 50)), 
+                        ui_screen.blit(render_text(font_bug_input, "(Установлен)", True, (50, 255, 50)), 
                                    (content_x + 10 + font_mods.size(mod['name'])[0] + 10, mod_y + 5))
                     else:
                         install_btn = pygame.Rect(content_x + 200, mod_y + 10, 120, 40)
-                        pygame.draw.rect(screen, (100, 100, 150), install_btn)
-                        pygame.draw.rect(screen, (200, 200, 200), install_btn, 2)
-                        screen.blit(font_bug_report.render("Установить", True, (255, 255, 255)), 
+                        pygame.draw.rect(ui_screen, (100, 100, 150), install_btn)
+                        pygame.draw.rect(ui_screen, (200, 200, 200), install_btn, 2)
+                        ui_screen.blit(render_text(font_bug_report, "Установить", True, (255, 255, 255)), 
                                    (install_btn.x + (install_btn.width - font_bug_report.size("Установить")[0])//2, install_btn.y + 10))
 
-            open_folder_btn = pygame.Rect(WIN_W // 2 - 100, WIN_H // 2 + 230, 200, 50)
-            pygame.draw.rect(screen, (70, 130, 180), open_folder_btn, border_radius=15)
-            pygame.draw.rect(screen, (200, 200, 200), open_folder_btn, 3, border_radius=15)
-            folder_btn_text = font_button.render("Папка с модами", True, (255, 255, 255))
-            screen.blit(folder_btn_text, (open_folder_btn.x + (open_folder_btn.width - folder_btn_text.get_width())//2, open_folder_btn.y + 10))
+            open_folder_btn = pygame.Rect(UI_W // 2 - 100, UI_H // 2 + 230, 200, 50)
+            pygame.draw.rect(ui_screen, (70, 130, 180), open_folder_btn, border_radius=15)
+            pygame.draw.rect(ui_screen, (200, 200, 200), open_folder_btn, 3, border_radius=15)
+            folder_btn_text = render_text(font_button, "Папка с модами", True, (255, 255, 255))
+            ui_screen.blit(folder_btn_text, (open_folder_btn.x + (open_folder_btn.width - folder_btn_text.get_width())//2, open_folder_btn.y + 10))
 
         warning_y = window_y + window_height + 20
-        warning_text1 = font_mods_warning.render("Внимание! Моды являются модификацией игрового кода.", True, (255, 50, 50))
-        warning_text2 = font_mods_warning.render("Перед их скачиванием проверяйте мод на вирусы!", True, (255, 50, 50))
-        screen.blit(warning_text1, (WIN_W // 2 - warning_text1.get_width() // 2, warning_y))
-        screen.blit(warning_text2, (WIN_W // 2 - warning_text2.get_width() // 2, warning_y + 25))
+        warning_text1 = render_text(font_mods_warning, "Внимание! Моды являются модификацией игрового кода.", True, (255, 50, 50))
+        warning_text2 = render_text(font_mods_warning, "Перед их скачиванием проверяйте мод на вирусы!", True, (255, 50, 50))
+        ui_screen.blit(warning_text1, (UI_W // 2 - warning_text1.get_width() // 2, warning_y))
+        ui_screen.blit(warning_text2, (UI_W // 2 - warning_text2.get_width() // 2, warning_y + 25))
+        dirty_renderer.scene("mods", current_mods_tab, tuple(mod['name'] for mod in available_mods),
+                             installed_mod and installed_mod['name'])
 
     elif game_state == "CUSTOM":
-        screen.fill((0, 0, 0))
-
-        custom_title = font_title.render("Custom Night", True, (255, 255, 255))
-        screen.blit(custom_title, (WIN_W//2 - custom_title.get_width()//2, 50))
-
+        ui_screen.fill((0, 0, 0))
+
+        custom_title = render_text(font_title, "Custom Night", True, (255, 255, 255))
+        ui_screen.blit(custom_title, (UI_W//2 - custom_title.get_width()//2, 50))
+
+        face_map = {
+            "Toy Bonnie": ["toy_bonnie_face", "toy_bonnie_face2", "toy_bonnie_face3"],
+            "Toy Chica": ["toy_chica_face", "toy_chica_face2", "toy_chica_face3"],
+            "Withered Foxy": ["withered_foxy_face", "withered_foxy_face2", "withered_foxy_face3"],
+            "Puppet": ["puppet_face"],
+            "Balloon Boy": ["bb_face", "bb_face2", "bb_face3", "bb_face4"],
+            "Withered Bonny": ["withered_bonny_face"],
+            "Withered Freddy": ["withered_freddy_face"],
+            "Withered Chica": ["withered_chica_face"],
+            "Toy Freddy": ["toy_freddy_face"],
+        }
+
+        # Все лица - одним blits() из атласа
+        face_blits = []
         for i, name in enumerate(custom_characters):
             x, y = char_positions[i]
             level = custom_levels[name]
 
-            face_map = {
-                "Toy Bonnie": ["toy_bonnie_face", "toy_bonnie_face2", "toy_bonnie_face3"],
-                "Toy Chica": ["toy_chica_face", "toy_chica_face2", "toy_chica_face3"],
-                "Withered Foxy": ["withered_foxy_face", "withered_foxy_face2", "withered_foxy_face3"],
-                "Puppet": ["puppet_face"],
-                "Balloon Boy": ["bb_face", "bb_face2", "bb_face3", "bb_face4"],
-                "Withered Bonny": ["withered_bonny_face"],
-                "Withered Freddy": ["withered_freddy_face"],
-                "Withered Chica": ["withered_chica_face"],
-                "Toy Freddy": ["toy_freddy_face"],
-            }
-
             if name in face_map:
                 faces = face_map[name]
                 if name == "Balloon Boy":
@@ -2064,38 +4267,47 @@ while running:
                     face_idx = 0
 
                 face_key = faces[min(face_idx, len(faces) - 1)]
-                if face_key in imgs:
-                    face_img = imgs[face_key]
-                    screen.blit(face_img, (x - face_img.get_width() // 2, y - face_img.get_height() // 2 - 30))
+                face_w, face_h = ui_atlas.get_size(face_key)
+                face_blits.append((face_key, (x - face_w // 2, y - face_h // 2 - 30)))
+        ui_atlas.blits(ui_screen, face_blits)
+
+        for i, name in enumerate(custom_characters):
+            x, y = char_positions[i]
+            level = custom_levels[name]
 
-            screen.blit(font_button.render(name, True, (255, 255, 255)), (x - font_button.size(name)[0] // 2, y + 60))
+            ui_screen.blit(render_text(font_button, name, True, (255, 255, 255)), (x - font_button.size(name)[0] // 2, y + 60))
 
-            pygame.draw.rect(screen, (100, 100, 100), custom_rects_left[name])
-            pygame.draw.rect(screen, (200, 200, 200), custom_rects_left[name], 2)
-            screen.blit(font_button.render("<", True, (255, 255, 255)), (custom_rects_left[name].x + 8, custom_rects_left[name].y + 5))
+            pygame.draw.rect(ui_screen, (100, 100, 100), custom_rects_left[name])
+            pygame.draw.rect(ui_screen, (200, 200, 200), custom_rects_left[name], 2)
+            ui_screen.blit(render_text(font_button, "<", True, (255, 255, 255)), (custom_rects_left[name].x + 8, custom_rects_left[name].y + 5))
 
-            level_text = pygame.font.SysFont("Arial", 28, bold=True).render(str(level), True, (255, 255, 0))
+            level_text = render_text(font_level, str(level), True, (255, 255, 0))
             level_rect = custom_level_rects[name]
-            screen.blit(level_text, (level_rect.x + (level_rect.width - level_text.get_width()) // 2, 
+            ui_screen.blit(level_text, (level_rect.x + (level_rect.width - level_text.get_width()) // 2, 
                                     level_rect.y + (level_rect.height - level_text.get_height()) // 2))
 
-            pygame.draw.rect(screen, (100, 100, 100), custom_rects_right[name])
-            pygame.draw.rect(screen, (200, 200, 200), custom_rects_right[name], 2)
-            screen.blit(font_button.render(">", True, (255, 255, 255)), (custom_rects_right[name].x + 8, custom_rects_right[name].y + 5))
+            pygame.draw.rect(ui_screen, (100, 100, 100), custom_rects_right[name])
+            pygame.draw.rect(ui_screen, (200, 200, 200), custom_rects_right[name], 2)
+            ui_screen.blit(render_text(font_button, ">", True, (255, 255, 255)), (custom_rects_right[name].x + 8, custom_rects_right[name].y + 5))
 
-        pygame.draw.rect(screen, (50, 150, 50), rect_start_custom)
-        pygame.draw.rect(screen, (200, 200, 200), rect_start_custom, 3)
-        screen.blit(font_button.render("START", True, (255, 255, 255)), 
+        pygame.draw.rect(ui_screen, (50, 150, 50), rect_start_custom)
+        pygame.draw.rect(ui_screen, (200, 200, 200), rect_start_custom, 3)
+        ui_screen.blit(render_text(font_button, "START", True, (255, 255, 255)), 
                    (rect_start_custom.x + (rect_start_custom.width - font_button.size("START")[0])//2, rect_start_custom.y + 10))
+        dirty_renderer.scene("custom", tuple(custom_levels.items()))
 
     elif game_state == "JUMPSCARE":
-        screen.fill((0, 0, 0))
-        frames = jumpscares.get(active_js_bot)
+        stream = jumpscares.get(active_js_bot)
+        frame = js_player.frame(stream) if stream else None
 
-        if frames and js_frame_index < len(frames):
-            screen.blit(frames[js_frame_index][0], (0, 0))
-            js_frame_index += 1
+        if frame:
+            js_player.draw_fullscreen(screen)
+            dirty_renderer.scene("JUMPSCARE", stream)
+            dirty_renderer.mark(js_player.dirty)
         else:
+            screen.fill((0, 0, 0))
+            if stream:
+                stream.release()
             if active_js_bot == "Withered Foxy":
                 game_state = "FOXY_SEQUENCE"
                 foxy_sequence_start = pygame.time.get_ticks()
@@ -2128,43 +4340,39 @@ while running:
                 menu_music_start_time = pygame.time.get_ticks()
                 beat_detector.reset()
 
-        black_surf = pygame.Surface((WIN_W, WIN_H))
-        black_surf.fill((0, 0, 0))
-        black_surf.set_alpha(int(black_screen_alpha))
-        screen.blit(black_surf, (0, 0))
+        draw_fade(screen, black_screen_alpha)
 
     elif game_state == "PUPPET_DANCE":
-        screen.fill((0, 0, 0))
+        frame = js_player.frame(puppet_dance_stream)
 
-        if puppet_dance_frames and js_frame_index < len(puppet_dance_frames):
-            screen.blit(puppet_dance_frames[js_frame_index][0], (0, 0))
-            js_frame_index += 1
+        if frame:
+            js_player.draw_fullscreen(screen)
+            dirty_renderer.scene("PUPPET_DANCE")
+            dirty_renderer.mark(js_player.dirty)
         else:
+            screen.fill((0, 0, 0))
+            puppet_dance_stream.release()
             active_js_bot = "Puppet"
             game_state = "JUMPSCARE"
-            js_frame_index = 0
+            js_player.play()
             stop_all_sounds()
             play_sound(jumpscare_sound)
 
     elif game_state == "SIX_AM_ANIMATION":
-        screen.fill((0, 0, 0))
-
         if not six_am_sound_playing:
             play_sound(six_am_theme)
             six_am_sound_playing = True
 
-        if six_am_frames and six_am_frame_index < len(six_am_frames):
-            now = pygame.time.get_ticks()
-            elapsed = now - six_am_animation_start
-            cum_time = 0
+        if six_am_stream.exists():
+            frame = six_am_player.frame(six_am_stream)
 
-            for i, (surf, dur) in enumerate(six_am_frames):
-                if elapsed < cum_time + dur:
-                    six_am_frame_index = i
-                    screen.blit(surf, (0, 0))
-                    break
-                cum_time += dur
+            if frame:
+                six_am_player.draw_fullscreen(screen)
+                dirty_renderer.scene("SIX_AM_ANIMATION")
+                dirty_renderer.mark(six_am_player.dirty)
             else:
+                screen.fill((0, 0, 0))
+                six_am_stream.release()
                 stop_sound(six_am_theme)
                 if not is_custom_night:
                     current_night = min(6, current_night + 1)
@@ -2177,9 +4385,11 @@ while running:
                 beat_detector.reset()
                 six_am_sound_playing = False
         else:
-            screen.blit(font_main.render("6 AM", True, (255, 255, 255)), (WIN_W//2 - font_main.size("6 AM")[0]//2, WIN_H//2 - 50))
+            screen.fill((0, 0, 0))
+            screen.blit(render_text(font_main, "6 AM", True, (255, 255, 255)), (WIN_W//2 - font_main.size("6 AM")[0]//2, WIN_H//2 - 50))
+            dirty_renderer.scene("SIX_AM_TEXT")
 
-            if pygame.time.get_ticks() - six_am_animation_start >= 3000:
+            if six_am_player.elapsed() >= 3000:
                 stop_sound(six_am_theme)
                 if not is_custom_night:
                     current_night = min(6, current_night + 1)
@@ -2193,13 +4403,19 @@ while running:
                 six_am_sound_playing = False
 
     elif game_state == "GAMEOVER":
-        screen.fill((0, 0, 0))
+        ui_screen.fill((0, 0, 0))
 
-        screen.blit(font_main.render("ВЫ УМЕРЛИ", True, (255, 0, 0)), (WIN_W//2 - font_main.size("ВЫ УМЕРЛИ")[0]//2, WIN_H//2 - 50))
-        press_text = font_button.render("Нажмите любую кнопку для продолжения", True, (255, 255, 255))
-        screen.blit(press_text, (WIN_W//2 - press_text.get_width()//2, WIN_H//2 + 50))
+        ui_screen.blit(render_text(font_main, "ВЫ УМЕРЛИ", True, (255, 0, 0)), (UI_W//2 - font_main.size("ВЫ УМЕРЛИ")[0]//2, UI_H//2 - 50))
+        press_text = render_text(font_button, "Нажмите любую кнопку для продолжения", True, (255, 255, 255))
+        ui_screen.blit(press_text, (UI_W//2 - press_text.get_width()//2, UI_H//2 + 50))
+        dirty_renderer.scene("gameover")
 
-    pygame.display.flip()
+    present_frame(ui_frame)
+    idle_scheduler.account(game_state)
 
+if cpu_report:
+    idle_scheduler.report()
 save_progress()
+asset_loader.shutdown()
+surface_cache.save_index()
 pygame.quit()